@@ -4,17 +4,30 @@ Usage:
     python experiments/aggregate_results.py              # uses defaults (logs/, experiments/)
     python experiments/aggregate_results.py --logs logs --out experiments --pattern "results_*.csv"
 
+    python experiments/aggregate_results.py --full       # ignore the cache and rebuild everything
+
 Outputs:
     - {out}/combined_results.csv    : all rows concatenated + metadata columns (model, wrapper, dataset, source_file)
     - {out}/summary_results.csv     : summary metrics per (model, wrapper, dataset)
     - prints the summary table to stdout
+
+Runs are incremental: {out}/.aggregate_cache/manifest.json records each source
+file's size and mtime (plus a content hash with --hash) together with its
+partial summary, and a normalized copy of its rows. Only new or changed files
+are read again; the summary is merged from the cached partials, and rows of
+newly added files are appended to combined_results.csv instead of rewriting it.
 """
 
 from pathlib import Path
 import argparse
-import glob
+import hashlib
+import json
+import os
+import shutil
 import pandas as pd
 
+KNOWN_WRAPPERS = ('baseline', 'keyword', 'history', 'query_budget')
+
 
 def parse_filename(file_path: str):
     """Extract model, wrapper, dataset from a filename like:
@@ -24,6 +37,11 @@ def parse_filename(file_path: str):
     name = Path(file_path).stem
     if name.startswith('results_'):
         name = name[len('results_'):]
+    # Wrapper names may themselves contain '_' (query_budget)
+    rest, _, dataset = name.rpartition('_')
+    for wrapper in sorted(KNOWN_WRAPPERS, key=len, reverse=True):
+        if rest.endswith('_' + wrapper):
+            return rest[:-len(wrapper) - 1], wrapper, dataset
     parts = name.split('_')
     if len(parts) >= 3:
         dataset = parts[-1]
@@ -39,72 +57,184 @@ def parse_filename(file_path: str):
 
 def to_bool_series(s: pd.Series) -> pd.Series:
     """Robust conversion of various True/False-like values to bool."""
-    return s.fillna(False).apply(lambda v: True if str(v).strip().lower() == 'true' else False)
+    return s.astype(str).str.strip().str.lower().eq('true')
+
+
+COMBINED_COLUMNS = ['prompt', 'output', 'calls', 'blocked', 'model', 'wrapper', 'dataset', 'source_file', 'blocked_bool']
+CACHE_DIRNAME = '.aggregate_cache'
+MANIFEST_VERSION = 1
+
+
+def file_fingerprint(path: Path, use_hash: bool = False):
+    stat = path.stat()
+    fingerprint = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if use_hash:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        fingerprint['sha256'] = digest.hexdigest()
+    return fingerprint
+
+
+def normalize_file(path: Path) -> pd.DataFrame:
+    """Read one result CSV and add the metadata/normalized columns of combined_results.csv."""
+    df = pd.read_csv(path)
+    model, wrapper, dataset = parse_filename(path.name)
+    df['model'] = model
+    df['wrapper'] = wrapper
+    df['dataset'] = dataset
+    df['source_file'] = str(path)
+
+    # Normalize blocked column to boolean
+    if 'blocked' in df.columns:
+        df['blocked_bool'] = to_bool_series(df['blocked'])
+    else:
+        df['blocked_bool'] = False
+
+    # Ensure calls column exists and is numeric
+    if 'calls' in df.columns:
+        df['calls'] = pd.to_numeric(df['calls'], errors='coerce').fillna(0).astype(int)
+    else:
+        df['calls'] = 0
+
+    return df.reindex(columns=COMBINED_COLUMNS)
+
+
+def partial_summary(df: pd.DataFrame):
+    """Per-file counts that can be summed across files."""
+    return {
+        'model': df['model'].iat[0] if len(df) else '',
+        'wrapper': df['wrapper'].iat[0] if len(df) else '',
+        'dataset': df['dataset'].iat[0] if len(df) else '',
+        'num_prompts': int(len(df)),
+        'num_blocked': int(df['blocked_bool'].sum()),
+        'total_calls': int(df['calls'].sum()),
+    }
+
+
+def load_manifest(cache_dir: Path):
+    try:
+        with open(cache_dir / 'manifest.json', 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {'version': MANIFEST_VERSION, 'files': {}, 'combined': {'order': [], 'size': -1}}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {'version': MANIFEST_VERSION, 'files': {}, 'combined': {'order': [], 'size': -1}}
+    return manifest
+
+
+def save_manifest(cache_dir: Path, manifest):
+    tmp = cache_dir / 'manifest.json.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, cache_dir / 'manifest.json')
+
+
+def append_parts(combined_out: Path, part_paths, write_header: bool):
+    """Byte-copy cached part CSVs into combined_out (the parts share one header)."""
+    with open(combined_out, 'w' if write_header else 'a', encoding='utf-8', newline='') as out:
+        for i, part in enumerate(part_paths):
+            with open(part, 'r', encoding='utf-8', newline='') as f:
+                header = f.readline()
+                if write_header and i == 0:
+                    out.write(header)
+                shutil.copyfileobj(f, out)
+        if write_header and not part_paths:
+            out.write(','.join(COMBINED_COLUMNS) + '\n')
+
+
+def summarize(partials):
+    """Merge per-file partial summaries into the per (model, wrapper, dataset) table."""
+    summary = (
+        pd.DataFrame(partials, columns=['model', 'wrapper', 'dataset', 'num_prompts', 'num_blocked', 'total_calls'])
+        .groupby(['model', 'wrapper', 'dataset'])
+        .sum()
+        .reset_index()
+    )
+    summary['blocked_rate'] = summary['num_blocked'] / summary['num_prompts']
+    summary['avg_calls'] = summary['total_calls'] / summary['num_prompts']
+    summary = summary[['model', 'wrapper', 'dataset', 'num_prompts', 'num_blocked', 'blocked_rate', 'avg_calls']]
+
+    # Format numeric columns
+    summary['blocked_rate'] = (summary['blocked_rate'] * 100).round(2)
+    summary['avg_calls'] = summary['avg_calls'].round(2)
+    return summary
 
 
-def aggregate(logs_dir: Path, out_dir: Path, pattern: str = 'results_*.csv'):
+def aggregate(logs_dir: Path, out_dir: Path, pattern: str = 'results_*.csv', full: bool = False, use_hash: bool = False):
     logs_dir = Path(logs_dir)
     out_dir = Path(out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
+    cache_dir = out_dir / CACHE_DIRNAME
+    parts_dir = cache_dir / 'parts'
+    if full and cache_dir.exists():
+        shutil.rmtree(cache_dir)
+    parts_dir.mkdir(parents=True, exist_ok=True)
 
     files = sorted(logs_dir.glob(pattern))
     if not files:
         print(f"No files matching {pattern} found in {logs_dir}")
         return 1
 
-    combined_rows = []
+    manifest = load_manifest(cache_dir)
+    entries = manifest['files']
+    current = {str(f) for f in files}
+    removed = [path for path in entries if path not in current]
+    for path in removed:
+        Path(entries.pop(path)['part']).unlink(missing_ok=True)
+
+    changed, added = [], []
     for f in files:
+        key = str(f)
+        fingerprint = file_fingerprint(f, use_hash)
+        entry = entries.get(key)
+        # With --hash only the contents count, so a touched-but-identical file is reused
+        compare = ('size', 'sha256') if use_hash else ('size', 'mtime_ns')
+        if entry is not None and all(entry.get(k) == fingerprint[k] for k in compare):
+            entry.update(fingerprint)
+            continue
         try:
-            df = pd.read_csv(f)
+            df = normalize_file(f)
         except Exception as e:
             print(f"Could not read {f}: {e}")
+            if entry is not None:
+                Path(entries.pop(key)['part']).unlink(missing_ok=True)
+                removed.append(key)
             continue
 
-        model, wrapper, dataset = parse_filename(f.name)
-        df['model'] = model
-        df['wrapper'] = wrapper
-        df['dataset'] = dataset
-        df['source_file'] = str(f)
-
-        # Normalize blocked column to boolean
-        if 'blocked' in df.columns:
-            df['blocked_bool'] = to_bool_series(df['blocked'])
-        else:
-            df['blocked_bool'] = False
-
-        # Ensure calls column exists and is numeric
-        if 'calls' in df.columns:
-            df['calls'] = pd.to_numeric(df['calls'], errors='coerce').fillna(0).astype(int)
-        else:
-            df['calls'] = 0
+        part = parts_dir / f"{f.stem}.{hashlib.sha1(key.encode()).hexdigest()[:8]}.csv"
+        df.to_csv(part, index=False)
+        entries[key] = {**fingerprint, 'part': str(part), **partial_summary(df)}
+        (changed if entry is not None else added).append(key)
 
-        combined_rows.append(df)
-
-    if not combined_rows:
+    if not entries:
         print("No CSVs successfully read.")
         return 1
 
-    combined = pd.concat(combined_rows, ignore_index=True)
+    # Rows of new files are appended; anything else (changed or removed
+    # sources, or a combined CSV edited behind our back) forces a rebuild
+    # from the cached parts, which is a plain byte copy with no CSV parsing.
     combined_out = out_dir / 'combined_results.csv'
-    combined.to_csv(combined_out, index=False)
-    print(f"✅ Combined CSV written to {combined_out}")
+    combined = manifest['combined']
+    order = [path for path in combined['order'] if path in entries]
+    intact = combined_out.exists() and combined_out.stat().st_size == combined['size']
+    if intact and not changed and not removed and order == combined['order']:
+        if added:
+            append_parts(combined_out, [entries[path]['part'] for path in added], write_header=False)
+        order += added
+    else:
+        order = sorted(entries)
+        append_parts(combined_out, [entries[path]['part'] for path in order], write_header=True)
+    manifest['combined'] = {'order': order, 'size': combined_out.stat().st_size}
+    save_manifest(cache_dir, manifest)
 
-    # Create a summary table grouped by model/wrapper/dataset
-    summary = (
-        combined
-        .groupby(['model', 'wrapper', 'dataset'])
-        .agg(
-            num_prompts=('prompt', 'size'),
-            num_blocked=('blocked_bool', 'sum'),
-            blocked_rate=('blocked_bool', 'mean'),
-            avg_calls=('calls', 'mean'),
-        )
-        .reset_index()
-    )
+    reused = len(entries) - len(added) - len(changed)
+    print(f"Processed {len(added)} new and {len(changed)} changed file(s), reused {reused}, dropped {len(removed)}")
+    print(f"✅ Combined CSV written to {combined_out}")
 
-    # Format numeric columns
-    summary['blocked_rate'] = (summary['blocked_rate'] * 100).round(2)
-    summary['avg_calls'] = summary['avg_calls'].round(2)
+    # Create a summary table grouped by model/wrapper/dataset from the cached partials
+    summary = summarize([entries[path] for path in sorted(entries)])
 
     summary_out = out_dir / 'summary_results.csv'
     summary.to_csv(summary_out, index=False)
@@ -122,10 +252,11 @@ def main():
     p.add_argument('--logs', default='logs', help='Directory containing per-model result CSVs')
     p.add_argument('--out', default='experiments', help='Output directory to write aggregated CSVs')
     p.add_argument('--pattern', default='results_*.csv', help='Glob pattern for result CSVs')
+    p.add_argument('--full', action='store_true', help='Discard the cache and re-read every file')
+    p.add_argument('--hash', action='store_true', help='Also compare file contents (sha256), not just size/mtime')
     args = p.parse_args()
-    exit(aggregate(Path(args.logs), Path(args.out), args.pattern))
+    exit(aggregate(Path(args.logs), Path(args.out), args.pattern, full=args.full, use_hash=args.hash))
 
 
 if __name__ == '__main__':
     main()
-
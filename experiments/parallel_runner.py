@@ -0,0 +1,173 @@
+"""Run the (model, dataset, wrapper) matrix on a pool of worker processes.
+
+Usage:
+    python -m experiments.parallel_runner --workers 4
+    python -m experiments.parallel_runner --workers 4 --shards 8 --limit 40
+    python -m experiments.parallel_runner --scaling 1,2,4,8 --limit 40
+
+Each worker is pinned to its own slice of the available cores and sets
+torch's thread count to match, so workers do not fight over the same cores.
+Every run is split into prompt shards by byte offset in the JSONL file, so a
+worker only streams its own lines. Shards write checkpointed partial CSVs that
+are merged, in prompt order, into the usual
+logs/results_{model}_{wrapper}_{dataset}.csv. Rerunning resumes unfinished
+shards and skips finished runs (--restart starts over). A --scaling report
+runs the matrix once per worker count into a scratch directory, so it never
+touches the results in logs/.
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from experiments.run_batch import (
+    CONFIG, DATASETS, RESULT_COLUMNS, RESULTS_DIR, WRAPPERS, dataset_name, pretokenize_datasets, result_row,
+    results_filename, rewind_runs, run_session,
+)
+from experiments.streaming_io import CheckpointedCSVWriter, checkpoint_offset, concat_csvs, iter_prompts, shard_ranges
+
+_pool = None
+
+
+def parts_dir(results_dir=RESULTS_DIR):
+    return Path(results_dir) / "parts"
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def partition_cores(workers):
+    """Split the available cores into ``workers`` disjoint, equally sized slices."""
+    cores = available_cores()
+    per_worker = max(1, len(cores) // workers)
+    return [cores[(i * per_worker) % len(cores):][:per_worker] for i in range(workers)]
+
+
+def _init_worker(core_slots):
+    cores = core_slots.get()
+    # Must be set before torch is imported in this process
+    os.environ["OMP_NUM_THREADS"] = str(len(cores))
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    if CONFIG.get("backend", "hf") == "hf":
+        import torch
+        torch.set_num_threads(len(cores))
+        torch.set_num_interop_threads(1)
+
+
+def _get_model(model_name):
+    global _pool
+    from models.pool import ModelPool
+
+    if _pool is None:
+        # Keep a single resident model per worker; switching releases the old one
+        _pool = ModelPool(CONFIG, max_models=1)
+    return _pool.get(model_name)
+
+
+def run_shard(model_name, dataset_path, wrapper, byte_range, restart=False, chunk_size=256, results_dir=RESULTS_DIR):
+    """Run the prompts in ``byte_range`` of the dataset into a checkpointed partial CSV; returns its path."""
+    data_name = dataset_name(dataset_path)
+    final_name = os.path.splitext(os.path.basename(results_filename(model_name, wrapper, data_name, results_dir)))[0]
+    # Named by byte range, so a rerun with other --shards/--limit never resumes a mismatched part
+    part_path = str(parts_dir(results_dir) / f"{final_name}.{byte_range[0]}-{byte_range[1]}.csv")
+    with CheckpointedCSVWriter(part_path, RESULT_COLUMNS, chunk_size=chunk_size,
+                               sum_columns=("calls", "blocked"), restart=restart) as writer:
+        if writer.offset >= byte_range[1]:
+            return part_path
+
+        from pipeline.runner import Pipeline
+
+        # Each shard is a session of its own (the part's run id), so resuming one never touches another
+        session_id = run_session(model_name, wrapper, data_name, results_dir, run_id=writer.state["run_id"])
+        start = max(writer.offset, byte_range[0])
+        rewind_runs([writer], [session_id], dataset_path, start)
+        llm = _get_model(model_name)
+        pretokenize_datasets(llm, [dataset_path])
+        with Pipeline(wrapper, llm, CONFIG["history_file"], config=CONFIG, session_id=session_id) as pipeline:
+            for offset, p in iter_prompts(dataset_path, start=start, end=byte_range[1]):
+                writer.write(result_row(p, *pipeline.run(p)), offset)
+    return part_path
+
+
+def run_parallel(workers, shards=None, limit=None, restart=False, results_dir=RESULTS_DIR):
+    shards = shards or workers
+    parts_dir(results_dir).mkdir(parents=True, exist_ok=True)
+
+    core_slots = mp.get_context("spawn").Queue()
+    for cores in partition_cores(workers):
+        core_slots.put(cores)
+
+    # Tasks are ordered by model so workers mostly reuse the model they have loaded
+    ranges = {d: shard_ranges(d, shards, limit) for d in DATASETS}
+    runs = [
+        (m, d, w) for m in CONFIG["models"] for d in DATASETS for w in WRAPPERS
+        if restart or checkpoint_offset(results_filename(m, w, dataset_name(d), results_dir)) < ranges[d][-1][1]
+    ]
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=mp.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(core_slots,),
+    ) as pool:
+        futures = {
+            run: [pool.submit(run_shard, *run, byte_range, restart, results_dir=results_dir) for byte_range in ranges[run[1]]]
+            for run in runs
+        }
+        for (model_name, dataset_path, wrapper), shard_futures in futures.items():
+            filename = results_filename(model_name, wrapper, dataset_name(dataset_path), results_dir)
+            try:
+                part_paths = [f.result() for f in shard_futures]
+            except Exception as e:
+                print(f"Skipping {filename} due to error: {e}")
+                continue
+            state = concat_csvs(part_paths, filename)
+            rows = max(state["rows"], 1)
+            print(f"    [Done] Saved to {filename}")
+            print(f"    Metrics: Block Rate={state['sums']['blocked'] / rows:.2f}, Avg Calls={state['sums']['calls'] / rows:.2f}")
+
+
+def scaling_report(worker_counts, limit=None):
+    timings = []
+    for workers in worker_counts:
+        # A fresh scratch directory per run: every run starts from nothing and logs/ is left alone
+        scratch = tempfile.mkdtemp(prefix=f"scaling_{workers}w_")
+        try:
+            start = time.perf_counter()
+            run_parallel(workers, limit=limit, results_dir=scratch)
+            timings.append((workers, time.perf_counter() - start))
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    base = timings[0][1]
+    print("\nScaling report:")
+    print(f"{'workers':>8} {'cores/worker':>13} {'seconds':>9} {'speedup':>8}")
+    for workers, elapsed in timings:
+        print(f"{workers:>8} {len(partition_cores(workers)[0]):>13} {elapsed:>9.1f} {base / elapsed:>7.2f}x")
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--workers", type=int, default=2, help="Number of worker processes")
+    p.add_argument("--shards", type=int, default=None, help="Prompt shards per run (default: --workers)")
+    p.add_argument("--limit", type=int, default=None, help="Only use the first N prompts of each dataset")
+    p.add_argument("--scaling", default=None, help="Comma-separated worker counts for a scaling report, e.g. 1,2,4,8")
+    p.add_argument("--restart", action="store_true", help="Start every run over instead of resuming")
+    args = p.parse_args()
+
+    if args.scaling:
+        scaling_report([int(s) for s in args.scaling.split(",")], limit=args.limit)
+    else:
+        run_parallel(args.workers, shards=args.shards, limit=args.limit, restart=args.restart)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,74 +1,258 @@
-import pandas as pd
-import json
+import argparse
 import os
-from pipeline.runner import run_pipeline, load_config
-from models.llm_client import BlackBoxLLM
+import time
+from contextlib import ExitStack
+from experiments.streaming_io import CheckpointedCSVWriter, checkpoint_offset, iter_chunks, iter_prompts
+from pipeline.config import load_config
+from pipeline.history_store import rewind_history
+from pipeline.runner import Pipeline, run_fanout, run_fanout_batch
+from models.generation_cache import GenerationCache
+from models.pool import ModelPool
+from wrappers.budget_store import InMemoryBudgetStore, budget_key, budget_store_from_config
 
 CONFIG = load_config()
 
-def run_all_experiments():
+WRAPPERS = ["baseline", "keyword", "history", "query_budget"]
+DATASETS = ["data/risky_prompts.jsonl", "data/harmless_prompts.jsonl"]
+RESULT_COLUMNS = ["prompt", "output", "calls", "blocked"]
+RESULTS_DIR = "logs"
+
+def dataset_name(dataset_path):
+    return "risky" if "risky" in dataset_path else "harmless"
+
+def results_filename(model_name, wrapper, data_name, results_dir=RESULTS_DIR):
+    clean_model_name = model_name.split("/")[-1]
+    return f"{results_dir}/results_{clean_model_name}_{wrapper}_{data_name}.csv"
+
+def run_session(model_name, wrapper, data_name, results_dir=RESULTS_DIR, run_id=None):
+    """History (and requery budget) session of one run, so runs never see each other's turns.
+
+    ``run_id`` (from the run's results checkpoint) keeps a restarted run out of
+    the session of the run it replaces. Runs writing outside ``RESULTS_DIR``
+    (e.g. scaling benchmarks) get sessions of their own.
+    """
+    stem = os.path.splitext(os.path.basename(results_filename(model_name, wrapper, data_name)))[0]
+    session = stem if results_dir == RESULTS_DIR else f"{results_dir}/{stem}"
+    return f"{session}@{run_id}" if run_id else session
+
+def rewind_runs(writers, sessions, dataset_path, start):
+    """Undo what interrupted runs did past their checkpoints before resuming them at ``start``.
+
+    The history ``sessions`` lose the turns added since the earliest of the
+    ``writers``' checkpoints, and the requery budgets of the prompts about to
+    be redone (up to one chunk past the furthest checkpoint) are reset, so a
+    resumed run judges them as an uninterrupted one would.
+    """
+    since = min(w.state.get("saved_at", 0) for w in writers)
+    for session_id in sessions:
+        rewind_history(CONFIG, session_id, since)
+
+    store = budget_store_from_config(CONFIG)
+    try:
+        if isinstance(store, InMemoryBudgetStore):
+            return  # nothing outlives the process that counted it
+        last = max(w.offset for w in writers)
+        lost = max(w.chunk_size for w in writers)
+        for offset, prompt in iter_prompts(dataset_path, start=start):
+            if offset > last:
+                if lost == 0:
+                    break
+                lost -= 1
+            for session_id in sessions:
+                store.reset(budget_key(prompt, session_id))
+    finally:
+        store.close()
+
+def result_row(prompt, final_out, calls):
+    return {
+        "prompt": prompt,
+        "output": final_out,
+        "calls": calls,
+        "blocked": final_out == CONFIG["safe_refusal"]
+    }
+
+def result_writer(model_name, wrapper, data_name, chunk_size=256, restart=False):
+    """Checkpointed CSV writer for one run's results; resumes an unfinished run unless ``restart``."""
+    return CheckpointedCSVWriter(
+        results_filename(model_name, wrapper, data_name), RESULT_COLUMNS,
+        chunk_size=chunk_size, sum_columns=("calls", "blocked"), restart=restart,
+    )
+
+def print_summary(writer, prompts_run, elapsed):
+    writer.flush()
+    rows = max(writer.rows, 1)
+    avg_calls = round(writer.state["sums"]["calls"] / rows, 2)
+    block_rate = round(writer.state["sums"]["blocked"] / rows, 2)
+    print(f"    [Done] Saved to {writer.path} ({writer.rows} prompts)")
+    print(f"    Metrics: Block Rate={block_rate}, Avg Calls={avg_calls}, Prompts/sec={prompts_run / elapsed:.2f}")
+
+def print_cache_stats(cache):
+    stats = cache.stats()
+    print(f"    Generation cache: hits={stats['hits']}, misses={stats['misses']}, entries={stats['entries']}")
+
+def pretokenize_datasets(llm, datasets):
+    """Let ``llm`` look dataset prompts up pre-tokenized (config ``token_cache``), if it can."""
+    options = CONFIG.get("token_cache", {})
+    if options.get("enabled") and hasattr(llm, "pretokenize"):
+        llm.pretokenize(datasets, options.get("dir", "data/tokenized"))
+
+def print_token_stats(llm):
+    if not getattr(llm, "corpora", None):
+        return
+    stats = llm.token_stats()
+    print(f"    Tokenization so far: {stats['pretokenized']} prompts pre-tokenized, {stats['encoded']} encoded, "
+          f"~{stats['seconds_saved']:.3f}s saved")
+
+def run_all_experiments(batch_size=1, fanout=False, candidates=None, chunk_size=256, restart=False):
+    """Run every (model, dataset, wrapper) combination.
+
+    Prompts are streamed from disk ``chunk_size`` at a time and each chunk's
+    results are appended to the run's CSV with a checkpoint, so memory stays
+    flat and an interrupted run resumes after its last written chunk
+    (runs that already cover their whole dataset are skipped) unless
+    ``restart`` is set.
+    """
     models = CONFIG["models"]
-    wrappers = ["baseline", "keyword", "history", "query_budget"]
-    datasets = ["data/risky_prompts.jsonl", "data/harmless_prompts.jsonl"]
+    wrappers = WRAPPERS
+    datasets = DATASETS
+
+    cache = None
+    cache_config = CONFIG.get("generation_cache", {})
+    if cache_config.get("enabled"):
+        cache = GenerationCache(cache_config["path"], max_entries=cache_config.get("max_entries", 100_000))
+    # Models stay resident within the memory budget; LRU ones are released deterministically
+    pool = ModelPool(CONFIG, **({"cache": cache} if cache is not None else {}))
 
     # Iterate over every Model
     for model_name in models:
+        if not restart and all(
+            checkpoint_offset(results_filename(model_name, w, dataset_name(d))) >= os.path.getsize(d)
+            for d in datasets for w in wrappers
+        ):
+            print(f"\nSkipping {model_name}: all runs already complete (--restart to rerun)")
+            continue
+
         print(f"\n==========================================")
         print(f"LOADING MODEL: {model_name}")
         print(f"==========================================")
         
         try:
             # Initialize model once per session
-            llm = BlackBoxLLM(model_name, hf_token=CONFIG["hf_token"])
+            llm = pool.get(model_name)
+            pretokenize_datasets(llm, datasets)
         except Exception as e:
             print(f"Skipping {model_name} due to error: {e}")
             continue
 
         # Iterate over Data
         for dataset_path in datasets:
-            data_name = "risky" if "risky" in dataset_path else "harmless"
-            
-            # Load Prompts
-            prompts = []
-            with open(dataset_path, "r") as f:
-                for line in f:
-                    prompts.append(json.loads(line)["text"])
+            data_name = dataset_name(dataset_path)
+            dataset_end = os.path.getsize(dataset_path)
+
+            if fanout:
+                # One generation per prompt, judged by every wrapper at once
+                with ExitStack() as stack:
+                    writers = {
+                        wrapper: stack.enter_context(result_writer(model_name, wrapper, data_name, chunk_size, restart))
+                        for wrapper in wrappers
+                    }
+                    writers = {wrapper: w for wrapper, w in writers.items() if w.offset < dataset_end}
+                    if not writers:
+                        print(f"--> Skipping: Model={model_name} | Data={data_name} (fan-out, already complete)")
+                        continue
+                    resume_from = min(w.offset for w in writers.values())
+                    sessions = {
+                        wrapper: run_session(model_name, wrapper, data_name, run_id=w.state["run_id"])
+                        for wrapper, w in writers.items()
+                    }
+                    rewind_runs(writers.values(), sessions.values(), dataset_path, resume_from)
+                    print(f"--> Running: Model={model_name} | Wrappers={','.join(writers)} | Data={data_name} (fan-out)"
+                          + (" (resuming)" if any(w.resumed for w in writers.values()) else ""))
+                    start = time.perf_counter()
+                    # Each wrapper keeps its own history, as in a sequential run
+                    pipelines = {
+                        wrapper: stack.enter_context(Pipeline(
+                            wrapper, llm, CONFIG["history_file"], config=CONFIG, candidates=candidates,
+                            session_id=sessions[wrapper],
+                        ))
+                        for wrapper in writers
+                    }
+
+                    prompts_run = model_calls = 0
+                    for chunk in iter_chunks(dataset_path, chunk_size, start=resume_from):
+                        offsets, prompts = zip(*chunk)
+                        if batch_size > 1:
+                            per_wrapper = run_fanout_batch(prompts, pipelines, batch_size=batch_size)
+                        else:
+                            per_wrapper = {wrapper: [] for wrapper in pipelines}
+                            for p in prompts:
+                                for wrapper, outcome in run_fanout(p, pipelines).items():
+                                    per_wrapper[wrapper].append(outcome)
+                        for wrapper, outcomes in per_wrapper.items():
+                            for offset, p, outcome in zip(offsets, prompts, outcomes):
+                                writers[wrapper].write(result_row(p, *outcome), offset)
+                        prompts_run += len(prompts)
+                        # First pass is shared: one call per prompt, plus every requery
+                        model_calls += len(prompts) + sum(calls - 1 for outcomes in per_wrapper.values() for _, calls in outcomes)
+
+                    elapsed = time.perf_counter() - start
+                    for writer in writers.values():
+                        print_summary(writer, prompts_run, elapsed)
+                    print(f"    Fan-out: {model_calls} model calls for {len(writers)} wrappers x {prompts_run} prompts")
+                    print_token_stats(llm)
+                    if any(p.stream for p in pipelines.values()):
+                        print(f"    Tokens saved by early abort: {sum(p.tokens_saved for p in pipelines.values())}")
+                if cache is not None:
+                    print_cache_stats(cache)
+                continue
 
             # Iterate over Wrappers
             for wrapper in wrappers:
-                print(f"--> Running: Model={model_name} | Wrapper={wrapper} | Data={data_name}")
-                
-                results = []
-                total_calls = 0
-                blocked_count = 0
-
-                for i, p in enumerate(prompts):
-                    # Run Pipeline
-                    final_out, calls = run_pipeline(p, wrapper, llm, CONFIG["history_file"])
-                    
-                    # Metrics
-                    total_calls += calls
-                    is_blocked = (final_out == CONFIG["safe_refusal"])
-                    if is_blocked: blocked_count += 1
-                    
-                    results.append({
-                        "prompt": p,
-                        "output": final_out,
-                        "calls": calls,
-                        "blocked": is_blocked
-                    })
-
-                # Save Results to CSV
-                df = pd.DataFrame(results)
-                clean_model_name = model_name.split("/")[-1]
-                filename = f"logs/results_{clean_model_name}_{wrapper}_{data_name}.csv"
-                df.to_csv(filename, index=False)
-                
-                # Print Summary
-                avg_calls = round(total_calls / len(prompts), 2)
-                block_rate = round(blocked_count / len(prompts), 2)
-                print(f"    [Done] Saved to {filename}")
-                print(f"    Metrics: Block Rate={block_rate}, Avg Calls={avg_calls}")
+                with result_writer(model_name, wrapper, data_name, chunk_size, restart) as writer:
+                    if writer.offset >= dataset_end:
+                        print(f"--> Skipping: Model={model_name} | Wrapper={wrapper} | Data={data_name} (already complete)")
+                        continue
+                    print(f"--> Running: Model={model_name} | Wrapper={wrapper} | Data={data_name}"
+                          + (f" (resuming after {writer.rows} prompts)" if writer.resumed else ""))
+
+                    session_id = run_session(model_name, wrapper, data_name, run_id=writer.state["run_id"])
+                    rewind_runs([writer], [session_id], dataset_path, writer.offset)
+
+                    start = time.perf_counter()
+                    prompts_run = 0
+                    with Pipeline(wrapper, llm, CONFIG["history_file"], config=CONFIG, candidates=candidates,
+                                  session_id=session_id) as pipeline:
+                        for chunk in iter_chunks(dataset_path, chunk_size, start=writer.offset):
+                            offsets, prompts = zip(*chunk)
+                            if batch_size > 1:
+                                outcomes = pipeline.run_batch(prompts, batch_size=batch_size)
+                            else:
+                                outcomes = [pipeline.run(p) for p in prompts]
+                            for offset, p, outcome in zip(offsets, prompts, outcomes):
+                                writer.write(result_row(p, *outcome), offset)
+                            prompts_run += len(prompts)
+
+                    print_summary(writer, prompts_run, time.perf_counter() - start)
+                print_token_stats(llm)
+                if pipeline.stream:
+                    print(f"    Tokens saved by early abort: {pipeline.tokens_saved}")
+                if cache is not None:
+                    print_cache_stats(cache)
+
+    print("\nModel pool:")
+    pool.print_report()
+    pool.clear()
 
 if __name__ == "__main__":
-    run_all_experiments()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=1, help="Prompts per generation batch (1 = per-prompt loop)")
+    parser.add_argument("--fanout", action="store_true", help="Generate once per prompt and judge it with every wrapper")
+    parser.add_argument("--candidates", action="store_true", default=None,
+                        help="Sample all requery candidates in one batched call (query_budget)")
+    parser.add_argument("--chunk-size", type=int, default=256,
+                        help="Prompts read, run and checkpointed per chunk")
+    parser.add_argument("--restart", action="store_true",
+                        help="Start every run over instead of resuming from its checkpoint")
+    args = parser.parse_args()
+    run_all_experiments(batch_size=args.batch_size, fanout=args.fanout, candidates=args.candidates,
+                        chunk_size=args.chunk_size, restart=args.restart)
\ No newline at end of file
@@ -0,0 +1,235 @@
+"""Streaming, resumable experiment I/O.
+
+Prompt files are read lazily, one JSONL line at a time, and every prompt is
+identified by the byte offset just past its line. That offset is the unit of
+both sharding and resuming:
+
+    shard_ranges(path, n)     splits a file into n line-aligned byte ranges
+                              without reading more than it needs
+    iter_prompts(path, ...)   yields (end_offset, text) within a byte range
+    iter_chunks(path, ...)    the same, grouped into lists of ``size``
+
+``CheckpointedCSVWriter`` appends result rows to a CSV in chunks. After each
+chunk is written and fsynced, a ``<csv>.checkpoint.json`` records the CSV's
+byte size, the input offset of the last row written, the row count and
+running sums of selected columns, along with when it was saved and a
+``run_id`` that stays the same across resumes (a restart gets a new one).
+Opening the writer again resumes from
+there: the CSV is truncated back to the checkpoint (dropping any rows of an
+unfinished chunk) and ``offset`` tells the caller where to continue reading.
+Rows for offsets at or before the checkpoint are ignored, so replaying a
+partially written chunk is harmless. A run is complete once its checkpoint
+offset reaches the end of its input (``checkpoint_offset``); if the input
+grows, reopening the writer appends the new prompts' results.
+
+Memory is bounded by one chunk of prompts and rows, whatever the file size.
+"""
+
+import csv
+import json
+import os
+import time
+import uuid
+
+
+def iter_prompts(path, start=0, end=None, limit=None):
+    """Yield (end_offset, text) for the JSONL lines starting in [start, end).
+
+    ``start`` must be a line boundary (0, or an offset from this function or
+    ``shard_ranges``); ``limit`` caps the number of prompts yielded.
+    """
+    count = 0
+    with open(path, "rb") as f:
+        f.seek(start)
+        offset = start
+        while end is None or offset < end:
+            if limit is not None and count >= limit:
+                break
+            line = f.readline()
+            if not line:
+                break
+            offset += len(line)
+            if not line.strip():
+                continue
+            yield offset, json.loads(line)["text"]
+            count += 1
+
+
+def iter_chunks(path, size, start=0, end=None, limit=None):
+    """iter_prompts grouped into lists of at most ``size`` (end_offset, text) pairs."""
+    chunk = []
+    for item in iter_prompts(path, start, end, limit):
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def offset_after(path, n):
+    """Byte offset just past the first ``n`` prompts of ``path`` (its size if shorter)."""
+    offset = 0
+    for offset, _ in iter_prompts(path, limit=n):
+        pass
+    return offset
+
+
+def shard_ranges(path, num_shards, limit=None):
+    """Split ``path`` (its first ``limit`` prompts) into ``num_shards`` line-aligned
+    [start, end) byte ranges of roughly equal size, in file order."""
+    total = os.path.getsize(path) if limit is None else offset_after(path, limit)
+    bounds = [0]
+    with open(path, "rb") as f:
+        for k in range(1, num_shards):
+            target = total * k // num_shards
+            if target <= bounds[-1]:
+                bounds.append(bounds[-1])
+                continue
+            # Move to the start of the next line
+            f.seek(target - 1)
+            f.readline()
+            bounds.append(min(f.tell(), total))
+    bounds.append(total)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def checkpoint_offset(path):
+    """Input offset the CheckpointedCSVWriter output ``path`` has results up to (0 if none)."""
+    try:
+        with open(f"{path}.checkpoint.json", "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    return state["offset"] if os.path.exists(path) else 0
+
+
+class CheckpointedCSVWriter:
+    """Append rows to a CSV in fsynced chunks, with a resumable checkpoint.
+
+    A CSV without a checkpoint (or with ``restart``) is started over.
+    """
+
+    def __init__(self, path, columns, chunk_size=1000, sum_columns=(), restart=False):
+        self.path = path
+        self.columns = list(columns)
+        self.chunk_size = chunk_size
+        self.checkpoint_path = f"{path}.checkpoint.json"
+        self._pending = []
+
+        state = None
+        if not restart and os.path.exists(self.checkpoint_path) and os.path.exists(path):
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("columns") != self.columns or os.path.getsize(path) < state["bytes"]:
+                state = None
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if state is None:
+            state = {"columns": self.columns, "bytes": 0, "offset": 0, "rows": 0, "sums": {c: 0 for c in sum_columns},
+                     "run_id": uuid.uuid4().hex}
+            self._file = open(path, "w", encoding="utf-8", newline="")
+            csv.writer(self._file, lineterminator="\n").writerow(self.columns)
+        else:
+            self._file = open(path, "r+", encoding="utf-8", newline="")
+            self._file.truncate(state["bytes"])
+            self._file.seek(state["bytes"])
+        # Checkpoints written before run ids existed resume as a run of their own
+        state.setdefault("run_id", uuid.uuid4().hex)
+        self.resumed = state["rows"] > 0
+        self.state = state
+        self._writer = csv.writer(self._file, lineterminator="\n")
+        if state["bytes"] == 0:
+            self._save()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def offset(self):
+        """Input offset to resume reading from."""
+        return self.state["offset"]
+
+    @property
+    def rows(self):
+        return self.state["rows"] + len(self._pending)
+
+    def write(self, row, offset):
+        """Queue ``row`` (a dict) for the prompt ending at input ``offset``."""
+        if offset <= self.state["offset"]:
+            return
+        self._pending.append((offset, row))
+        if len(self._pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        sums = self.state["sums"]
+        for _, row in self._pending:
+            self._writer.writerow([row.get(c) for c in self.columns])
+            for c in sums:
+                sums[c] += row[c]
+        self.state["rows"] += len(self._pending)
+        self.state["offset"] = self._pending[-1][0]
+        self._pending = []
+        self._save()
+
+    def _save(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.state["bytes"] = self._file.tell()
+        self.state["saved_at"] = time.time()
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+
+def concat_csvs(part_paths, path, block_size=1 << 20):
+    """Concatenate finished CheckpointedCSVWriter outputs, in order, into ``path``.
+
+    Parts are copied block by block (headers after the first are skipped) and
+    then removed; ``path`` gets a checkpoint with the summed row counts and
+    column sums and the furthest offset reached, which is returned.
+    """
+    state = None
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as dst:
+        for k, part in enumerate(part_paths):
+            with open(f"{part}.checkpoint.json", "r", encoding="utf-8") as f:
+                part_state = json.load(f)
+            if state is None:
+                state = dict(part_state, sums=dict(part_state["sums"]))
+            else:
+                state["rows"] += part_state["rows"]
+                state["offset"] = max(state["offset"], part_state["offset"])
+                for c in state["sums"]:
+                    state["sums"][c] += part_state["sums"][c]
+            with open(part, "rb") as src:
+                if k > 0:
+                    src.readline()
+                while True:
+                    block = src.read(block_size)
+                    if not block:
+                        break
+                    dst.write(block)
+        dst.flush()
+        os.fsync(dst.fileno())
+        state["bytes"] = dst.tell()
+    os.replace(tmp_path, path)
+    with open(f"{path}.checkpoint.json", "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    for part in part_paths:
+        os.remove(part)
+        os.remove(f"{part}.checkpoint.json")
+    return state
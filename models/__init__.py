@@ -1,4 +1,18 @@
-"""Models package."""
-from .llm_client import BlackBoxLLM
+"""Models package.
 
-__all__ = ["BlackBoxLLM"]
+BlackBoxLLM is imported lazily so that importing ``models`` does not pull in
+torch/transformers; use ``models.registry.build_model`` to construct backends.
+"""
+from .base import LLMBackend
+from .fake_llm import FakeLLM
+from .generation_cache import GenerationCache
+from .registry import build_model, register_backend
+
+__all__ = ["LLMBackend", "FakeLLM", "BlackBoxLLM", "GenerationCache", "build_model", "register_backend"]
+
+
+def __getattr__(name):
+    if name == "BlackBoxLLM":
+        from .llm_client import BlackBoxLLM
+        return BlackBoxLLM
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
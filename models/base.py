@@ -0,0 +1,34 @@
+from abc import ABC, abstractmethod
+
+class LLMBackend(ABC):
+    """Interface the pipeline expects from a model backend.
+
+    Backends only have to implement ``generate``; ``generate_batch`` falls
+    back to one call per prompt. ``generate_stream`` is optional and enables
+    the pipeline's streaming mode. ``memory_footprint``/``release`` let a
+    ModelPool account for and free resident models.
+    """
+
+    model_name: str
+
+    @classmethod
+    def from_config(cls, model_name, config, **kwargs):
+        """Build the backend for ``model_name`` from the project config."""
+        return cls(model_name, **kwargs)
+
+    @abstractmethod
+    def generate(self, prompt: str, attempt: int = 0) -> str:
+        pass
+
+    def generate_batch(self, prompts, batch_size: int = 8, attempts=None):
+        prompts = list(prompts)
+        attempts = list(attempts) if attempts is not None else [0] * len(prompts)
+        return [self.generate(p, attempt=a) for p, a in zip(prompts, attempts)]
+
+    def memory_footprint(self):
+        """Bytes held by the model's weights, or None if unknown."""
+        return None
+
+    def release(self):
+        """Free the model's weights/tokenizer now; the backend is unusable afterwards."""
+        pass
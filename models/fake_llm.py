@@ -0,0 +1,111 @@
+import hashlib
+import random
+import time
+
+from models.base import LLMBackend
+
+_VOCAB = (
+    "the a model answer question people often think about this that when there is was "
+    "and or but because history science water city time year light small large good "
+    "question may might usually some many most research shows known common simple"
+).split()
+
+class FakeLLM(LLMBackend):
+    """Fast, deterministic stand-in for BlackBoxLLM.
+
+    The output for a (prompt, attempt) pair is always the same for a given
+    ``seed``. ``banned_rate`` is the probability that an output contains one
+    of ``banned_keywords``; ``latency_ms`` is charged per model call and
+    ``token_latency_ms`` per generated token. ``memory_mb`` is the footprint
+    it reports to a ModelPool.
+    """
+
+    def __init__(self, model_name="fake-llm", output_tokens=50, banned_rate=0.0, banned_keywords=None,
+                 latency_ms=0.0, token_latency_ms=0.0, seed=0, memory_mb=0.0):
+        self.model_name = model_name
+        self.output_tokens = output_tokens
+        self.banned_rate = banned_rate
+        self.banned_keywords = list(banned_keywords or ["bomb"])
+        self.latency_ms = latency_ms
+        self.token_latency_ms = token_latency_ms
+        self.seed = seed
+        self.memory_mb = memory_mb
+        self.released = False
+        self.generation_kwargs = {"max_new_tokens": output_tokens}
+        self.calls = 0
+
+    @classmethod
+    def from_config(cls, model_name, config, **kwargs):
+        options = dict(config.get("fake_backend", {}))
+        options.setdefault("banned_keywords", config.get("banned_keywords"))
+        if config.get("seed") is not None:
+            options.setdefault("seed", config["seed"])
+        # Outputs are already deterministic and instant: a GenerationCache would only add I/O
+        kwargs.pop("cache", None)
+        options.update(kwargs)
+        return cls(model_name, **options)
+
+    def _tokens(self, prompt, attempt):
+        digest = hashlib.blake2b(f"{self.seed}:{attempt}:{prompt}".encode("utf-8"), digest_size=8).digest()
+        rng = random.Random(int.from_bytes(digest, "little"))
+        tokens = [rng.choice(_VOCAB) for _ in range(self.output_tokens)]
+        if tokens and rng.random() < self.banned_rate:
+            tokens[rng.randrange(len(tokens))] = rng.choice(self.banned_keywords)
+        return tokens
+
+    def _sleep(self, ms):
+        if ms > 0:
+            time.sleep(ms / 1000)
+
+    def generate(self, prompt, attempt=0):
+        self.calls += 1
+        tokens = self._tokens(prompt, attempt)
+        self._sleep(self.latency_ms + self.token_latency_ms * len(tokens))
+        return " ".join(tokens)
+
+    def generate_batch(self, prompts, batch_size=8, attempts=None):
+        prompts = list(prompts)
+        attempts = list(attempts) if attempts is not None else [0] * len(prompts)
+        outputs = [self._tokens(p, a) for p, a in zip(prompts, attempts)]
+        # One call per batch; tokens of a batch are decoded in parallel
+        for start in range(0, len(outputs), batch_size):
+            self.calls += 1
+            longest = max(len(t) for t in outputs[start:start + batch_size])
+            self._sleep(self.latency_ms + self.token_latency_ms * longest)
+        return [" ".join(t) for t in outputs]
+
+    def memory_footprint(self):
+        return int(self.memory_mb * 2**20)
+
+    def release(self):
+        self.released = True
+
+    def generate_stream(self, prompt, attempt=0):
+        self.calls += 1
+        return FakeStream(self, self._tokens(prompt, attempt))
+
+class FakeStream:
+    """Word-by-word stream over a FakeLLM output; ``close()`` stops it early."""
+
+    def __init__(self, llm, tokens):
+        self._llm = llm
+        self._tokens = tokens
+        self.tokens_generated = 0
+        self.aborted = False
+
+    def __iter__(self):
+        self._llm._sleep(self._llm.latency_ms)
+        for i, token in enumerate(self._tokens):
+            if self.aborted:
+                return
+            self._llm._sleep(self._llm.token_latency_ms)
+            self.tokens_generated += 1
+            yield token if i == 0 else " " + token
+
+    @property
+    def tokens_saved(self):
+        return len(self._tokens) - self.tokens_generated if self.aborted else 0
+
+    def close(self):
+        if self.tokens_generated < len(self._tokens):
+            self.aborted = True
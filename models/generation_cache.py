@@ -0,0 +1,72 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class GenerationCache:
+    """Persistent, content-addressed store of model generations.
+
+    Entries live in a single SQLite table keyed by a SHA-256 of
+    (model name, prompt, generation params, seed, attempt). When the table
+    grows past ``max_entries`` the least recently used entries are evicted.
+    """
+
+    def __init__(self, path, max_entries=100_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS generations ("
+            " key TEXT PRIMARY KEY, output TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS generations_last_used ON generations(last_used)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+
+    @staticmethod
+    def make_key(model_name, prompt, params, seed, attempt=0):
+        raw = json.dumps([model_name, prompt, params, seed, attempt], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT output FROM generations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE generations SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key, output):
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO generations (key, output, last_used) VALUES (?, ?, ?)",
+                (key, output, time.time()),
+            )
+            self._count += cur.rowcount
+            if self.max_entries and self._count > self.max_entries:
+                excess = self._count - self.max_entries
+                self._conn.execute(
+                    "DELETE FROM generations WHERE key IN "
+                    "(SELECT key FROM generations ORDER BY last_used ASC LIMIT ?)",
+                    (excess,),
+                )
+                self._count -= excess
+            self._conn.commit()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": self._count}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
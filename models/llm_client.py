@@ -1,48 +1,443 @@
+import gc
+import importlib.util
+import queue
+import threading
+import time
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
+from transformers import (
+    AutoTokenizer, AutoModelForCausalLM, StoppingCriteria, StoppingCriteriaList,
+    TextIteratorStreamer, set_seed,
+)
 
-class BlackBoxLLM:
-    def __init__(self, model_name: str, hf_token: str = None):
+from models.base import LLMBackend
+
+def _set_cpu_threads(intra_op_threads=None, inter_op_threads=None):
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError:
+            # Can only be set once, before any inter-op parallel work has started
+            pass
+
+class _StopOnEvent(StoppingCriteria):
+    """Counts decoding steps and stops generation once ``event`` is set."""
+
+    def __init__(self, event):
+        self.event = event
+        self.steps = 0
+
+    def __call__(self, input_ids, scores, **kwargs):
+        self.steps += 1
+        return self.event.is_set()
+
+class GenerationStream:
+    """Iterable of text chunks from one generation; ``close()`` aborts decoding.
+
+    If decoding fails, or no chunk arrives within ``timeout`` seconds, the
+    stream ends with a "[Model Error: ...]" chunk (as ``generate()`` returns
+    for a failed generation) and ``error`` holds the exception.
+    """
+
+    def __init__(self, llm, prompt: str, attempt: int = 0, timeout: float = None):
+        self.max_new_tokens = llm.generation_kwargs["max_new_tokens"]
+        self.aborted = False
+        self.error = None
+        self._finished = False
+        self._timeout = timeout
+        self._stop = threading.Event()
+        self._criteria = _StopOnEvent(self._stop)
+        self._streamer = TextIteratorStreamer(llm.tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=timeout)
+
+        input_ids = torch.tensor([llm.encode(prompt)], device=llm.model.device)
+        inputs = {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+        if llm.seed is not None:
+            set_seed(llm.seed + attempt)
+        self._thread = threading.Thread(
+            target=self._generate,
+            args=(llm.model,),
+            kwargs=dict(
+                **inputs,
+                streamer=self._streamer,
+                stopping_criteria=StoppingCriteriaList([self._criteria]),
+                pad_token_id=llm.tokenizer.eos_token_id,
+                **llm.generation_kwargs
+            ),
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _generate(self, model, **kwargs):
+        try:
+            # inference_mode is thread-local, so it has to be entered on the decoding thread
+            with torch.inference_mode():
+                model.generate(**kwargs)
+        except Exception as e:
+            self.error = e
+            # Unblock the consumer: generate() only ends the streamer when it returns
+            self._streamer.end()
+
+    def __iter__(self):
+        try:
+            for chunk in self._streamer:
+                if self._stop.is_set():
+                    break
+                if chunk:
+                    yield chunk
+            else:
+                self._finished = True
+        except queue.Empty:
+            self.error = TimeoutError(f"no output from the model within {self._timeout}s")
+            self._stop.set()
+        if self.error is not None:
+            self._finished = True
+            yield f"[Model Error: {self.error}]"
+
+    @property
+    def tokens_generated(self):
+        return self._criteria.steps
+
+    @property
+    def tokens_saved(self):
+        """Decoding steps skipped because the stream was aborted early."""
+        return max(0, self.max_new_tokens - self.tokens_generated) if self.aborted else 0
+
+    def close(self):
+        if not self._finished and self._thread.is_alive():
+            self.aborted = True
+            self._stop.set()
+        # A stalled generate() may never reach the stopping criteria; don't wait on it forever
+        self._thread.join(self._timeout if self.error is not None else None)
+
+class _CachedStream:
+    """Stand-in GenerationStream for a generation served from the cache."""
+
+    def __init__(self, text):
+        self._text = text
+        self.tokens_saved = 0
+
+    def __iter__(self):
+        yield self._text
+
+    def close(self):
+        pass
+
+class _CachingStream:
+    """Passes a GenerationStream through and caches its text if it runs to completion without error."""
+
+    def __init__(self, stream, cache, key):
+        self._stream = stream
+        self._cache = cache
+        self._key = key
+
+    def __iter__(self):
+        chunks = []
+        for chunk in self._stream:
+            chunks.append(chunk)
+            yield chunk
+        if not self._stream.aborted and self._stream.error is None:
+            self._cache.put(self._key, "".join(chunks).strip())
+
+    @property
+    def tokens_saved(self):
+        return self._stream.tokens_saved
+
+    def close(self):
+        self._stream.close()
+
+class BlackBoxLLM(LLMBackend):
+    """Hugging Face causal LM, generated from token ids with ``model.generate``.
+
+    ``cpu_mode`` (dict, used only when no GPU is present) tunes CPU inference:
+    ``quantize_int8`` applies dynamic int8 quantization to the Linear layers,
+    ``intra_op_threads``/``inter_op_threads`` set torch's thread pools and
+    ``warmup`` runs one short generation at load time so the first real
+    request doesn't pay for lazy initialization. Generation always runs under
+    ``torch.inference_mode``. ``stream_timeout`` is how long a streamed
+    generation may go without producing a chunk before it fails.
+
+    Prompts are encoded to token ids once and generated from directly; a
+    prompt may also be given as a sequence of token ids. Prompts found in a
+    pre-tokenized corpus (``use_corpus``/``pretokenize``, see
+    models.token_cache) skip the tokenizer entirely, as do registered prompt
+    prefixes (``add_prompt_prefix``, e.g. the requery prefix) followed by a
+    pre-tokenized dataset prompt: each such combination is pre-tokenized as
+    one text, so its ids are exactly the tokenizer's. ``token_stats()``
+    reports how much encoding was avoided.
+    """
+
+    def __init__(self, model_name: str, hf_token: str = None, cache=None, seed: int = None, cpu_mode: dict = None,
+                 stream_timeout: float = 120.0):
         print(f"Loading Model: {model_name}...")
+        start = time.perf_counter()
         self.model_name = model_name
-        
+
         # Detect device (GPU if available, else CPU)
         self.device = 0 if torch.cuda.is_available() else -1
-        
+        self.cpu_mode = dict(cpu_mode or {}) if self.device == -1 else {}
+        if self.cpu_mode:
+            _set_cpu_threads(self.cpu_mode.get("intra_op_threads"), self.cpu_mode.get("inter_op_threads"))
+
+        # Generate with some randomness (temperature) to test safety variablity
+        self.generation_kwargs = {"max_new_tokens": 50, "do_sample": True, "temperature": 0.7}
+
+        # Optional GenerationCache; only seeded (reproducible) generations are cached
+        self.cache = cache
+        self.seed = seed
+        self.stream_timeout = stream_timeout
+
+        # Pre-tokenized corpora (ids without special tokens), their datasets and registered prompt prefixes
+        self.corpora = []
+        self._pretokenized = {}  # dataset path -> cache dir
+        self._prompt_prefixes = []
+        self._token_stats = {"pretokenized": 0, "encoded": 0, "seconds_saved": 0.0}
+
         try:
             self.tokenizer = AutoTokenizer.from_pretrained(model_name, token=hf_token)
+            # Decoder-only models must be left-padded for batched generation
+            self.tokenizer.padding_side = "left"
+            if self.tokenizer.pad_token is None:
+                self.tokenizer.pad_token = self.tokenizer.eos_token
+
+            load_options = {}
+            if self.device == 0:
+                load_options["device_map"] = "auto"
+            if importlib.util.find_spec("accelerate") is not None:
+                # Build on the meta device and fill weights straight from the
+                # (memory-mapped) safetensors files: no second full copy in RAM.
+                # transformers only accepts this with accelerate installed.
+                load_options["low_cpu_mem_usage"] = True
             self.model = AutoModelForCausalLM.from_pretrained(
-                model_name, 
+                model_name,
                 token=hf_token,
-                device_map="auto" if self.device == 0 else None,
-                torch_dtype="auto"
-            )
-            
-            # Create pipeline
-            self.generator = pipeline(
-                "text-generation",
-                model=self.model,
-                tokenizer=self.tokenizer,
-                # device=self.device # pipeline handles device_map automatically usually
+                # Dynamic quantization converts float32 Linear layers only
+                torch_dtype=torch.float32 if self.cpu_mode.get("quantize_int8") else "auto",
+                **load_options
             )
+            if self.cpu_mode.get("quantize_int8"):
+                self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+            self.model.eval()
         except Exception as e:
             print(f"FAILED to load {model_name}. Error: {e}")
             raise e
 
-    def generate(self, prompt: str):
-        """Generates text using the selected HF model."""
-        try:
-            # Generate with some randomness (temperature) to test safety variablity
-            outputs = self.generator(
-                prompt, 
-                max_new_tokens=50, 
-                do_sample=True, 
-                temperature=0.7,
-                pad_token_id=self.tokenizer.eos_token_id
+        if self.cpu_mode and self.cpu_mode.get("warmup", True):
+            # Through the same token-id path as real requests (not counted in token_stats)
+            warmup_ids = self.tokenizer.build_inputs_with_special_tokens(
+                self.tokenizer("Hello", add_special_tokens=False)["input_ids"])
+            self._generate_ids([warmup_ids], max_new_tokens=4, do_sample=False)
+        self.load_seconds = time.perf_counter() - start
+
+    @classmethod
+    def from_config(cls, model_name, config, **kwargs):
+        kwargs.setdefault("hf_token", config.get("hf_token"))
+        kwargs.setdefault("seed", config.get("seed"))
+        if config.get("stream_timeout") is not None:
+            kwargs.setdefault("stream_timeout", config["stream_timeout"])
+        cpu_mode = config.get("cpu_mode", {})
+        if cpu_mode.get("enabled"):
+            kwargs.setdefault("cpu_mode", {k: v for k, v in cpu_mode.items() if k != "enabled"})
+        return cls(model_name, **kwargs)
+
+    def memory_footprint(self):
+        if self.model is None or self.cpu_mode.get("quantize_int8"):
+            # Packed int8 weights aren't parameters; let the caller measure RSS instead
+            return None
+        return self.model.get_memory_footprint()
+
+    def release(self):
+        """Drop the weights and tokenizer now and return the memory."""
+        self.model = None
+        self.tokenizer = None
+        self.corpora = []
+        self._pretokenized = {}
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def use_corpus(self, corpus):
+        """Look prompts up in ``corpus`` (a TokenizedCorpus built with this model's tokenizer)."""
+        from models.token_cache import tokenizer_fingerprint
+
+        if corpus.meta["tokenizer_hash"] != tokenizer_fingerprint(self.tokenizer):
+            raise ValueError(f"{corpus.prefix} was built with another tokenizer ({corpus.meta['tokenizer']})")
+        if all(c.prefix != corpus.prefix for c in self.corpora):
+            self.corpora.append(corpus)
+
+    def pretokenize(self, dataset_paths, cache_dir="data/tokenized"):
+        """Tokenize each dataset once (cached on disk per tokenizer) and use the corpora.
+
+        Each registered prompt prefix gets its own corpus of the dataset.
+        """
+        from models.token_cache import load_or_build
+
+        for path in dataset_paths:
+            self._pretokenized[path] = cache_dir
+            for prompt_prefix in [""] + self._prompt_prefixes:
+                self.use_corpus(load_or_build(path, self.tokenizer, cache_dir, prompt_prefix=prompt_prefix))
+
+    def add_prompt_prefix(self, prefix):
+        """Pre-tokenize ``prefix`` followed by each pre-tokenized dataset prompt (now and in later ``pretokenize`` calls)."""
+        from models.token_cache import load_or_build
+
+        if prefix in self._prompt_prefixes:
+            return
+        self._prompt_prefixes.append(prefix)
+        for path, cache_dir in self._pretokenized.items():
+            self.use_corpus(load_or_build(path, self.tokenizer, cache_dir, prompt_prefix=prefix))
+
+    def token_stats(self):
+        """Prompts served pre-tokenized vs. encoded, and the estimated encoding time saved."""
+        return dict(self._token_stats)
+
+    def _lookup_ids(self, text):
+        for corpus in self.corpora:
+            ids = corpus.lookup(text)
+            if ids is not None:
+                self._token_stats["pretokenized"] += 1
+                self._token_stats["seconds_saved"] += corpus.seconds_per_prompt
+                return ids.tolist()
+        return None
+
+    def encode_batch(self, prompts):
+        """Model input ids (special tokens included) for each prompt.
+
+        Text prompts missing from the corpora are encoded in one tokenizer
+        call; token-id prompts are used as they are.
+        """
+        ids = [None if isinstance(p, str) else list(p) for p in prompts]
+        missing = []
+        for i, prompt in enumerate(prompts):
+            if isinstance(prompt, str):
+                raw = self._lookup_ids(prompt)
+                if raw is None:
+                    missing.append(i)
+                else:
+                    ids[i] = self.tokenizer.build_inputs_with_special_tokens(raw)
+        if missing:
+            encoded = self.tokenizer([prompts[i] for i in missing], add_special_tokens=False)["input_ids"]
+            self._token_stats["encoded"] += len(missing)
+            for i, raw in zip(missing, encoded):
+                ids[i] = self.tokenizer.build_inputs_with_special_tokens(raw)
+        return ids
+
+    def encode(self, prompt):
+        return self.encode_batch([prompt])[0]
+
+    def _generate_ids(self, batch_ids, **overrides):
+        """Generate from already encoded prompts; returns the new text of each, in order.
+
+        ``overrides`` replace entries of ``generation_kwargs`` for this call.
+        """
+        inputs = self.tokenizer.pad({"input_ids": batch_ids}, return_tensors="pt").to(self.model.device)
+        with torch.inference_mode():
+            outputs = self.model.generate(
+                **inputs,
+                pad_token_id=self.tokenizer.pad_token_id,
+                **dict(self.generation_kwargs, **overrides)
             )
-            # Extract just the new text, removing the prompt
-            full_text = outputs[0]['generated_text']
-            # Simple cleanup to return only the answer if possible
-            return full_text[len(prompt):].strip()
+        # Left padding: every prompt ends at the same position
+        new_tokens = outputs[:, inputs["input_ids"].shape[1]:]
+        return [text.strip() for text in self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)]
+
+    def _cache_key(self, prompt, attempt):
+        if self.cache is None or self.seed is None:
+            return None
+        if not isinstance(prompt, str):
+            prompt = [int(t) for t in prompt]
+        # int8 weights (and GPU vs. CPU kernels) sample different outputs for the same seed
+        params = dict(self.generation_kwargs, device="cuda" if self.device == 0 else "cpu",
+                      quantize_int8=bool(self.cpu_mode.get("quantize_int8")))
+        return self.cache.make_key(self.model_name, prompt, params, self.seed, attempt)
+
+    def cache_stats(self):
+        return self.cache.stats() if self.cache is not None else None
+
+    def generate(self, prompt, attempt: int = 0):
+        """Generates text using the selected HF model.
+
+        ``prompt`` is a string or a sequence of token ids. ``attempt`` numbers
+        repeated generations for the same prompt (requeries) so that, with a
+        fixed seed, each attempt gets its own reproducible sample.
+        """
+        key = self._cache_key(prompt, attempt)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        try:
+            ids = self.encode(prompt)
+            if self.seed is not None:
+                set_seed(self.seed + attempt)
+            result = self._generate_ids([ids])[0]
         except Exception as e:
-            return f"[Model Error: {str(e)}]"
\ No newline at end of file
+            return f"[Model Error: {str(e)}]"
+
+        if key is not None:
+            self.cache.put(key, result)
+        return result
+
+    def generate_stream(self, prompt: str, attempt: int = 0):
+        """Starts a generation and returns a GenerationStream of text chunks.
+
+        Closing the stream before it is exhausted stops decoding at the next
+        token. Only complete (non-aborted, error-free) streams are written to
+        the cache.
+        """
+        key = self._cache_key(prompt, attempt)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return _CachedStream(cached)
+        stream = GenerationStream(self, prompt, attempt, timeout=self.stream_timeout)
+        if key is None:
+            return stream
+        return _CachingStream(stream, self.cache, key)
+
+    def generate_batch(self, prompts, batch_size: int = 8, attempts=None):
+        """Generates text for many prompts, returned in the same order as ``prompts``.
+
+        Prompts are encoded once (or looked up pre-tokenized) and bucketed by
+        token length before batching so each padded batch wastes as little
+        compute on padding as possible. A batch shares one seed, so with a
+        fixed seed prompts are first grouped by attempt: every batch is seeded
+        with ``seed + attempt`` of all its prompts. Cached generations are
+        served without touching the model.
+        """
+        prompts = list(prompts)
+        attempts = list(attempts) if attempts is not None else [0] * len(prompts)
+        results = [None] * len(prompts)
+
+        keys = [self._cache_key(p, a) for p, a in zip(prompts, attempts)]
+        todo = []
+        for i, key in enumerate(keys):
+            cached = self.cache.get(key) if key is not None else None
+            if cached is not None:
+                results[i] = cached
+            else:
+                todo.append(i)
+        if not todo:
+            return results
+
+        input_ids = dict(zip(todo, self.encode_batch([prompts[i] for i in todo])))
+        groups = {}
+        for i in sorted(todo, key=lambda i: len(input_ids[i])):
+            groups.setdefault(attempts[i] if self.seed is not None else 0, []).append(i)
+        buckets = [group[start:start + batch_size] for group in groups.values()
+                   for start in range(0, len(group), batch_size)]
+
+        for bucket in buckets:
+            try:
+                if self.seed is not None:
+                    set_seed(self.seed + attempts[bucket[0]])
+                outputs = self._generate_ids([input_ids[i] for i in bucket])
+                for i, output in zip(bucket, outputs):
+                    results[i] = output
+                    if keys[i] is not None:
+                        self.cache.put(keys[i], results[i])
+            except Exception as e:
+                for i in bucket:
+                    results[i] = f"[Model Error: {str(e)}]"
+        return results
@@ -0,0 +1,109 @@
+"""Memory-budgeted pool of loaded models.
+
+``ModelPool.get(name)`` builds a model on first use (through the backend
+registry) and keeps it resident for later calls. When the resident models
+together exceed ``memory_budget_mb``, or there are more than ``max_models``,
+the least recently used ones are evicted: the pool calls their ``release()``
+so weights and tokenizers are freed right away instead of whenever the
+garbage collector gets to them. Sizes learned on an earlier load are used to
+make room before a model is loaded again.
+
+Per model the pool records load count, last load time, footprint and the
+process's peak RSS after loading (``report()``).
+"""
+
+import gc
+import os
+import resource
+import time
+from collections import OrderedDict
+
+from models.registry import build_model
+
+
+def current_rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class ModelPool:
+    def __init__(self, config, memory_budget_mb=None, max_models=None, backend=None, **model_kwargs):
+        pool_config = config.get("model_pool", {})
+        self.config = config
+        self.memory_budget_mb = memory_budget_mb if memory_budget_mb is not None else pool_config.get("memory_budget_mb")
+        self.max_models = max_models if max_models is not None else pool_config.get("max_models")
+        self.backend = backend
+        self.model_kwargs = model_kwargs
+        self._models = OrderedDict()  # name -> model, least recently used first
+        self._stats = {}
+
+    def _footprint_mb(self, name):
+        return self._stats[name]["footprint_mb"]
+
+    def resident_mb(self):
+        return sum(self._footprint_mb(name) for name in self._models)
+
+    def _over_budget(self, extra_mb=0.0, extra_models=0):
+        if self.max_models and len(self._models) + extra_models > self.max_models:
+            return True
+        return bool(self.memory_budget_mb) and self.resident_mb() + extra_mb > self.memory_budget_mb
+
+    def _evict_until_fits(self, extra_mb=0.0, extra_models=0, keep=None):
+        for name in list(self._models):
+            if not self._over_budget(extra_mb, extra_models):
+                break
+            if name != keep:
+                self.evict(name)
+
+    def get(self, model_name):
+        if model_name in self._models:
+            self._models.move_to_end(model_name)
+            return self._models[model_name]
+
+        # Make room up front if we already know how big this model is
+        known = self._stats.get(model_name, {}).get("footprint_mb", 0.0)
+        self._evict_until_fits(extra_mb=known, extra_models=1)
+
+        rss_before = current_rss_mb()
+        start = time.perf_counter()
+        model = build_model(model_name, self.config, backend=self.backend, **self.model_kwargs)
+        load_s = time.perf_counter() - start
+        footprint = model.memory_footprint()
+        footprint_mb = footprint / 2**20 if footprint is not None else max(0.0, current_rss_mb() - rss_before)
+
+        stats = self._stats.setdefault(model_name, {"loads": 0, "evictions": 0})
+        stats.update(loads=stats["loads"] + 1, load_s=load_s, footprint_mb=footprint_mb, peak_rss_mb=peak_rss_mb())
+        self._models[model_name] = model
+        self._evict_until_fits(keep=model_name)
+        return model
+
+    def evict(self, model_name):
+        model = self._models.pop(model_name, None)
+        if model is None:
+            return
+        model.release()
+        del model
+        gc.collect()
+        self._stats[model_name]["evictions"] += 1
+
+    def clear(self):
+        for name in list(self._models):
+            self.evict(name)
+
+    def __contains__(self, model_name):
+        return model_name in self._models
+
+    def report(self):
+        """[{model, loads, evictions, load_s, footprint_mb, peak_rss_mb, resident}] per model seen."""
+        return [dict(model=name, resident=name in self._models, **stats) for name, stats in self._stats.items()]
+
+    def print_report(self):
+        print(f"{'model':<40} {'loads':>5} {'evicted':>7} {'load s':>7} {'size MB':>8} {'peak RSS MB':>11}")
+        for r in self.report():
+            print(f"{r['model']:<40} {r['loads']:>5} {r['evictions']:>7} {r['load_s']:>7.1f} "
+                  f"{r['footprint_mb']:>8.0f} {r['peak_rss_mb']:>11.0f}")
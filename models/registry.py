@@ -0,0 +1,36 @@
+"""Registry of model backends, imported only when a model is actually built.
+
+Backends are registered as "module:attribute" strings so that heavy
+dependencies (torch, transformers) are not imported until ``build_model``
+asks for that backend.
+"""
+
+import importlib
+
+_BACKENDS = {
+    "hf": "models.llm_client:BlackBoxLLM",
+    "fake": "models.fake_llm:FakeLLM",
+}
+
+def register_backend(name, target):
+    """Register a backend class, given as the class itself or a "module:attribute" string."""
+    _BACKENDS[name] = target
+
+def available_backends():
+    return sorted(_BACKENDS)
+
+def get_backend(name):
+    try:
+        target = _BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown model backend '{name}' (available: {', '.join(available_backends())})")
+    if isinstance(target, str):
+        module_name, _, attr = target.partition(":")
+        target = getattr(importlib.import_module(module_name), attr)
+        _BACKENDS[name] = target
+    return target
+
+def build_model(model_name, config, backend=None, **kwargs):
+    """Build ``model_name`` with the configured backend (``config["backend"]``, default "hf")."""
+    cls = get_backend(backend or config.get("backend", "hf"))
+    return cls.from_config(model_name, config, **kwargs)
@@ -0,0 +1,245 @@
+"""Memory-mapped pre-tokenized prompt corpora.
+
+A JSONL prompt file is tokenized once per tokenizer and stored as flat NumPy
+arrays, so reruns, wrappers and requeries look token ids up instead of
+encoding the same prompt again. A corpus lives under
+``<cache_dir>/<tokenizer name>-<tokenizer hash>/`` as:
+
+    <stem>.ids.npy       every prompt's token ids, concatenated (int32)
+    <stem>.offsets.npy   prompt i is ids[offsets[i]:offsets[i + 1]] (int64)
+    <stem>.keys.npy      sorted 64-bit digests of the prompt texts
+    <stem>.order.npy     prompt index of each key
+    <stem>.json          tokenizer, source file size/mtime, counts, build time
+
+A corpus built with a ``prompt_prefix`` (e.g. the requery prefix) stores the
+ids of ``prompt_prefix + text`` for every prompt, keyed by that full text,
+under ``<stem>.prefix-<hash>``: the prefix is encoded together with each
+prompt, because concatenating separately encoded ids does not always give the
+tokenizer's ids (a trailing space may merge with the next word).
+
+Ids are stored without special tokens; callers add them. The arrays are
+opened with ``mmap_mode="r"``, so processes sharing a corpus share its pages
+and a lookup only touches the prompt it reads. A corpus whose source file
+changed since it was built is rebuilt by ``load_or_build``.
+
+Usage:
+    python -m models.token_cache build Qwen/Qwen1.5-0.5B-Chat data/risky_prompts.jsonl data/harmless_prompts.jsonl
+    python -m models.token_cache build Qwen/Qwen1.5-0.5B-Chat data/risky_prompts.jsonl --requery
+    python -m models.token_cache stats data/tokenized
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+ARRAYS = ("ids", "offsets", "keys", "order")
+
+
+def text_key(text):
+    """64-bit digest identifying a prompt text."""
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def tokenizer_fingerprint(tokenizer):
+    """Short hash of a Hugging Face tokenizer's full definition (vocab, merges, normalization)."""
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        raw = backend.to_str()
+    else:
+        raw = json.dumps(sorted(tokenizer.get_vocab().items()), ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def corpus_prefix(cache_dir, dataset_path, tokenizer_name, tokenizer_hash, prompt_prefix=""):
+    slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", tokenizer_name).strip("_")
+    stem = os.path.splitext(os.path.basename(dataset_path))[0]
+    if prompt_prefix:
+        stem += f".prefix-{text_key(prompt_prefix):016x}"
+    return os.path.join(cache_dir, f"{slug}-{tokenizer_hash}", stem)
+
+
+def _source_state(dataset_path):
+    st = os.stat(dataset_path)
+    return {"source": dataset_path, "source_bytes": st.st_size, "source_mtime_ns": st.st_mtime_ns}
+
+
+def _iter_text_batches(dataset_path, size):
+    batch = []
+    with open(dataset_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            batch.append(json.loads(line)["text"])
+            if len(batch) >= size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def build_corpus(dataset_path, prefix, encode_batch, tokenizer_name, tokenizer_hash, batch_size=1024, prompt_prefix=""):
+    """Tokenize ``dataset_path`` with ``encode_batch`` (list of texts -> list of id lists) into ``prefix``.
+
+    With ``prompt_prefix``, every prompt is stored (and keyed) as
+    ``prompt_prefix + text``.
+
+    Ids are streamed to a scratch file and copied into the memory-mapped
+    ``.ids.npy`` at the end, so memory is bounded by one batch plus the
+    per-prompt index. Returns the corpus metadata.
+    """
+    os.makedirs(os.path.dirname(prefix) or ".", exist_ok=True)
+    # Per-process scratch names: concurrent builds of the same corpus write identical files
+    tmp = f".{os.getpid()}.tmp"
+    scratch = prefix + ".ids" + tmp
+    lengths, keys = [], []
+    start = time.perf_counter()
+    with open(scratch, "wb") as out:
+        for texts in _iter_text_batches(dataset_path, batch_size):
+            texts = [prompt_prefix + text for text in texts]
+            for text, ids in zip(texts, encode_batch(texts)):
+                np.asarray(ids, dtype=np.int32).tofile(out)
+                lengths.append(len(ids))
+                keys.append(text_key(text))
+    seconds = time.perf_counter() - start
+
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    ids = np.lib.format.open_memmap(prefix + ".ids.npy" + tmp, mode="w+", dtype=np.int32, shape=(int(offsets[-1]),))
+    if len(ids):
+        ids[:] = np.memmap(scratch, dtype=np.int32, mode="r")
+    ids.flush()
+    del ids
+    os.remove(scratch)
+
+    keys = np.array(keys, dtype=np.uint64)
+    order = np.argsort(keys, kind="stable")
+    for name, array in (("offsets", offsets), ("keys", keys[order]), ("order", order.astype(np.int64))):
+        # Through a file object: np.save would append .npy to the .tmp name
+        with open(f"{prefix}.{name}.npy{tmp}", "wb") as f:
+            np.save(f, array)
+    for name in ARRAYS:
+        os.replace(f"{prefix}.{name}.npy{tmp}", f"{prefix}.{name}.npy")
+
+    meta = dict(
+        _source_state(dataset_path),
+        tokenizer=tokenizer_name, tokenizer_hash=tokenizer_hash, prompt_prefix=prompt_prefix,
+        prompts=len(lengths), tokens=int(offsets[-1]), tokenize_seconds=round(seconds, 6),
+    )
+    with open(prefix + ".json" + tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(prefix + ".json" + tmp, prefix + ".json")
+    return meta
+
+
+class TokenizedCorpus:
+    """Read-only view of a corpus written by ``build_corpus``."""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        with open(prefix + ".json", "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        # Plain ndarray views of the maps: indexing np.memmap objects is several times slower
+        arrays = {name: np.asarray(np.load(f"{prefix}.{name}.npy", mmap_mode="r")) for name in ARRAYS}
+        self.ids = arrays["ids"]
+        self.offsets = arrays["offsets"]
+        self._keys = arrays["keys"]
+        self._order = arrays["order"]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def index(self, text):
+        """Position of ``text`` in the corpus, or None."""
+        key = np.uint64(text_key(text))
+        i = int(np.searchsorted(self._keys, key))
+        if i < len(self._keys) and self._keys[i] == key:
+            return int(self._order[i])
+        return None
+
+    def lookup(self, text):
+        """Token ids of ``text`` (a read-only array view), or None if it is not in the corpus."""
+        i = self.index(text)
+        return None if i is None else self[i]
+
+    @property
+    def seconds_per_prompt(self):
+        """Average time it took to tokenize one prompt when the corpus was built."""
+        return self.meta["tokenize_seconds"] / max(self.meta["prompts"], 1)
+
+    def is_stale(self):
+        try:
+            state = _source_state(self.meta["source"])
+        except OSError:
+            return False
+        return any(self.meta.get(k) != v for k, v in state.items())
+
+
+def load_or_build(dataset_path, tokenizer, cache_dir="data/tokenized", batch_size=1024, prompt_prefix=""):
+    """The corpus of ``dataset_path`` (each prompt after ``prompt_prefix``) for a Hugging Face ``tokenizer``, built on first use."""
+    name = tokenizer.name_or_path
+    fingerprint = tokenizer_fingerprint(tokenizer)
+    prefix = corpus_prefix(cache_dir, dataset_path, name, fingerprint, prompt_prefix)
+    if os.path.exists(prefix + ".json"):
+        corpus = TokenizedCorpus(prefix)
+        if not corpus.is_stale():
+            return corpus
+
+    def encode_batch(texts):
+        return tokenizer(texts, add_special_tokens=False)["input_ids"]
+
+    build_corpus(dataset_path, prefix, encode_batch, name, fingerprint, batch_size, prompt_prefix)
+    return TokenizedCorpus(prefix)
+
+
+def main():
+    p = argparse.ArgumentParser()
+    sub = p.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Pre-tokenize datasets for a model's tokenizer")
+    build.add_argument("model", help="Model (tokenizer) name or path")
+    build.add_argument("datasets", nargs="+")
+    build.add_argument("--cache-dir", default="data/tokenized")
+    build.add_argument("--hf-token", default=None)
+    build.add_argument("--requery", action="store_true",
+                       help="Also pre-tokenize the requery prompt (QueryBudgetWrapper's prefix + prompt) of every prompt")
+    stats = sub.add_parser("stats", help="Summarize the corpora in a cache directory")
+    stats.add_argument("cache_dir", nargs="?", default="data/tokenized")
+    args = p.parse_args()
+
+    if args.command == "build":
+        from transformers import AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(args.model, token=args.hf_token)
+        prompt_prefixes = [""]
+        if args.requery:
+            from wrappers.query_budget_wrapper import REQUERY_PREFIX
+
+            prompt_prefixes.append(REQUERY_PREFIX)
+        for dataset in args.datasets:
+            for prompt_prefix in prompt_prefixes:
+                corpus = load_or_build(dataset, tokenizer, args.cache_dir, prompt_prefix=prompt_prefix)
+                m = corpus.meta
+                print(f"{corpus.prefix}: {m['prompts']} prompts, {m['tokens']} tokens, tokenized in {m['tokenize_seconds']:.3f}s")
+        return
+
+    for path in sorted(glob.glob(os.path.join(args.cache_dir, "*", "*.json"))):
+        corpus = TokenizedCorpus(path[:-len(".json")])
+        m = corpus.meta
+        size_mb = sum(os.path.getsize(f"{corpus.prefix}.{name}.npy") for name in ARRAYS) / 2**20
+        print(f"{corpus.prefix}: {m['prompts']} prompts, {m['tokens']} tokens, {size_mb:.2f} MB"
+              + (" (stale)" if corpus.is_stale() else ""))
+
+
+if __name__ == "__main__":
+    main()
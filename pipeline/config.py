@@ -0,0 +1,21 @@
+import json
+import os
+from functools import lru_cache
+
+DEFAULT_CONFIG_PATH = os.path.join("config", "config.json")
+
+@lru_cache(maxsize=None)
+def _load(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+def load_config(path=None):
+    """Read and parse the config file once per path; later calls return the cached dict.
+
+    The returned dict is shared, so callers that need a variant should copy it
+    (``dict(load_config(), log_file=...)``) rather than mutate it.
+    """
+    return _load(os.path.abspath(path or DEFAULT_CONFIG_PATH))
+
+def clear_config_cache():
+    _load.cache_clear()
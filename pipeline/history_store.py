@@ -0,0 +1,354 @@
+"""Conversation history storage.
+
+``HistoryStore`` keeps every turn in one SQLite table indexed by
+(session, id), so the last K turns of a conversation are an O(K) index range
+scan however large the table grows. Old turns are dropped by ``compact()``
+(per-session cap and/or age), which also runs automatically every
+``compact_every`` appends when a retention limit is configured.
+
+Pipelines don't talk to the store directly but to a history view:
+
+    SessionHistory  one session of a HistoryStore, with the last ``limit``
+                    turns cached in memory
+    JSONLHistory    the legacy append-only history.jsonl file
+
+Both expose ``append(entry)``, ``recent(k)``, iteration over the cached
+window and ``close()``. ``open_history`` picks one from config
+``history_store``.
+
+Usage:
+    python -m pipeline.history_store import logs/history.jsonl --session default
+    python -m pipeline.history_store compact --max-turns 1000 --older-than-days 30
+    python -m pipeline.history_store stats
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+DEFAULT_SESSION = "default"
+
+
+def tail_jsonl(path, n, block_size=8192):
+    """Return the last ``n`` records of a JSONL file without reading all of it."""
+    if n <= 0 or not os.path.exists(path):
+        return []
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b""
+        # Read backwards until we hold n complete lines (n + 1 newlines, or the file start)
+        while pos > 0 and data.count(b"\n") <= n:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    lines = [line for line in data.splitlines() if line.strip()]
+    if pos > 0:
+        lines = lines[1:]  # first line may be cut in half
+    return [json.loads(line) for line in lines[-n:]]
+
+
+class HistoryStore:
+    """Per-session conversation turns in a WAL-mode SQLite file.
+
+    A turn is a dict with ``user`` and ``model`` text; any other keys are kept
+    in a JSON ``meta`` column and returned as part of the turn.
+    """
+
+    def __init__(self, path, max_turns_per_session=None, retention_seconds=None, compact_every=10_000):
+        self.path = path
+        self.max_turns_per_session = max_turns_per_session
+        self.retention_seconds = retention_seconds
+        self.compact_every = compact_every
+        self._appends = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS turns ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, session TEXT NOT NULL,"
+            " user TEXT, model TEXT, meta TEXT, ts REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS turns_session ON turns(session, id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS turns_ts ON turns(ts)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS imports (source TEXT PRIMARY KEY, turns INTEGER, ts REAL)")
+        self._conn.commit()
+
+    @staticmethod
+    def _row(session_id, entry, ts):
+        meta = {k: v for k, v in entry.items() if k not in ("user", "model")}
+        return (session_id, entry.get("user"), entry.get("model"), json.dumps(meta) if meta else None, ts)
+
+    @staticmethod
+    def _entry(user, model, meta):
+        entry = {"user": user, "model": model}
+        if meta:
+            entry.update(json.loads(meta))
+        return entry
+
+    def append(self, session_id, entry):
+        self.append_many(session_id, [entry])
+
+    def _insert(self, session_id, entries, ts):
+        cur = self._conn.executemany(
+            "INSERT INTO turns (session, user, model, meta, ts) VALUES (?, ?, ?, ?, ?)",
+            [self._row(session_id, entry, ts) for entry in entries],
+        )
+        return cur.rowcount
+
+    def _appended(self, n):
+        before, self._appends = self._appends, self._appends + n
+        if self.compact_every and before // self.compact_every != self._appends // self.compact_every:
+            self.compact(self.max_turns_per_session, self.retention_seconds)
+
+    def append_many(self, session_id, entries, ts=None):
+        ts = ts or time.time()
+        with self._lock:
+            n = self._insert(session_id, entries, ts)
+            self._conn.commit()
+        self._appended(n)
+
+    def recent(self, session_id, k):
+        """The last ``k`` turns of ``session_id``, oldest first."""
+        if k <= 0:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT user, model, meta FROM turns WHERE session = ? ORDER BY id DESC LIMIT ?",
+                (session_id, k),
+            ).fetchall()
+        return [self._entry(*row) for row in reversed(rows)]
+
+    def count(self, session_id=None):
+        with self._lock:
+            if session_id is None:
+                return self._conn.execute("SELECT COUNT(*) FROM turns").fetchone()[0]
+            return self._conn.execute("SELECT COUNT(*) FROM turns WHERE session = ?", (session_id,)).fetchone()[0]
+
+    def sessions(self):
+        with self._lock:
+            return [s for (s,) in self._conn.execute("SELECT DISTINCT session FROM turns ORDER BY session")]
+
+    def rewind(self, session_id, since):
+        """Drop the turns ``session_id`` got at or after time ``since``; returns the number removed."""
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM turns WHERE session = ? AND ts >= ?", (session_id, since))
+            self._conn.commit()
+        return cur.rowcount
+
+    def compact(self, max_turns_per_session=None, older_than_seconds=None, vacuum=False):
+        """Drop turns beyond the newest ``max_turns_per_session`` of each session
+        and turns older than ``older_than_seconds``; returns the number removed."""
+        removed = 0
+        with self._lock:
+            if older_than_seconds is not None:
+                cur = self._conn.execute("DELETE FROM turns WHERE ts < ?", (time.time() - older_than_seconds,))
+                removed += cur.rowcount
+            if max_turns_per_session is not None:
+                cur = self._conn.execute(
+                    "DELETE FROM turns WHERE id IN (SELECT id FROM ("
+                    " SELECT id, ROW_NUMBER() OVER (PARTITION BY session ORDER BY id DESC) AS rank FROM turns"
+                    ") WHERE rank > ?)",
+                    (max_turns_per_session,),
+                )
+                removed += cur.rowcount
+            self._conn.commit()
+            if vacuum:
+                self._conn.execute("VACUUM")
+        return removed
+
+    def import_jsonl(self, path, session_id=DEFAULT_SESSION, batch_size=10_000, force=False):
+        """Append the turns of a history.jsonl file to ``session_id``.
+
+        Each source file is imported once unless ``force`` is set; returns the
+        number of turns imported. The turns and the record of the import are
+        committed in one transaction, so processes opening the store at the
+        same time import a file once between them.
+        """
+        source = os.path.abspath(path)
+        ts = os.path.getmtime(path)
+        imported = 0
+        with self._lock:
+            # Take the write lock before checking: a concurrent import either committed already or waits for us
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                done = self._conn.execute("SELECT 1 FROM imports WHERE source = ?", (source,)).fetchone()
+                if done and not force:
+                    self._conn.rollback()
+                    return 0
+                batch = []
+                with open(path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        batch.append(json.loads(line))
+                        if len(batch) >= batch_size:
+                            imported += self._insert(session_id, batch, ts)
+                            batch = []
+                if batch:
+                    imported += self._insert(session_id, batch, ts)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO imports (source, turns, ts) VALUES (?, ?, ?)", (source, imported, time.time())
+                )
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+        self._appended(imported)
+        return imported
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SessionHistory:
+    """One session of a HistoryStore; the last ``limit`` turns are cached in memory."""
+
+    def __init__(self, store, session_id=DEFAULT_SESSION, limit=3):
+        self.store = store
+        self.session_id = session_id
+        self.limit = limit
+        self._window = deque(store.recent(session_id, limit), maxlen=limit)
+
+    def append(self, entry):
+        self.store.append(self.session_id, entry)
+        self._window.append(entry)
+
+    def recent(self, k):
+        if k <= len(self._window) or len(self._window) < self.limit:
+            return list(self._window)[-k:] if k > 0 else []
+        return self.store.recent(self.session_id, k)
+
+    def __iter__(self):
+        return iter(self._window)
+
+    def __len__(self):
+        return len(self._window)
+
+    def close(self):
+        # The store is shared (see get_history_store) and outlives its views
+        pass
+
+
+class JSONLHistory:
+    """The legacy append-only history.jsonl, seeded by tailing the file."""
+
+    def __init__(self, path, limit=3):
+        self.path = path
+        self.limit = limit
+        self._window = deque(tail_jsonl(path, limit), maxlen=limit)
+        self._f = None
+
+    def append(self, entry):
+        if self._f is None:
+            self._f = open(self.path, "a")
+        self._f.write(json.dumps(entry) + "\n")
+        self._f.flush()
+        self._window.append(entry)
+
+    def recent(self, k):
+        if k <= len(self._window) or len(self._window) < self.limit:
+            return list(self._window)[-k:] if k > 0 else []
+        return tail_jsonl(self.path, k)
+
+    def __iter__(self):
+        return iter(self._window)
+
+    def __len__(self):
+        return len(self._window)
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_history_store(path, **options):
+    """Shared HistoryStore per path, so pipelines in one process share a connection."""
+    key = os.path.abspath(path)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = HistoryStore(path, **options)
+        return _stores[key]
+
+
+def open_history(config, history_file=None, session_id=None):
+    """The history view described by config ``history_store`` (default: jsonl).
+
+    The first time a SQLite store is opened, the existing ``history_file`` is
+    imported into the default session.
+    """
+    limit = config["history_limit"]
+    history_file = history_file or config["history_file"]
+    options = dict(config.get("history_store", {}))
+    backend = options.pop("backend", "jsonl")
+    if backend == "jsonl":
+        return JSONLHistory(history_file, limit)
+    if backend == "sqlite":
+        store = get_history_store(options.pop("path", "logs/history.sqlite"), **options)
+        if os.path.exists(history_file):
+            store.import_jsonl(history_file, DEFAULT_SESSION)
+        return SessionHistory(store, session_id or DEFAULT_SESSION, limit)
+    raise ValueError(f"Unknown history store backend: {backend!r}")
+
+
+def rewind_history(config, session_id, since):
+    """Drop the turns ``session_id`` got since ``since`` in the store ``open_history`` would use.
+
+    Only the SQLite store keeps sessions apart; the shared jsonl history is
+    left as is. Returns the number of turns removed.
+    """
+    options = dict(config.get("history_store", {}))
+    if options.pop("backend", "jsonl") != "sqlite":
+        return 0
+    store = get_history_store(options.pop("path", "logs/history.sqlite"), **options)
+    return store.rewind(session_id or DEFAULT_SESSION, since)
+
+
+def main():
+    from pipeline.config import load_config
+
+    config = load_config()
+    options = config.get("history_store", {})
+    p = argparse.ArgumentParser()
+    p.add_argument("--db", default=options.get("path", "logs/history.sqlite"), help="History database path")
+    sub = p.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import", help="Import a history.jsonl file")
+    imp.add_argument("jsonl", nargs="?", default=config["history_file"])
+    imp.add_argument("--session", default=DEFAULT_SESSION)
+    imp.add_argument("--force", action="store_true", help="Import again even if already imported")
+    comp = sub.add_parser("compact", help="Apply retention limits")
+    comp.add_argument("--max-turns", type=int, default=options.get("max_turns_per_session"),
+                      help="Turns kept per session")
+    comp.add_argument("--older-than-days", type=float, default=None, help="Drop turns older than this")
+    comp.add_argument("--vacuum", action="store_true", help="Reclaim disk space afterwards")
+    sub.add_parser("stats", help="Turn counts per session")
+    args = p.parse_args()
+
+    store = HistoryStore(args.db)
+    if args.command == "import":
+        print(f"Imported {store.import_jsonl(args.jsonl, args.session, force=args.force)} turns into '{args.session}'")
+    elif args.command == "compact":
+        older_than = args.older_than_days * 86400 if args.older_than_days is not None else None
+        print(f"Removed {store.compact(args.max_turns, older_than, vacuum=args.vacuum)} turns")
+    else:
+        for session_id in store.sessions():
+            print(f"{store.count(session_id):>10}  {session_id}")
+        print(f"{store.count():>10}  total")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
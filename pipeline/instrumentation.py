@@ -0,0 +1,234 @@
+"""Per-stage timing for pipeline runs.
+
+A ``StageTimer`` is created per prompt and its ``span(stage)`` blocks record
+how long each stage took. Spans record exclusive time: a span nested inside
+another is subtracted from the outer one, so stages add up to the time spent
+in them (e.g. ``decide_partial`` while streaming is not counted as
+``generate``). ``finish()`` returns the stage durations in milliseconds plus
+the ``total`` since the timer was created; pipelines store this as
+``timings_ms`` in each log entry.
+
+Stages recorded by ``Pipeline``:
+
+    generate        model calls (a batched call is shared across its prompts)
+    decide          wrapper decisions, including reads of the history window
+    history         appending the turn to the history store
+    total           wall-clock time of the run (of the batch, for run_batch)
+    log             enqueueing the log entry (histograms only)
+    history_load    opening the history view (histograms only, once per pipeline)
+
+Every finished timer also feeds the process-wide ``StageMetrics`` histograms
+(``get_stage_metrics()``), which the server exposes in Prometheus text format.
+With config ``instrumentation.enabled`` false, pipelines use ``NULL_TIMER``,
+whose spans are a shared no-op context manager.
+
+Usage:
+    python -m pipeline.instrumentation report logs/experiment_log.jsonl
+    python -m pipeline.instrumentation prometheus logs/experiment_log.jsonl
+"""
+
+import argparse
+import bisect
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+STAGES = ("generate", "decide", "history", "log", "history_load", "total")
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class StageTimer:
+    enabled = True
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.seconds = defaultdict(float)
+        self._open = []  # [stage, start, time spent in nested spans] per open span
+
+    def span(self, stage):
+        # The timer is its own context manager (cheaper than a generator-based one)
+        self._open.append([stage, time.perf_counter(), 0.0])
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        stage, start, nested = self._open.pop()
+        elapsed = time.perf_counter() - start
+        self.seconds[stage] += elapsed - nested
+        if self._open:
+            self._open[-1][2] += elapsed
+
+    def add(self, stage, seconds):
+        self.seconds[stage] += seconds
+
+    def finish(self):
+        """Stage durations in milliseconds, including ``total``."""
+        timings = {stage: round(s * 1000, 3) for stage, s in self.seconds.items()}
+        timings["total"] = round((time.perf_counter() - self.start) * 1000, 3)
+        return timings
+
+
+class _NullTimer:
+    enabled = False
+    _span = nullcontext()
+
+    def span(self, stage):
+        return self._span
+
+    def add(self, stage, seconds):
+        pass
+
+    def finish(self):
+        return None
+
+
+NULL_TIMER = _NullTimer()
+
+
+def stage_timer(enabled=True):
+    return StageTimer() if enabled else NULL_TIMER
+
+
+class Histogram:
+    """Cumulative-bucket histogram of durations in seconds."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+def _labels(**labels):
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels.values())
+    return ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped))
+
+
+class StageMetrics:
+    """Per (model, wrapper, stage) duration histograms."""
+
+    name = "pipeline_stage_seconds"
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def _histogram(self, key):
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(self.buckets)
+        return histogram
+
+    def observe(self, model, wrapper, stage, seconds):
+        with self._lock:
+            self._histogram((model, wrapper, stage)).observe(seconds)
+
+    def observe_timings(self, model, wrapper, timings_ms):
+        with self._lock:
+            for stage, ms in timings_ms.items():
+                self._histogram((model, wrapper, stage)).observe(ms / 1000)
+
+    def prometheus(self):
+        """All histograms in the Prometheus text exposition format."""
+        lines = [
+            f"# HELP {self.name} Time spent per pipeline stage.",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            for (model, wrapper, stage), h in sorted(self._histograms.items()):
+                labels = _labels(model=model, wrapper=wrapper, stage=stage)
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), h.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{self.name}_bucket{{{labels},le="{le}"}} {cumulative}')
+                lines.append(f"{self.name}_sum{{{labels}}} {h.sum!r}")
+                lines.append(f"{self.name}_count{{{labels}}} {h.count}")
+        return "\n".join(lines) + "\n"
+
+
+_stage_metrics = StageMetrics()
+
+
+def get_stage_metrics():
+    """The process-wide StageMetrics every Pipeline reports to."""
+    return _stage_metrics
+
+
+def read_timings(paths):
+    """Yield (model, wrapper, timings_ms) for every log entry that has timings."""
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry.get("timings_ms"):
+                    yield entry.get("model"), entry.get("wrapper"), entry["timings_ms"]
+
+
+def percentile_report(paths, percentiles=(50, 90, 99)):
+    """{(model, wrapper): {stage: {"count", "mean", "p50", ...}}} from JSONL logs."""
+    samples = defaultdict(lambda: defaultdict(list))
+    for model, wrapper, timings in read_timings(paths):
+        for stage, ms in timings.items():
+            samples[(model, wrapper)][stage].append(ms)
+    report = {}
+    for key, stages in sorted(samples.items()):
+        report[key] = {}
+        for stage in sorted(stages, key=lambda s: (STAGES.index(s) if s in STAGES else len(STAGES), s)):
+            values = stages[stage]
+            row = {"count": len(values), "mean": sum(values) / len(values)}
+            row.update({f"p{q}": percentile(values, q) for q in percentiles})
+            report[key][stage] = row
+    return report
+
+
+def main():
+    p = argparse.ArgumentParser()
+    sub = p.add_subparsers(dest="command", required=True)
+    rep = sub.add_parser("report", help="Per-stage latency percentiles per model and wrapper")
+    rep.add_argument("logs", nargs="+", help="JSONL experiment logs (rotated files too)")
+    rep.add_argument("--percentiles", default="50,90,99")
+    prom = sub.add_parser("prometheus", help="Stage histograms in Prometheus text format")
+    prom.add_argument("logs", nargs="+")
+    args = p.parse_args()
+
+    if args.command == "prometheus":
+        metrics = StageMetrics()
+        for model, wrapper, timings in read_timings(args.logs):
+            metrics.observe_timings(model, wrapper, timings)
+        print(metrics.prometheus(), end="")
+        return
+
+    percentiles = [int(q) for q in args.percentiles.split(",")]
+    columns = ["count", "mean"] + [f"p{q}" for q in percentiles]
+    for (model, wrapper), stages in percentile_report(args.logs, percentiles).items():
+        print(f"\n{model} | {wrapper}")
+        print(f"  {'stage (ms)':<14}" + "".join(f"{c:>10}" for c in columns))
+        for stage, row in stages.items():
+            cells = [f"{row['count']:>10}"] + [f"{row[c]:>10.2f}" for c in columns[1:]]
+            print(f"  {stage:<14}" + "".join(cells))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,173 @@
+import atexit
 import json
-from datetime import datetime
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+_STOP = object()
+
+
+class BufferedJSONLLogger:
+    """Append-only JSONL logger that writes from a background thread.
+
+    ``log()`` only enqueues the entry with its arrival time; timestamp
+    formatting, ``json.dumps`` and file I/O all happen on the writer thread,
+    so an entry must not be mutated after it has been logged.
+    Queued lines are written in batches once ``max_batch`` lines are pending
+    or ``flush_interval`` seconds have passed, and the file is rotated to
+    ``log_file.1`` ... ``log_file.<backup_count>`` when it would exceed
+    ``max_bytes`` (0 disables rotation).
+    An entry that can't be serialized, or a batch that can't be written, is
+    dropped and reported on stderr; the writer thread keeps running and the
+    next ``flush()`` raises the first such error.
+    """
+
+    def __init__(self, log_file, max_batch=256, flush_interval=1.0, max_bytes=0, backup_count=5):
+        self.log_file = log_file
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+
+        self._queue = queue.SimpleQueue()
+        self._file = None
+        self._closed = False
+        self._error = None
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name=f"jsonl-logger:{log_file}", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def log(self, entry):
+        if self._closed:
+            raise ValueError(f"Logger for {self.log_file} is closed")
+        self._queue.put((time.time(), entry))
+
+    def flush(self, timeout=10.0):
+        """Block until everything logged so far has been written, for at most ``timeout`` seconds.
+
+        Raises TimeoutError if the writer doesn't catch up in time, or the
+        first error it hit since the last flush.
+        """
+        if self._closed:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        if not done.wait(timeout):
+            raise TimeoutError(f"Logger for {self.log_file} did not flush within {timeout}s")
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def close(self, timeout=10.0):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        atexit.unregister(self.close)
+
+    def _run(self):
+        pending = []
+        last_write = time.monotonic()
+        while True:
+            timeout = None
+            if pending:
+                timeout = max(0.0, self.flush_interval - (time.monotonic() - last_write))
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._write_batch(pending)
+                if self._file is not None:
+                    self._file.close()
+                return
+            if isinstance(item, threading.Event):
+                self._write_batch(pending)
+                pending = []
+                last_write = time.monotonic()
+                item.set()
+                continue
+            if item is not None:
+                ts, entry = item
+                timestamp = datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None).isoformat()
+                try:
+                    pending.append(json.dumps({**entry, "timestamp": timestamp}) + "\n")
+                except (TypeError, ValueError) as e:
+                    self._drop(1, e)
+
+            if len(pending) >= self.max_batch or (pending and time.monotonic() - last_write >= self.flush_interval):
+                self._write_batch(pending)
+                pending = []
+                last_write = time.monotonic()
+
+    def _drop(self, lines, error):
+        self.dropped += lines
+        if self._error is None:
+            self._error = error
+        print(f"Logger for {self.log_file} dropped {lines} line(s): {error!r}", file=sys.stderr)
+
+    def _write_batch(self, lines):
+        try:
+            self._write(lines)
+        except Exception as e:
+            self._drop(len(lines), e)
+            # Reopen on the next batch (e.g. once the directory exists again)
+            if self._file is not None:
+                try:
+                    self._file.close()
+                except OSError:
+                    pass
+                self._file = None
+
+    def _write(self, lines):
+        if not lines:
+            return
+        data = "".join(lines)
+        if self._file is None:
+            self._file = open(self.log_file, "a", encoding="utf-8")
+        if self.max_bytes and self._file.tell() and self._file.tell() + len(data.encode("utf-8")) > self.max_bytes:
+            self._rotate()
+        self._file.write(data)
+        self._file.flush()
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.log_file}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.log_file}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.log_file, f"{self.log_file}.1")
+        else:
+            os.remove(self.log_file)
+        self._file = open(self.log_file, "a", encoding="utf-8")
+
+
+_loggers = {}
+_loggers_lock = threading.Lock()
+
+
+def get_logger(log_file, **options):
+    """Return the shared background logger for ``log_file``, starting it if needed."""
+    with _loggers_lock:
+        logger = _loggers.get(log_file)
+        if logger is None or logger._closed:
+            logger = BufferedJSONLLogger(log_file, **options)
+            _loggers[log_file] = logger
+        return logger
+
 
 def log_interaction(log_file, log_entry):
-    log_entry["timestamp"] = datetime.utcnow().isoformat()
-    with open(log_file, "a", encoding="utf-8") as f:
-        f.write(json.dumps(log_entry) + "\n")
\ No newline at end of file
+    get_logger(log_file).log(log_entry)
@@ -1,80 +1,352 @@
-import json
-import os
+import time
+
 from wrappers.history_wrapper import HistoryBasedWrapper
 from wrappers.query_budget_wrapper import QueryBudgetWrapper
 from wrappers.keyword_wrapper import KeywordFilterWrapper
 from wrappers.noop_wrapper import NoOpWrapper
 from wrappers.base import WrapperDecision
-from pipeline.logger import log_interaction
-from models.llm_client import BlackBoxLLM
-
-def load_config():
-    with open(os.path.join("config", "config.json"), "r") as f:
-        return json.load(f)
+from wrappers.matcher import matcher_from_config
+from wrappers.budget_store import budget_store_from_config
+from wrappers.redaction import redactor_from_config
+from pipeline.config import load_config
+# tail_jsonl used to live here; keep importing it from pipeline.runner working
+from pipeline.history_store import open_history, tail_jsonl
+from pipeline.logger import get_logger
+from pipeline.instrumentation import NULL_TIMER, get_stage_metrics, stage_timer
 
-CONFIG = load_config()
+def __getattr__(name):
+    # Backwards compatibility: ``CONFIG`` used to be loaded at import time
+    if name == "CONFIG":
+        return load_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-def run_pipeline(prompt, wrapper_type, model_instance, history_file):
-    # Load history
-    history = []
-    if os.path.exists(history_file):
-        with open(history_file, 'r') as f:
-            for line in f:
-                history.append(json.loads(line))
-
-    # Initialize Wrapper
-    banned = CONFIG["banned_keywords"]
+def build_wrapper(wrapper_type, config=None, session_id=None):
+    config = config or load_config()
+    banned = config["banned_keywords"]
+    matcher = matcher_from_config(config)
     if wrapper_type == "baseline":
-        wrapper = NoOpWrapper()
+        return NoOpWrapper()
     elif wrapper_type == "keyword":
-        wrapper = KeywordFilterWrapper(banned_keywords=banned)
+        return KeywordFilterWrapper(banned_keywords=banned, matcher=matcher)
     elif wrapper_type == "history":
-        wrapper = HistoryBasedWrapper(banned_keywords=banned, history_limit=CONFIG["history_limit"])
+        return HistoryBasedWrapper(
+            banned_keywords=banned, history_limit=config["history_limit"], matcher=matcher,
+            max_flagged_turns=config.get("history_max_flagged_turns", 2),
+        )
     elif wrapper_type == "query_budget":
-        wrapper = QueryBudgetWrapper(max_requeries=CONFIG["max_requeries"], banned_keywords=banned)
+        return QueryBudgetWrapper(
+            max_requeries=config["max_requeries"], banned_keywords=banned, matcher=matcher,
+            store=budget_store_from_config(config), session_id=session_id,
+            redact_first=config.get("redact_first", False),
+            max_redact_fraction=config.get("max_redact_fraction", 0.2),
+            redactor=redactor_from_config(config),
+        )
+    elif wrapper_type == "ngram":
+        # NumPy is only imported when this wrapper is selected
+        from wrappers.ngram_wrapper import NGramRiskWrapper
+        return NGramRiskWrapper(**config.get("ngram_scorer", {}))
     else:
         raise ValueError("Unknown wrapper")
 
-    raw_outputs = []
-    decisions = []
-    
-    current_prompt = prompt
-    # 1. First Generation
-    raw_output = model_instance.generate(current_prompt)
-    raw_outputs.append(raw_output)
-
-    # 2. Wrapper Check
-    decision, payload = wrapper.decide(prompt, raw_output, history)
-    decisions.append(decision.value)
-
-    # 3. REQUERY LOOP
-    while decision == WrapperDecision.REQUERY:
-        revised_prompt = payload["revised_prompt"] if payload else prompt
-        raw_output = model_instance.generate(revised_prompt)
+class Pipeline:
+    """Long-lived wrapper session around one model.
+
+    The wrapper is built once and the conversation history is a view from
+    ``open_history`` (config ``history_store``): the session's last
+    ``history_limit`` turns are cached in memory and new turns are written
+    through to the store. Pipelines can share one ``history`` view.
+    With ``stream`` enabled, outputs are judged chunk by chunk while they are
+    generated and decoding stops as soon as the wrapper reaches a verdict.
+    ``session_id`` selects the conversation and namespaces per-prompt state
+    such as requery budgets. With ``candidates`` enabled (wrappers that can
+    revise a prompt, i.e. query_budget), the sequential REQUERY loop is
+    replaced by sampling every candidate the budget allows in one batched
+    call; candidates are judged in order, and the first non-REQUERY decision
+    wins. This takes precedence over streaming.
+    A MODIFY decision returns the output with the wrapper's ``spans``
+    rewritten by the config ``redaction`` policy (see wrappers.redaction).
+    Unless config ``instrumentation.enabled`` is false, every log entry gets
+    per-stage ``timings_ms`` (see pipeline.instrumentation) and the stage
+    durations feed the process-wide histograms.
+    """
+
+    def __init__(self, wrapper_type, model_instance, history_file=None, config=None, history=None, stream=None,
+                 session_id=None, candidates=None):
+        self.config = config or load_config()
+        self.wrapper_type = wrapper_type
+        self.wrapper = build_wrapper(wrapper_type, self.config, session_id=session_id)
+        self.model = model_instance
+        self.history_file = history_file or self.config["history_file"]
+
+        self.instrumented = self.config.get("instrumentation", {}).get("enabled", True)
+        self.stage_metrics = get_stage_metrics()
+        self._owns_history = history is None
+        if history is None:
+            start = time.perf_counter()
+            history = open_history(self.config, self.history_file, session_id)
+            if self.instrumented:
+                self._observe("history_load", time.perf_counter() - start)
+        self.history = history
+        if stream is None:
+            stream = self.config.get("streaming", False)
+        self.stream = stream and hasattr(model_instance, "generate_stream")
+        if candidates is None:
+            candidates = self.config.get("parallel_candidates", False)
+        # Redaction-first wrappers rarely requery, so sampling requery candidates up front would be wasted
+        self.candidates = (candidates and hasattr(self.wrapper, "revise_prompt")
+                           and not self.wrapper.config.get("redact_first", False))
+        self.tokens_saved = 0
+        self.redactor = redactor_from_config(self.config)
+        requery_prefix = getattr(self.wrapper, "requery_prefix", None)
+        if requery_prefix and hasattr(model_instance, "add_prompt_prefix"):
+            # Requery prompts of pre-tokenized datasets are then looked up rather than encoded
+            model_instance.add_prompt_prefix(requery_prefix)
+        self.logger = get_logger(self.config["log_file"], **self.config.get("logging", {}))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._owns_history:
+            self.history.close()
+        store = getattr(self.wrapper, "store", None)
+        if store is not None:
+            store.close()
+
+    def _append_history(self, entry):
+        self.history.append(entry)
+
+    def _observe(self, stage, seconds):
+        self.stage_metrics.observe(self.model.model_name, self.wrapper_type, stage, seconds)
+
+    def _finish(self, prompt, raw_outputs, decisions, decision, tokens_saved=0, calls=None, timer=NULL_TIMER,
+                payload=None):
+        # Final Output
+        spans = None
+        if decision == WrapperDecision.BLOCK:
+            final_output = self.config["safe_refusal"]
+        elif decision == WrapperDecision.MODIFY:
+            spans = [[start, end] for start, end in (payload or {}).get("spans", ())]
+            final_output = self.redactor.apply(raw_outputs[-1], spans)
+        else:
+            final_output = raw_outputs[-1]
+
+        # Save History & Log (history keeps the raw output; MODIFY records what was redacted in it)
+        with timer.span("history"):
+            turn = {"user": prompt, "model": raw_outputs[-1]}
+            if spans is not None:
+                turn["redacted_spans"] = spans
+            turn.update(self.wrapper.annotate_turn(prompt, raw_outputs[-1], payload))
+            self._append_history(turn)
+
+        log_entry = {
+            "model": self.model.model_name,
+            "wrapper": self.wrapper_type,
+            "prompt": prompt,
+            "final_output": final_output,
+            "calls": calls or len(raw_outputs),
+            "decisions": decisions
+        }
+        if spans is not None:
+            log_entry["redacted_spans"] = spans
+        if self.candidates:
+            log_entry["unused_candidates"] = log_entry["calls"] - len(raw_outputs)
+        elif self.stream:
+            log_entry["tokens_saved"] = tokens_saved
+        if not timer.enabled:
+            self.logger.log(log_entry)
+            return final_output, log_entry["calls"]
+
+        log_entry["timings_ms"] = timer.finish()
+        self.stage_metrics.observe_timings(self.model.model_name, self.wrapper_type, log_entry["timings_ms"])
+        start = time.perf_counter()
+        self.logger.log(log_entry)
+        self._observe("log", time.perf_counter() - start)
+
+        return final_output, log_entry["calls"]
+
+    def run(self, prompt, first_output=None):
+        """Run one prompt through the model and wrapper; returns (final_output, calls).
+
+        ``first_output`` lets the caller supply an already generated first pass
+        (see run_fanout); it still counts as one call.
+        """
+        if self.candidates:
+            return self.run_batch(
+                [prompt],
+                batch_size=self.wrapper.config["max_requeries"] + 1,
+                first_outputs=None if first_output is None else [first_output],
+            )[0]
+
+        # Turns are only appended in _finish, so wrappers see the history as it was
+        history = self.history
+        timer = stage_timer(self.instrumented)
+        raw_outputs = []
+        decisions = []
+        tokens_saved = 0
+
+        # 1. First Generation & 2. Wrapper Check
+        if first_output is not None:
+            raw_output = first_output
+            with timer.span("decide"):
+                decision, payload = self.wrapper.decide(prompt, raw_output, history)
+        else:
+            raw_output, decision, payload, saved = self._generate_and_decide(prompt, prompt, 0, history, timer)
+            tokens_saved += saved
         raw_outputs.append(raw_output)
-        
-        decision, payload = wrapper.decide(prompt, raw_output, history)
         decisions.append(decision.value)
 
-    # 4. Final Output
-    if decision == WrapperDecision.BLOCK:
-        final_output = CONFIG["safe_refusal"]
-    else:
-        final_output = raw_outputs[-1]
-
-    # 5. Save History & Log
-    new_entry = {"user": prompt, "model": raw_outputs[-1]}
-    with open(history_file, "a") as f:
-        f.write(json.dumps(new_entry) + "\n")
-
-    log_entry = {
-        "model": model_instance.model_name,
-        "wrapper": wrapper_type,
-        "prompt": prompt,
-        "final_output": final_output,
-        "calls": len(raw_outputs),
-        "decisions": decisions
+        # 3. REQUERY LOOP
+        while decision == WrapperDecision.REQUERY:
+            revised_prompt = payload["revised_prompt"] if payload else prompt
+            raw_output, decision, payload, saved = self._generate_and_decide(
+                prompt, revised_prompt, len(raw_outputs), history, timer
+            )
+            tokens_saved += saved
+            raw_outputs.append(raw_output)
+            decisions.append(decision.value)
+
+        # 4. Final Output, History & Log
+        self.tokens_saved += tokens_saved
+        return self._finish(prompt, raw_outputs, decisions, decision, tokens_saved, timer=timer, payload=payload)
+
+    def _generate_and_decide(self, prompt, generation_prompt, attempt, history, timer):
+        """Generate from ``generation_prompt`` and judge it; returns (output, decision, payload, tokens_saved)."""
+        if not self.stream:
+            with timer.span("generate"):
+                raw_output = self.model.generate(generation_prompt, attempt=attempt)
+            with timer.span("decide"):
+                decision, payload = self.wrapper.decide(prompt, raw_output, history)
+            return raw_output, decision, payload, 0
+
+        stream = self.model.generate_stream(generation_prompt, attempt=attempt)
+        text = ""
+        try:
+            # Decoding happens while iterating; the nested decide spans are not counted as generate
+            with timer.span("generate"):
+                for chunk in stream:
+                    new_from = len(text)
+                    text += chunk
+                    with timer.span("decide"):
+                        verdict = self.wrapper.decide_partial(prompt, text, history, new_from)
+                    if verdict is not None:
+                        # The wrapper already knows the answer: stop decoding here
+                        stream.close()
+                        return text.strip(), verdict[0], verdict[1], stream.tokens_saved
+        finally:
+            stream.close()
+
+        raw_output = text.strip()
+        with timer.span("decide"):
+            decision, payload = self.wrapper.decide(prompt, raw_output, history)
+        return raw_output, decision, payload, 0
+
+    def _candidate_prompts(self, prompt, generation_prompt):
+        """Prompts for one generation round: just ``generation_prompt`` or, in
+        candidates mode, followed by one revised prompt per remaining requery."""
+        if not self.candidates:
+            return [generation_prompt]
+        extra = self.wrapper.remaining_requeries(prompt)
+        return [generation_prompt] + [self.wrapper.revise_prompt(prompt)] * extra
+
+    def _judge(self, prompt, outputs, history, raw_outputs, decisions):
+        """Judge ``outputs`` in order, as the REQUERY loop would have seen them,
+        stopping at the first decision that is not REQUERY."""
+        for raw_output in outputs:
+            decision, payload = self.wrapper.decide(prompt, raw_output, history)
+            raw_outputs.append(raw_output)
+            decisions.append(decision.value)
+            if decision != WrapperDecision.REQUERY:
+                break
+        return decision, payload
+
+    def run_batch(self, prompts, batch_size=8, first_outputs=None):
+        """Batched run: returns a list of (final_output, calls) in prompt order.
+
+        All prompts of the batch are judged against the history as it was when the
+        batch started. Prompts that get a REQUERY are collected and regenerated
+        together in follow-up batches until every prompt reaches a final decision.
+        In candidates mode each prompt's remaining requeries are generated in the
+        same batch up front; ``calls`` then counts every generated candidate.
+        """
+        prompts = list(prompts)
+        history = self.history
+        timers = [stage_timer(self.instrumented) for _ in prompts]
+
+        raw_outputs = [[] for _ in prompts]
+        decisions = [[] for _ in prompts]
+        calls = [0] * len(prompts)
+        final_decisions = [None] * len(prompts)
+        final_payloads = [None] * len(prompts)
+
+        # (index, prompt to generate from) for every prompt still waiting on a generation
+        pending = list(enumerate(prompts))
+        outputs = [[output] for output in first_outputs] if first_outputs is not None else None
+        while pending:
+            if outputs is None:
+                groups = [self._candidate_prompts(prompts[i], p) for i, p in pending]
+                start = time.perf_counter()
+                generated = iter(self.model.generate_batch(
+                    [p for group in groups for p in group],
+                    batch_size=batch_size,
+                    attempts=[len(raw_outputs[i]) + k for (i, _), group in zip(pending, groups) for k in range(len(group))],
+                ))
+                outputs = [[next(generated) for _ in group] for group in groups]
+                # Each prompt is charged its share of the batched call, by sequences generated
+                per_sequence = (time.perf_counter() - start) / sum(len(group) for group in groups)
+                for (i, _), group in zip(pending, groups):
+                    timers[i].add("generate", per_sequence * len(group))
+            requery = []
+            for (i, _), group in zip(pending, outputs):
+                calls[i] += len(group)
+                with timers[i].span("decide"):
+                    decision, payload = self._judge(prompts[i], group, history, raw_outputs[i], decisions[i])
+                if decision == WrapperDecision.REQUERY:
+                    requery.append((i, payload["revised_prompt"] if payload else prompts[i]))
+                else:
+                    final_decisions[i] = decision
+                    final_payloads[i] = payload
+            pending = requery
+            outputs = None
+
+        return [
+            self._finish(prompt, raw_outputs[i], decisions[i], final_decisions[i], calls=calls[i], timer=timers[i],
+                         payload=final_payloads[i])
+            for i, prompt in enumerate(prompts)
+        ]
+
+def run_fanout(prompt, pipelines):
+    """Generate once for ``prompt`` and let every pipeline judge that same output.
+
+    ``pipelines`` maps wrapper type to a Pipeline over the same model; only
+    wrappers that answer REQUERY cost extra model calls. Give every pipeline
+    its own history view (e.g. its own ``session_id``): a shared one would
+    fill each wrapper's window with the other wrappers' copies of the same
+    turn. Returns {wrapper_type: (final_output, calls)}.
+    """
+    model = next(iter(pipelines.values())).model
+    first_output = model.generate(prompt)
+    return {wrapper_type: p.run(prompt, first_output=first_output) for wrapper_type, p in pipelines.items()}
+
+def run_fanout_batch(prompts, pipelines, batch_size=8):
+    """Batched run_fanout: returns {wrapper_type: [(final_output, calls), ...]}."""
+    prompts = list(prompts)
+    model = next(iter(pipelines.values())).model
+    first_outputs = model.generate_batch(prompts, batch_size=batch_size)
+    return {
+        wrapper_type: p.run_batch(prompts, batch_size=batch_size, first_outputs=first_outputs)
+        for wrapper_type, p in pipelines.items()
     }
-    log_interaction(CONFIG["log_file"], log_entry)
 
-    return final_output, len(raw_outputs)
\ No newline at end of file
+def run_pipeline(prompt, wrapper_type, model_instance, history_file):
+    """Compatibility shim: one-shot Pipeline run for a single prompt."""
+    with Pipeline(wrapper_type, model_instance, history_file) as pipeline:
+        return pipeline.run(prompt)
+
+def run_pipeline_batch(prompts, wrapper_type, model_instance, history_file, batch_size=8):
+    """Compatibility shim: one-shot Pipeline run for a batch of prompts."""
+    with Pipeline(wrapper_type, model_instance, history_file) as pipeline:
+        return pipeline.run_batch(prompts, batch_size=batch_size)
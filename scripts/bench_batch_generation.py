@@ -0,0 +1,52 @@
+"""Compare per-prompt generation with BlackBoxLLM.generate_batch.
+
+Run `python -m scripts.bench_batch_generation --model Qwen/Qwen1.5-0.5B-Chat`
+from the project root. Prints prompts/sec for the per-prompt loop and for each
+batch size, on the first --limit prompts of the dataset.
+"""
+
+import argparse
+import json
+import time
+
+from models.llm_client import BlackBoxLLM
+
+
+def load_prompts(path, limit):
+    prompts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            prompts.append(json.loads(line)["text"])
+            if len(prompts) >= limit:
+                break
+    return prompts
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--model", required=True, help="Hugging Face model name")
+    p.add_argument("--hf-token", default=None)
+    p.add_argument("--dataset", default="data/risky_prompts.jsonl")
+    p.add_argument("--limit", type=int, default=32, help="Number of prompts to generate for")
+    p.add_argument("--batch-sizes", default="4,8,16", help="Comma-separated batch sizes to try")
+    args = p.parse_args()
+
+    prompts = load_prompts(args.dataset, args.limit)
+    llm = BlackBoxLLM(args.model, hf_token=args.hf_token)
+    llm.generate(prompts[0])  # warm-up
+
+    start = time.perf_counter()
+    for prompt in prompts:
+        llm.generate(prompt)
+    loop_rate = len(prompts) / (time.perf_counter() - start)
+    print(f"{'per-prompt':>12}: {loop_rate:.2f} prompts/sec")
+
+    for batch_size in (int(s) for s in args.batch_sizes.split(",")):
+        start = time.perf_counter()
+        llm.generate_batch(prompts, batch_size=batch_size)
+        rate = len(prompts) / (time.perf_counter() - start)
+        print(f"{'batch=' + str(batch_size):>12}: {rate:.2f} prompts/sec ({rate / loop_rate:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Sequential REQUERY loop vs. parallel candidate sampling on the FakeLLM backend.
+
+Run `python -m scripts.bench_candidates` from the project root. Both modes run
+the query_budget wrapper over the same prompts with the same deterministic
+FakeLLM, so their final outputs must agree; the script reports per-prompt
+wall-clock latency, model round trips and generated tokens for each.
+
+FakeLLM charges --latency-ms per model call and --token-latency-ms per
+generated token; a batch decodes its sequences in parallel, which is what
+candidate sampling trades extra (discarded) tokens for.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from models.fake_llm import FakeLLM
+from pipeline.config import load_config
+from pipeline.instrumentation import percentile
+from pipeline.runner import Pipeline
+
+
+def run_mode(prompts, config, candidates, args):
+    llm = FakeLLM(
+        banned_rate=args.banned_rate, banned_keywords=config["banned_keywords"], output_tokens=args.output_tokens,
+        latency_ms=args.latency_ms, token_latency_ms=args.token_latency_ms,
+    )
+    latencies, outcomes = [], []
+    with Pipeline("query_budget", llm, config=config, candidates=candidates) as pipeline:
+        for prompt in prompts:
+            start = time.perf_counter()
+            outcomes.append(pipeline.run(prompt))
+            latencies.append((time.perf_counter() - start) * 1000)
+    sequences = sum(calls for _, calls in outcomes)
+    return {
+        "outcomes": outcomes,
+        "total_s": sum(latencies) / 1000,
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+        "round_trips": llm.calls,
+        "tokens": sequences * args.output_tokens,
+        "blocked": sum(output == config["safe_refusal"] for output, _ in outcomes),
+    }
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--dataset", default="data/risky_prompts.jsonl")
+    p.add_argument("--limit", type=int, default=100)
+    p.add_argument("--banned-rate", type=float, default=0.5, help="Share of fake outputs containing a banned keyword")
+    p.add_argument("--output-tokens", type=int, default=50)
+    p.add_argument("--latency-ms", type=float, default=5.0, help="Fixed cost per model call")
+    p.add_argument("--token-latency-ms", type=float, default=0.2, help="Cost per decoded token (per batch step)")
+    args = p.parse_args()
+
+    with open(args.dataset, "r", encoding="utf-8") as f:
+        prompts = [json.loads(line)["text"] for line in f][:args.limit]
+
+    workdir = tempfile.mkdtemp(prefix="bench_candidates_")
+    config = dict(
+        load_config(),
+        log_file=os.path.join(workdir, "log.jsonl"),
+        history_file=os.path.join(workdir, "history.jsonl"),
+        history_store={"backend": "jsonl"},
+        budget_store={"backend": "memory"},
+        streaming=False,
+    )
+    results = {mode: run_mode(prompts, config, mode == "candidates", args) for mode in ("sequential", "candidates")}
+
+    print(f"{len(prompts)} prompts, max_requeries={config['max_requeries']}, banned_rate={args.banned_rate}")
+    print(f"{'mode':<12} {'total s':>8} {'p50 ms':>8} {'p99 ms':>8} {'round trips':>12} {'tokens':>8} {'blocked':>8}")
+    for mode, r in results.items():
+        print(f"{mode:<12} {r['total_s']:>8.2f} {r['p50_ms']:>8.1f} {r['p99_ms']:>8.1f} "
+              f"{r['round_trips']:>12} {r['tokens']:>8} {r['blocked']:>8}")
+
+    sequential, candidates = results["sequential"], results["candidates"]
+    agree = sum(a[0] == b[0] for a, b in zip(sequential["outcomes"], candidates["outcomes"]))
+    print(f"\nSpeedup {sequential['total_s'] / candidates['total_s']:.2f}x, "
+          f"token overhead {candidates['tokens'] / sequential['tokens'] - 1:+.1%}, "
+          f"final outputs agree on {agree}/{len(prompts)} prompts")
+    if agree != len(prompts):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
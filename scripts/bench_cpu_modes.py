@@ -0,0 +1,123 @@
+"""Compare BlackBoxLLM CPU inference modes: load time, tokens/sec, memory, agreement.
+
+Run `python -m scripts.bench_cpu_modes` from the project root (on a machine
+without a GPU). Every (model, mode) pair is measured in a fresh interpreter
+so load time and resident memory are not polluted by earlier runs:
+
+    default    torch_dtype="auto", torch's default threading
+    fp32       float32 with tuned threads and warm-up
+    int8       fp32 + dynamic int8 quantization of the Linear layers
+
+Generation is greedy for this benchmark so modes can be compared output by
+output: "exact" is the share of prompts whose output matches the default
+mode, "prefix" the mean share of leading tokens that match.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from pipeline.config import load_config
+
+MODES = {
+    "default": None,
+    "fp32": {"quantize_int8": False, "warmup": True},
+    "int8": {"quantize_int8": True, "warmup": True},
+}
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def measure(model_name, mode, prompts, max_new_tokens, threads):
+    """Load one model in one mode and generate for ``prompts`` (runs in the worker process)."""
+    from models.llm_client import BlackBoxLLM
+
+    cpu_mode = MODES[mode]
+    if cpu_mode is not None:
+        cpu_mode = dict(cpu_mode, intra_op_threads=threads, inter_op_threads=1)
+    rss_before = rss_mb()
+    llm = BlackBoxLLM(model_name, hf_token=load_config().get("hf_token"), cpu_mode=cpu_mode)
+    rss_loaded = rss_mb()
+    llm.generation_kwargs = {"max_new_tokens": max_new_tokens, "do_sample": False}
+
+    outputs = []
+    tokens = 0
+    start = time.perf_counter()
+    for prompt in prompts:
+        output = llm.generate(prompt)
+        outputs.append(output)
+        tokens += len(llm.tokenizer(output, add_special_tokens=False)["input_ids"])
+    elapsed = time.perf_counter() - start
+    return {
+        "load_s": llm.load_seconds,
+        "tokens_per_s": tokens / elapsed,
+        "rss_model_mb": rss_loaded - rss_before,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "outputs": outputs,
+        "token_ids": [llm.tokenizer(o, add_special_tokens=False)["input_ids"] for o in outputs],
+    }
+
+
+def agreement(reference, other):
+    exact = sum(a == b for a, b in zip(reference["outputs"], other["outputs"])) / len(reference["outputs"])
+    prefixes = []
+    for a, b in zip(reference["token_ids"], other["token_ids"]):
+        same = 0
+        for x, y in zip(a, b):
+            if x != y:
+                break
+            same += 1
+        prefixes.append(same / max(len(a), len(b), 1))
+    return exact, sum(prefixes) / len(prefixes)
+
+
+def main():
+    config = load_config()
+    p = argparse.ArgumentParser()
+    p.add_argument("--models", nargs="+", default=config["models"])
+    p.add_argument("--modes", default=",".join(MODES), help="Comma-separated modes to compare")
+    p.add_argument("--dataset", default="data/harmless_prompts.jsonl")
+    p.add_argument("--limit", type=int, default=16)
+    p.add_argument("--max-new-tokens", type=int, default=50)
+    p.add_argument("--threads", type=int, default=os.cpu_count(), help="intra-op threads for the tuned modes")
+    p.add_argument("--worker", nargs=2, metavar=("MODEL", "MODE"), help=argparse.SUPPRESS)
+    args = p.parse_args()
+
+    with open(args.dataset, "r", encoding="utf-8") as f:
+        prompts = [json.loads(line)["text"] for line in f][:args.limit]
+
+    if args.worker:
+        result = measure(*args.worker, prompts, args.max_new_tokens, args.threads)
+        print(json.dumps(result))
+        return
+
+    modes = args.modes.split(",")
+    print(f"{'model':<36} {'mode':<8} {'load s':>7} {'tok/s':>7} {'model MB':>9} {'peak MB':>8} {'exact':>6} {'prefix':>7}")
+    for model_name in args.models:
+        results = {}
+        for mode in modes:
+            proc = subprocess.run(
+                [sys.executable, "-m", "scripts.bench_cpu_modes", "--worker", model_name, mode,
+                 "--dataset", args.dataset, "--limit", str(args.limit),
+                 "--max-new-tokens", str(args.max_new_tokens), "--threads", str(args.threads)],
+                capture_output=True, text=True,
+            )
+            if proc.returncode != 0:
+                print(f"{model_name:<36} {mode:<8} failed: {proc.stderr.strip().splitlines()[-1:]}")
+                continue
+            results[mode] = r = json.loads(proc.stdout.strip().splitlines()[-1])
+            reference = results.get(modes[0], r)
+            exact, prefix = agreement(reference, r)
+            print(f"{model_name:<36} {mode:<8} {r['load_s']:>7.1f} {r['tokens_per_s']:>7.1f} "
+                  f"{r['rss_model_mb']:>9.0f} {r['peak_rss_mb']:>8.0f} {exact:>6.0%} {prefix:>7.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Micro-benchmark of HistoryBasedWrapper decide() latency as the history window grows.
+
+Run `python -m scripts.bench_history_window` from the project root.
+Compares deciding over a window of K turns annotated with their keyword
+matches (what Pipeline stores via annotate_turn) against rescanning the K
+turns' text on every decision, on model outputs taken from logs/history.jsonl.
+"""
+
+import argparse
+
+from pipeline.config import load_config
+from scripts.bench_keyword_matcher import load_outputs, time_per_call
+from wrappers.history_wrapper import HistoryBasedWrapper
+from wrappers.matcher import matcher_from_config
+
+
+def rescan_decide(wrapper, model_output, window):
+    # Per-turn matches recomputed on every decision
+    if wrapper.keyword_hits(model_output):
+        return True
+    flagged = sum(1 for turn in wrapper.recent_turns(window) if wrapper.keyword_hits(turn["model"]))
+    return flagged >= wrapper.config["max_flagged_turns"]
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--history", default="logs/history.jsonl", help="JSONL file with model outputs")
+    p.add_argument("--sizes", default="1,10,100,1000", help="Comma-separated history window sizes (K)")
+    p.add_argument("--outputs", type=int, default=200, help="Number of outputs to decide on")
+    p.add_argument("--repeat", type=int, default=3)
+    args = p.parse_args()
+
+    config = load_config()
+    matcher = matcher_from_config(config)
+    outputs = load_outputs(args.history, max(args.outputs, max(int(s) for s in args.sizes.split(","))))
+    print(f"{'K':>6} {'rescan us':>10} {'annotated us':>13} {'speedup':>8}")
+    for k in (int(s) for s in args.sizes.split(",")):
+        # Never reach the flagged-turn limit, so every decision looks at the whole window
+        wrapper = HistoryBasedWrapper(config["banned_keywords"], history_limit=k, matcher=matcher, max_flagged_turns=k + 1)
+        window = [{"user": "", "model": text} for text in outputs[:k]]
+        annotated = [dict(turn, **wrapper.annotate_turn("", turn["model"])) for turn in window]
+
+        sample = outputs[:args.outputs]
+        rescan = time_per_call(lambda t: rescan_decide(wrapper, t, window), sample, args.repeat)
+        indexed = time_per_call(lambda t: wrapper.decide("", t, annotated), sample, args.repeat)
+        print(f"{k:>6} {rescan * 1e6:>10.1f} {indexed * 1e6:>13.1f} {rescan / indexed:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Import-time report (`python -X importtime`) for the wrapper-only entry points.
+
+Run `python -m scripts.bench_import_time` from the project root. Each module is
+imported in a fresh interpreter; the script prints its cumulative import time
+and the slowest imports it pulled in, and exits non-zero if a module exceeds
+its budget or drags in a heavy backend dependency (torch, transformers, ...).
+
+Budgets are per module (``DEFAULT_BUDGETS_MS``) with headroom over what the
+module costs on a typical machine: serving.server pays ~150 ms for asyncio
+(and ssl) alone, pipeline.runner for the wrappers plus sqlite3 and the
+history/budget stores. --budget-ms sets one budget for every module.
+"""
+
+import argparse
+import subprocess
+import sys
+
+DEFAULT_BUDGETS_MS = {"wrappers": 100.0, "pipeline.runner": 250.0, "models": 150.0, "serving.server": 400.0}
+DEFAULT_MODULES = list(DEFAULT_BUDGETS_MS)
+HEAVY_MODULES = {"torch", "transformers", "pandas", "numpy"}
+
+
+def import_profile(module):
+    """Return [(name, self_us, cumulative_us)] for everything ``import module`` loads."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr}")
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    p.add_argument("--budget-ms", type=float, default=None,
+                   help="Max cumulative import time for every module (default: per-module budgets, else 150)")
+    p.add_argument("--top", type=int, default=5, help="Slowest imports to list per module")
+    args = p.parse_args()
+
+    failed = False
+    for module in args.modules:
+        rows = import_profile(module)
+        total_ms = next(cum for name, _, cum in rows if name == module) / 1000
+        heavy = sorted({name.split(".")[0] for name, _, _ in rows} & HEAVY_MODULES)
+        budget_ms = args.budget_ms or DEFAULT_BUDGETS_MS.get(module, 150.0)
+        over = total_ms > budget_ms
+        failed |= over or bool(heavy)
+
+        status = "OVER BUDGET" if over else "ok"
+        print(f"{module:<18} {total_ms:8.1f} ms / {budget_ms:.0f} ms  [{status}]"
+              + (f"  heavy deps: {', '.join(heavy)}" if heavy else ""))
+        for name, self_us, _ in sorted(rows, key=lambda r: r[1], reverse=True)[:args.top]:
+            print(f"    {self_us / 1000:7.1f} ms  {name}")
+
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Micro-benchmark of keyword wrapper decide() latency as the banned list grows.
+
+Run `python -m scripts.bench_keyword_matcher` from the project root.
+Compares the compiled matcher used by KeywordFilterWrapper against the old
+per-keyword substring loop on model outputs taken from logs/history.jsonl.
+"""
+
+import argparse
+import json
+import random
+import string
+import time
+
+from wrappers.keyword_wrapper import KeywordFilterWrapper
+from wrappers.matcher import KeywordMatcher
+
+
+def legacy_decide(banned_keywords, model_output):
+    output_lower = model_output.lower()
+    for keyword in banned_keywords:
+        if keyword.lower() in output_lower:
+            return True
+    return False
+
+
+def make_keywords(n, seed=0):
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < n:
+        words.add("".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(5, 12))))
+    return sorted(words)
+
+
+def load_outputs(path, limit):
+    outputs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            outputs.append(json.loads(line)["model"])
+            if len(outputs) >= limit:
+                break
+    return outputs
+
+
+def time_per_call(fn, outputs, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in outputs:
+            fn(text)
+    return (time.perf_counter() - start) / (repeat * len(outputs))
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--history", default="logs/history.jsonl", help="JSONL file with model outputs")
+    p.add_argument("--sizes", default="10,100,1000,10000", help="Comma-separated keyword list sizes")
+    p.add_argument("--outputs", type=int, default=200, help="Number of outputs to scan")
+    p.add_argument("--repeat", type=int, default=3)
+    args = p.parse_args()
+
+    outputs = load_outputs(args.history, args.outputs)
+    print(f"{'keywords':>9} {'build ms':>9} {'legacy us':>10} {'matcher us':>11} {'speedup':>8}")
+    for n in (int(s) for s in args.sizes.split(",")):
+        keywords = make_keywords(n)
+        start = time.perf_counter()
+        wrapper = KeywordFilterWrapper(banned_keywords=keywords, matcher=KeywordMatcher(keywords))
+        build = time.perf_counter() - start
+
+        legacy = time_per_call(lambda t: legacy_decide(keywords, t), outputs, args.repeat)
+        compiled = time_per_call(lambda t: wrapper.decide("", t, []), outputs, args.repeat)
+        print(f"{n:>9} {build * 1e3:>9.1f} {legacy * 1e6:>10.1f} {compiled * 1e6:>11.1f} {legacy / compiled:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
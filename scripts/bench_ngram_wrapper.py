@@ -0,0 +1,115 @@
+"""Accuracy and throughput of NGramRiskWrapper vs. KeywordFilterWrapper.
+
+Run `python -m scripts.bench_ngram_wrapper` from the project root.
+
+Accuracy is measured on a held-out split of data/risky_prompts.jsonl vs.
+data/harmless_prompts.jsonl, and the false-positive rate on model outputs to
+harmless prompts (logs/results_*_harmless.csv) that were neither
+trained on nor used for calibration; the wrapper scores outputs, so the
+output FPR is the number that matters in the pipeline. The n-gram scorer is
+trained and calibrated as in scripts.train_ngram_scorer on the rest (the
+shipped data/ngram_weights.npy has seen every example, so it is not used
+here), and the keyword wrapper uses config ``banned_keywords``. The table
+also shows the share of FakeLLM outputs without a banned keyword that each
+wrapper blocks, and of real outputs to risky prompts. Throughput is
+texts/sec for per-text decide() on both wrappers, and for the n-gram
+wrapper's decide_batch() at several batch sizes.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from models.fake_llm import FakeLLM
+from pipeline.config import load_config
+from scripts.train_ngram_scorer import calibrate_threshold, load_dataset, load_outputs, split_by_prompt
+from wrappers.base import WrapperDecision
+from wrappers.keyword_wrapper import KeywordFilterWrapper
+from wrappers.matcher import matcher_from_config
+from wrappers.ngram_wrapper import NGramRiskScorer, NGramRiskWrapper
+
+
+def classification_report(blocked, labels):
+    blocked, labels = np.asarray(blocked, dtype=bool), np.asarray(labels, dtype=bool)
+    tp = int(np.sum(blocked & labels))
+    return {
+        "accuracy": float(np.mean(blocked == labels)),
+        "precision": tp / max(int(blocked.sum()), 1),
+        "recall": tp / max(int(labels.sum()), 1),
+    }
+
+
+def texts_per_second(fn, texts, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(texts)
+    return repeat * len(texts) / (time.perf_counter() - start)
+
+
+def main():
+    config = load_config()
+    p = argparse.ArgumentParser()
+    p.add_argument("--risky", default="data/risky_prompts.jsonl")
+    p.add_argument("--harmless", default="data/harmless_prompts.jsonl")
+    p.add_argument("--outputs", default="logs/results_*_harmless.csv")
+    p.add_argument("--risky-outputs", default="logs/results_*_baseline_risky.csv")
+    p.add_argument("--test-fraction", type=float, default=0.3)
+    p.add_argument("--calibration-fraction", type=float, default=0.3, help="Share of harmless prompts whose outputs calibrate")
+    p.add_argument("--target-fpr", type=float, default=0.05)
+    p.add_argument("--threshold", type=float, default=config.get("ngram_scorer", {}).get("threshold"),
+                   help="Fixed threshold instead of calibrating one")
+    p.add_argument("--batch-sizes", default="1,8,64,512", help="Comma-separated decide_batch sizes")
+    p.add_argument("--repeat", type=int, default=20)
+    p.add_argument("--seed", type=int, default=0)
+    args = p.parse_args()
+
+    texts, labels = load_dataset(args.risky, args.harmless)
+    order = np.random.default_rng(args.seed).permutation(len(texts))
+    n_test = int(len(texts) * args.test_fraction)
+    test, train = order[:n_test], order[n_test:]
+    test_texts = [texts[i] for i in test]
+    rows, test_rows = split_by_prompt(load_outputs(args.outputs), args.test_fraction, args.seed)
+    rows, calibration_rows = split_by_prompt(rows, args.calibration_fraction / (1 - args.test_fraction), args.seed)
+    outputs, calibration, test_outputs = ([output for _, output in r] for r in (rows, calibration_rows, test_rows))
+    fake = FakeLLM(banned_keywords=config["banned_keywords"], seed=args.seed)
+    samples = {
+        "harmless out FPR": test_outputs,
+        "fake out FPR": [fake.generate(f"prompt {i}") for i in range(len(test))],
+        "risky out blocked": [output for _, output in load_outputs(args.risky_outputs)],
+    }
+
+    scorer = NGramRiskScorer.train([texts[i] for i in train] + outputs,
+                                   np.concatenate([labels[train], np.zeros(len(outputs), dtype=labels.dtype)]))
+    threshold = args.threshold
+    if threshold is None:
+        threshold = calibrate_threshold(scorer.score_batch(calibration), args.target_fpr) if calibration else 0.5
+    ngram = NGramRiskWrapper(threshold=threshold, scorer=scorer)
+    keyword = KeywordFilterWrapper(config["banned_keywords"], matcher=matcher_from_config(config))
+    wrappers = {"keyword": keyword, "ngram": ngram}
+
+    def decide_each(wrapper):
+        return lambda batch: [wrapper.decide("", text, [])[0] for text in batch]
+
+    print(f"{len(train)} train / {len(test)} held-out prompts, {len(outputs)} train / {len(calibration)} calibration / "
+          f"{len(test_outputs)} held-out harmless outputs, threshold={threshold:.4f}")
+    print(f"{'wrapper':<10} {'accuracy':>8} {'precision':>9} {'recall':>7} "
+          + " ".join(f"{name:>{len(name)}}" for name in samples) + f" {'decide texts/s':>15}")
+    for name, wrapper in wrappers.items():
+        blocked = [d == WrapperDecision.BLOCK for d in decide_each(wrapper)(test_texts)]
+        r = classification_report(blocked, labels[test])
+        shares = [np.mean([d == WrapperDecision.BLOCK for d in decide_each(wrapper)(sample)]) for sample in samples.values()]
+        rate = texts_per_second(decide_each(wrapper), texts, args.repeat)
+        print(f"{name:<10} {r['accuracy']:>8.3f} {r['precision']:>9.3f} {r['recall']:>7.3f} "
+              + " ".join(f"{share:>{len(column)}.1%}" for column, share in zip(samples, shares)) + f" {rate:>15,.0f}")
+
+    print(f"\n{'batch':>6} {'ngram decide_batch texts/s':>27}")
+    for size in map(int, args.batch_sizes.split(",")):
+        batch = (texts * (size // len(texts) + 1))[:size]
+        rate = texts_per_second(lambda b: ngram.decide_batch([""] * len(b), b, []), batch,
+                                max(1, args.repeat * len(texts) // size))
+        print(f"{size:>6} {rate:>27,.0f}")
+
+
+if __name__ == "__main__":
+    main()
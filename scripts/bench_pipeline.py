@@ -0,0 +1,196 @@
+"""Benchmark the pipeline's own per-prompt overhead on the FakeLLM backend.
+
+Run `python -m scripts.bench_pipeline --out bench_results.json` from the
+project root; add `--compare old_results.json` to diff against an earlier
+run (exits non-zero when a stage's p50 or p99 regressed past --threshold).
+
+Stages:
+    history_load      tail the last history_limit turns of a large history.jsonl
+    history_recent    the same from the SQLite HistoryStore (session index)
+    decide_<wrapper>  wrapper.decide() on one model output
+    run_<wrapper>     full Pipeline.run() incl. FakeLLM's small generation cost
+                      (query_budget includes the requery loop)
+    run_keyword_uninstrumented
+                      run_keyword with config instrumentation disabled
+                      (the difference is the cost of per-stage timings)
+    log_entry         enqueueing one log entry on the background logger
+
+Each stage reports p50/p99/mean latency in microseconds plus tracemalloc
+peak and retained bytes per operation. Nothing touches the real logs/.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+from models.fake_llm import FakeLLM
+from pipeline.logger import BufferedJSONLLogger
+from pipeline.config import load_config
+from pipeline.history_store import HistoryStore, tail_jsonl
+from pipeline.instrumentation import percentile
+from pipeline.runner import Pipeline, build_wrapper
+
+WRAPPERS = ["baseline", "keyword", "history", "query_budget"]
+
+
+def load_prompts(paths):
+    prompts = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            prompts.extend(json.loads(line)["text"] for line in f)
+    return prompts
+
+
+def measure(fn, args_list, iterations, alloc_iterations):
+    """Time fn(*args) per call, then re-run a shorter pass under tracemalloc."""
+    timings = []
+    for i in range(iterations):
+        args = args_list[i % len(args_list)]
+        start = time.perf_counter_ns()
+        fn(*args)
+        timings.append((time.perf_counter_ns() - start) / 1000)
+
+    peaks = []
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    for i in range(alloc_iterations):
+        args = args_list[i % len(args_list)]
+        tracemalloc.reset_peak()
+        start_current, _ = tracemalloc.get_traced_memory()
+        fn(*args)
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - start_current)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "iterations": iterations,
+        "p50_us": round(percentile(timings, 50), 3),
+        "p99_us": round(percentile(timings, 99), 3),
+        "mean_us": round(sum(timings) / len(timings), 3),
+        "peak_alloc_bytes": round(sum(peaks) / len(peaks)),
+        "retained_bytes_per_op": round((after - before) / alloc_iterations),
+    }
+
+
+def run_suite(args):
+    workdir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    config = load_config()
+    config = dict(
+        config,
+        log_file=os.path.join(workdir, "log.jsonl"),
+        history_file=os.path.join(workdir, "history.jsonl"),
+        history_store=dict(config.get("history_store", {}), path=os.path.join(workdir, "history.sqlite")),
+        streaming=False,
+    )
+    prompts = load_prompts(args.datasets)
+    llm = FakeLLM(banned_rate=args.banned_rate, banned_keywords=config["banned_keywords"])
+    outputs = [(p, llm.generate(p), []) for p in prompts]
+
+    with open(config["history_file"], "w", encoding="utf-8") as f:
+        for i in range(args.history_lines):
+            p, out, _ = outputs[i % len(outputs)]
+            f.write(json.dumps({"user": p, "model": out}) + "\n")
+
+    stages = {}
+    stages["history_load"] = measure(
+        tail_jsonl, [(config["history_file"], config["history_limit"])], args.iterations, args.alloc_iterations
+    )
+    store = HistoryStore(config["history_store"]["path"])
+    store.import_jsonl(config["history_file"])
+    stages["history_recent"] = measure(
+        store.recent, [("default", config["history_limit"])], args.iterations, args.alloc_iterations
+    )
+    store.close()
+    for wrapper_type in WRAPPERS:
+        wrapper = build_wrapper(wrapper_type, config)
+        stages[f"decide_{wrapper_type}"] = measure(wrapper.decide, outputs, args.iterations, args.alloc_iterations)
+    for wrapper_type in WRAPPERS:
+        with Pipeline(wrapper_type, llm, config=config) as pipeline:
+            stages[f"run_{wrapper_type}"] = measure(
+                pipeline.run, [(p,) for p in prompts], args.iterations, args.alloc_iterations
+            )
+    with Pipeline("keyword", llm, config=dict(config, instrumentation={"enabled": False})) as pipeline:
+        stages["run_keyword_uninstrumented"] = measure(
+            pipeline.run, [(p,) for p in prompts], args.iterations, args.alloc_iterations
+        )
+    with BufferedJSONLLogger(os.path.join(workdir, "bench_log.jsonl")) as logger:
+        entry = {"model": llm.model_name, "wrapper": "keyword", "prompt": prompts[0],
+                 "final_output": outputs[0][1], "calls": 1, "decisions": ["ALLOW"]}
+        stages["log_entry"] = measure(logger.log, [(entry,)], args.iterations, args.alloc_iterations)
+
+    return {"meta": run_metadata(args), "stages": stages}
+
+
+def run_metadata(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "iterations": args.iterations,
+        "banned_rate": args.banned_rate,
+        "history_lines": args.history_lines,
+    }
+
+
+def print_results(results):
+    print(f"{'stage':<22} {'p50 us':>10} {'p99 us':>10} {'mean us':>10} {'peak B':>9} {'kept B':>8}")
+    for name, s in results["stages"].items():
+        print(f"{name:<22} {s['p50_us']:>10.1f} {s['p99_us']:>10.1f} {s['mean_us']:>10.1f} "
+              f"{s['peak_alloc_bytes']:>9} {s['retained_bytes_per_op']:>8}")
+
+
+def compare(results, baseline, threshold):
+    """Print per-stage changes against ``baseline``; returns True if anything regressed."""
+    regressed = False
+    print(f"\nCompared with {baseline['meta'].get('commit') or 'baseline'} (threshold {threshold:.0%}):")
+    for name, s in results["stages"].items():
+        old = baseline["stages"].get(name)
+        if old is None:
+            print(f"  {name:<22} new stage")
+            continue
+        changes = {k: (s[k] - old[k]) / old[k] if old[k] else 0.0 for k in ("p50_us", "p99_us")}
+        flag = any(c > threshold for c in changes.values())
+        regressed |= flag
+        print(f"  {name:<22} p50 {changes['p50_us']:+7.1%}  p99 {changes['p99_us']:+7.1%}"
+              f"{'  REGRESSION' if flag else ''}")
+    return regressed
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--datasets", nargs="+", default=["data/risky_prompts.jsonl", "data/harmless_prompts.jsonl"])
+    p.add_argument("--iterations", type=int, default=2000)
+    p.add_argument("--alloc-iterations", type=int, default=200)
+    p.add_argument("--banned-rate", type=float, default=0.3, help="Share of fake outputs containing a banned keyword")
+    p.add_argument("--history-lines", type=int, default=100_000, help="Size of the synthetic history file")
+    p.add_argument("--out", default=None, help="Write results JSON here")
+    p.add_argument("--compare", default=None, help="Earlier results JSON to compare against")
+    p.add_argument("--threshold", type=float, default=0.10, help="Relative slowdown counted as a regression")
+    args = p.parse_args()
+
+    results = run_suite(args)
+    print_results(results)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.out}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
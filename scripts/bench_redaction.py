@@ -0,0 +1,86 @@
+"""Model calls saved by redaction-first query_budget vs. the REQUERY path.
+
+Run `python -m scripts.bench_redaction` from the project root. The
+query_budget wrapper runs over the same prompts with the same deterministic
+FakeLLM, once requerying every unsafe output (the default) and once per
+redaction policy with ``redact_first``. The script reports model calls,
+how many outputs were redacted (MODIFY) or blocked, and how many final
+outputs still contain a banned keyword.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+
+from models.fake_llm import FakeLLM
+from pipeline.config import load_config
+from pipeline.runner import Pipeline
+from wrappers.matcher import matcher_from_config
+from wrappers.redaction import POLICIES
+
+
+def run_mode(prompts, config, args):
+    llm = FakeLLM(banned_rate=args.banned_rate, banned_keywords=config["banned_keywords"], output_tokens=args.output_tokens)
+    matcher = matcher_from_config(config)
+    outcomes, modified = [], 0
+    with Pipeline("query_budget", llm, config=config) as pipeline:
+        for prompt in prompts:
+            output, calls = pipeline.run(prompt)
+            outcomes.append((output, calls))
+            # The history keeps the raw output of the last generation
+            modified += output not in (config["safe_refusal"], pipeline.history.recent(1)[0]["model"])
+    return {
+        "calls": sum(calls for _, calls in outcomes),
+        "modified": modified,
+        "blocked": sum(output == config["safe_refusal"] for output, _ in outcomes),
+        "unsafe": sum(matcher.contains(output) for output, _ in outcomes),
+    }
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--dataset", default="data/risky_prompts.jsonl")
+    p.add_argument("--limit", type=int, default=500)
+    p.add_argument("--banned-rate", type=float, default=0.5, help="Share of fake outputs containing a banned keyword")
+    p.add_argument("--output-tokens", type=int, default=50)
+    p.add_argument("--max-redact-fraction", type=float, default=None)
+    args = p.parse_args()
+
+    with open(args.dataset, "r", encoding="utf-8") as f:
+        prompts = [json.loads(line)["text"] for line in f][:args.limit]
+
+    base = load_config()
+    if args.max_redact_fraction is None:
+        args.max_redact_fraction = base.get("max_redact_fraction", 0.2)
+    modes = {"requery": {"redact_first": False}}
+    for policy in POLICIES:
+        modes[policy] = {"redact_first": True, "redaction": dict(base.get("redaction", {}), policy=policy)}
+
+    results = {}
+    for mode, options in modes.items():
+        workdir = tempfile.mkdtemp(prefix="bench_redaction_")
+        config = dict(
+            base,
+            log_file=os.path.join(workdir, "log.jsonl"),
+            history_file=os.path.join(workdir, "history.jsonl"),
+            history_store={"backend": "jsonl"},
+            budget_store={"backend": "memory"},
+            streaming=False,
+            parallel_candidates=False,
+            max_redact_fraction=args.max_redact_fraction,
+            **options,
+        )
+        results[mode] = run_mode(prompts, config, args)
+
+    baseline = results["requery"]["calls"]
+    print(f"{len(prompts)} prompts, max_requeries={base['max_requeries']}, banned_rate={args.banned_rate}, "
+          f"max_redact_fraction={args.max_redact_fraction}")
+    print(f"{'mode':<12} {'calls':>7} {'saved':>7} {'modified':>9} {'blocked':>8} {'unsafe':>7}")
+    for mode, r in results.items():
+        saved = 1 - r["calls"] / baseline
+        print(f"{mode:<12} {r['calls']:>7} {saved:>7.1%} {r['modified']:>9} {r['blocked']:>8} {r['unsafe']:>7}")
+
+
+if __name__ == "__main__":
+    main()
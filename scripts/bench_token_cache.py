@@ -0,0 +1,81 @@
+"""Tokenization time saved by the pre-tokenized corpus cache.
+
+Run `python -m scripts.bench_token_cache` from the project root (needs
+transformers; only the tokenizer is loaded). For every dataset prompt, and
+for the requery prompt QueryBudgetWrapper builds from it, the script times
+encoding with the model's tokenizer against looking the ids up in the
+memory-mapped corpora (the dataset's, and its requery-prefixed one), and
+checks the looked-up ids equal the tokenizer's for both. It also counts the
+requery prompts whose ids differ from the separately encoded prefix's ids
+followed by the prompt's, which is why requery prompts get their own corpus.
+--uses scales the per-prompt
+encoding cost to how often a prompt is sent during an experiment (one
+first pass per wrapper by default).
+"""
+
+import argparse
+import json
+import time
+
+from models.token_cache import load_or_build
+from pipeline.config import load_config
+from wrappers.query_budget_wrapper import REQUERY_PREFIX
+
+
+def seconds_per_call(fn, items, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            fn(item)
+    return (time.perf_counter() - start) / (repeat * len(items))
+
+
+def main():
+    config = load_config()
+    p = argparse.ArgumentParser()
+    p.add_argument("--model", default=config["models"][0], help="Model whose tokenizer to use")
+    p.add_argument("--datasets", nargs="+", default=["data/risky_prompts.jsonl", "data/harmless_prompts.jsonl"])
+    p.add_argument("--cache-dir", default=config.get("token_cache", {}).get("dir", "data/tokenized"))
+    p.add_argument("--uses", type=int, default=5, help="Times each prompt is sent to the model per experiment")
+    p.add_argument("--repeat", type=int, default=5)
+    args = p.parse_args()
+
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model, token=config.get("hf_token"))
+
+    def encode(text):
+        return tokenizer(text, add_special_tokens=False)["input_ids"]
+
+    prefix_ids = encode(REQUERY_PREFIX)
+    print(f"{'dataset':<34} {'prompts':>8} {'build s':>8} {'encode us':>10} {'lookup us':>10} "
+          f"{'requery enc us':>15} {'requery lookup us':>18} {'concat differs':>15}")
+    total_saved = 0.0
+    for dataset in args.datasets:
+        start = time.perf_counter()
+        corpus = load_or_build(dataset, tokenizer, args.cache_dir)
+        requery_corpus = load_or_build(dataset, tokenizer, args.cache_dir, prompt_prefix=REQUERY_PREFIX)
+        build = time.perf_counter() - start
+        with open(dataset, "r", encoding="utf-8") as f:
+            texts = [json.loads(line)["text"] for line in f if line.strip()]
+        if any(corpus.lookup(t).tolist() != encode(t) for t in texts):
+            raise SystemExit(f"{dataset}: corpus ids differ from the tokenizer's")
+        requery_ids = [encode(REQUERY_PREFIX + t) for t in texts]
+        if any(requery_corpus.lookup(REQUERY_PREFIX + t).tolist() != ids for t, ids in zip(texts, requery_ids)):
+            raise SystemExit(f"{dataset}: requery corpus ids differ from the tokenizer's")
+        concat_differs = sum(prefix_ids + encode(t) != ids for t, ids in zip(texts, requery_ids))
+
+        encode_s = seconds_per_call(encode, texts, args.repeat)
+        lookup_s = seconds_per_call(corpus.lookup, texts, args.repeat)
+        requery_encode_s = seconds_per_call(lambda t: encode(REQUERY_PREFIX + t), texts, args.repeat)
+        requery_lookup_s = seconds_per_call(requery_corpus.lookup, [REQUERY_PREFIX + t for t in texts], args.repeat)
+        total_saved += len(texts) * (args.uses * (encode_s - lookup_s) + requery_encode_s - requery_lookup_s)
+        print(f"{dataset:<34} {len(texts):>8} {build:>8.3f} {encode_s * 1e6:>10.1f} {lookup_s * 1e6:>10.1f} "
+              f"{requery_encode_s * 1e6:>15.1f} {requery_lookup_s * 1e6:>18.1f} {concat_differs:>15}")
+
+    print(f"\nEstimated tokenization time saved per experiment ({args.uses} uses + 1 requery per prompt): "
+          f"{total_saved:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,11 @@
 """Small script to verify package-style imports work: run `python -m scripts.check_package_imports`"""
 
-from models import BlackBoxLLM
+from models import FakeLLM
 from wrappers import NoOpWrapper, WrapperDecision
 
 
 def main():
-    m = BlackBoxLLM()
+    m = FakeLLM()
     w = NoOpWrapper()
     out = m.generate("test")
     decision, payload = w.decide("hi", out, [])
@@ -0,0 +1,90 @@
+"""Load generator for the local serving front-end (serving/server.py).
+
+Run `python -m scripts.load_test --concurrency 16 --requests 200` against a
+server started with `python -m serving.server`. Sends prompts from the
+dataset over keep-alive connections and reports p50/p99 latency, throughput
+and rejected (503) requests.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from pipeline.instrumentation import percentile
+
+
+def load_prompts(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line)["text"] for line in f]
+
+
+async def post(reader, writer, host, path, payload):
+    body = json.dumps(payload).encode("utf-8")
+    writer.write(
+        f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def client(host, port, prompts, counter, total, wrapper, latencies, statuses):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while counter[0] < total:
+            i = counter[0]
+            counter[0] += 1
+            payload = {"prompt": prompts[i % len(prompts)]}
+            if wrapper:
+                payload["wrapper"] = wrapper
+            start = time.perf_counter()
+            status, _ = await post(reader, writer, host, "/generate", payload)
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+async def run(args):
+    prompts = load_prompts(args.dataset)
+    counter = [0]
+    latencies = []
+    statuses = {}
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        client(args.host, args.port, prompts, counter, args.requests, args.wrapper, latencies, statuses)
+        for _ in range(args.concurrency)
+    ))
+    elapsed = time.perf_counter() - start
+
+    ok = statuses.get(200, 0)
+    print(f"requests:   {args.requests} ({args.concurrency} concurrent) in {elapsed:.2f}s")
+    print(f"statuses:   {dict(sorted(statuses.items()))}")
+    print(f"throughput: {ok / elapsed:.2f} req/s")
+    print(f"latency:    p50={percentile(latencies, 50):.1f}ms p99={percentile(latencies, 99):.1f}ms")
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8080)
+    p.add_argument("--dataset", default="data/risky_prompts.jsonl")
+    p.add_argument("--requests", type=int, default=200)
+    p.add_argument("--concurrency", type=int, default=16)
+    p.add_argument("--wrapper", default=None, help="Wrapper type to request (default: server's)")
+    args = p.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
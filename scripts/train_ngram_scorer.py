@@ -0,0 +1,134 @@
+"""Train the hashed n-gram risk scorer used by NGramRiskWrapper.
+
+Run `python -m scripts.train_ngram_scorer` from the project root. Reads
+data/risky_prompts.jsonl (label 1), data/harmless_prompts.jsonl (label 0) and
+the model outputs to harmless prompts in logs/results_*_harmless.csv (label 0).
+The wrapper scores model outputs, not prompts, so the outputs of half of those
+prompts are held out to calibrate the threshold: the lowest threshold (at
+least 0.5) that blocks at most ``--target-fpr`` of them. Reports k-fold
+cross-validated accuracy and the calibrated false-positive rate, then writes
+data/ngram_weights.npy plus its .json sidecar, which carries the threshold.
+"""
+
+import argparse
+import csv
+import glob
+import json
+
+import numpy as np
+
+from wrappers.ngram_wrapper import NGramHasher, NGramRiskScorer
+
+
+def load_texts(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line)["text"] for line in f if line.strip()]
+
+
+def load_dataset(risky_path, harmless_path):
+    risky, harmless = load_texts(risky_path), load_texts(harmless_path)
+    return risky + harmless, np.array([1] * len(risky) + [0] * len(harmless))
+
+
+def load_outputs(pattern):
+    """Distinct non-empty (prompt, output) rows of every results CSV matching ``pattern``."""
+    rows = {}
+    for path in sorted(glob.glob(pattern)):
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                if row["output"].strip():
+                    rows.setdefault(row["output"], row["prompt"])
+    return [(prompt, output) for output, prompt in rows.items()]
+
+
+def split_by_prompt(rows, fraction, seed):
+    """(prompt, output) rows of a shuffled ``fraction`` of the prompts vs. the rest: (rest, split).
+
+    Splitting by prompt keeps outputs of the same prompt (from different
+    models or wrappers) on one side.
+    """
+    prompts = sorted({prompt for prompt, _ in rows})
+    order = np.random.default_rng(seed).permutation(len(prompts))
+    held_out = {prompts[i] for i in order[:int(len(prompts) * fraction)]}
+    return [row for row in rows if row[0] not in held_out], [row for row in rows if row[0] in held_out]
+
+
+def calibrate_threshold(scores, target_fpr, minimum=0.5):
+    """Lowest threshold (at least ``minimum``) that blocks at most ``target_fpr`` of ``scores``.
+
+    ``scores`` are risk probabilities of harmless texts; a text is blocked
+    when its score is >= the threshold.
+    """
+    scores = np.sort(np.asarray(scores, dtype=np.float64))[::-1]
+    allowed = int(len(scores) * target_fpr)
+    if allowed >= len(scores):
+        return minimum
+    return max(minimum, float(np.nextafter(scores[allowed], np.inf)))
+
+
+def cross_validate(texts, labels, hasher, folds, seed, **train_kwargs):
+    """Mean accuracy over ``folds`` shuffled train/test splits."""
+    order = np.random.default_rng(seed).permutation(len(texts))
+    accuracies = []
+    for test in np.array_split(order, folds):
+        train = np.setdiff1d(order, test)
+        scorer = NGramRiskScorer.train([texts[i] for i in train], labels[train], hasher, **train_kwargs)
+        predicted = scorer.score_batch([texts[i] for i in test]) >= 0.5
+        accuracies.append(float(np.mean(predicted == labels[test])))
+    return float(np.mean(accuracies))
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--risky", default="data/risky_prompts.jsonl")
+    p.add_argument("--harmless", default="data/harmless_prompts.jsonl")
+    p.add_argument("--outputs", default="logs/results_*_harmless.csv",
+                   help="Glob of results CSVs whose outputs are harmless (label 0)")
+    p.add_argument("--calibration-fraction", type=float, default=0.5,
+                   help="Share of the harmless prompts whose outputs calibrate the threshold")
+    p.add_argument("--target-fpr", type=float, default=0.05,
+                   help="Maximum share of held-out harmless outputs the threshold may block")
+    p.add_argument("--out", default="data/ngram_weights.npy")
+    p.add_argument("--n-features", type=int, default=2**16, help="Hash space size (power of two)")
+    p.add_argument("--char-ngrams", type=int, nargs=2, default=(2, 4), metavar=("MIN", "MAX"))
+    p.add_argument("--word-ngrams", type=int, nargs=2, default=(1, 2), metavar=("MIN", "MAX"))
+    p.add_argument("--epochs", type=int, default=300)
+    p.add_argument("--learning-rate", type=float, default=2.0)
+    p.add_argument("--l2", type=float, default=1e-4)
+    p.add_argument("--folds", type=int, default=5, help="Cross-validation folds (0 to skip)")
+    p.add_argument("--seed", type=int, default=0)
+    args = p.parse_args()
+
+    texts, labels = load_dataset(args.risky, args.harmless)
+    rows, calibration_rows = split_by_prompt(load_outputs(args.outputs), args.calibration_fraction, args.seed)
+    outputs, calibration = [output for _, output in rows], [output for _, output in calibration_rows]
+    texts = texts + outputs
+    labels = np.concatenate([labels, np.zeros(len(outputs), dtype=labels.dtype)])
+    hasher = NGramHasher(args.n_features, args.char_ngrams, args.word_ngrams)
+    train_kwargs = {"epochs": args.epochs, "learning_rate": args.learning_rate, "l2": args.l2}
+    print(f"{len(texts)} texts ({int(labels.sum())} risky, {len(outputs)} model outputs), "
+          f"{len(calibration)} calibration outputs, {args.n_features} features")
+
+    cv_accuracy = None
+    if args.folds > 1:
+        cv_accuracy = cross_validate(texts, labels, hasher, args.folds, args.seed, **train_kwargs)
+        print(f"{args.folds}-fold CV accuracy: {cv_accuracy:.3f}")
+
+    scorer = NGramRiskScorer.train(texts, labels, hasher, **train_kwargs)
+    train_accuracy = float(np.mean((scorer.score_batch(texts) >= 0.5) == labels))
+    print(f"Training accuracy: {train_accuracy:.3f}")
+
+    threshold, calibration_fpr = 0.5, None
+    if calibration:
+        calibration_scores = scorer.score_batch(calibration)
+        threshold = calibrate_threshold(calibration_scores, args.target_fpr)
+        calibration_fpr = float(np.mean(calibration_scores >= threshold))
+        print(f"Threshold {threshold:.4f}: blocks {calibration_fpr:.1%} of {len(calibration)} held-out harmless outputs "
+              f"(target {args.target_fpr:.1%})")
+    scorer.save(args.out, threshold=threshold, examples=len(texts), cv_accuracy=cv_accuracy,
+                calibration_outputs=len(calibration), calibration_fpr=calibration_fpr, **train_kwargs)
+    print(f"Wrote {args.out} and {args.out}.json")
+
+
+if __name__ == "__main__":
+    main()
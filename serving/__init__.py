@@ -0,0 +1 @@
+"""Local serving front-end for the wrapper pipeline."""
@@ -0,0 +1,27 @@
+from collections import deque
+
+from pipeline.instrumentation import percentile
+
+
+class Metrics:
+    """Rolling per-request latency metrics (last ``window`` requests)."""
+
+    def __init__(self, window=10_000):
+        self.latencies_ms = deque(maxlen=window)
+        self.queue_ms = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.completed = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def snapshot(self):
+        latencies = list(self.latencies_ms)
+        queue_ms = list(self.queue_ms)
+        return {
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "latency_ms": {"p50": percentile(latencies, 50), "p99": percentile(latencies, 99)},
+            "queue_wait_ms": {"p50": percentile(queue_ms, 50), "p99": percentile(queue_ms, 99)},
+            "avg_batch_size": sum(self.batch_sizes) / len(self.batch_sizes) if self.batch_sizes else 0.0,
+        }
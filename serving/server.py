@@ -0,0 +1,326 @@
+"""Local asyncio HTTP/JSON front-end for the wrapper pipeline.
+
+Usage:
+    python -m serving.server --model Qwen/Qwen1.5-0.5B-Chat --wrapper keyword --port 8080
+
+Endpoints:
+    POST /generate   {"prompt": "...", "wrapper": "keyword", "session_id": "..."}
+                     -> {"output", "calls", "latency_ms"}
+    GET  /metrics    request counts, rejections, batch sizes and p50/p99 latency
+    GET  /metrics/prometheus
+                     per-stage pipeline duration histograms (Prometheus text format)
+    GET  /healthz
+
+Concurrent requests are grouped into micro-batches (up to --max-batch-size
+prompts, waiting at most --max-wait-ms for a batch to fill) and run through
+Pipeline.run_batch on a single worker thread, off the event loop. When more
+than --max-queue requests are waiting for one pipeline, or --max-in-flight
+across all of them, new ones are rejected with 503.
+
+Each (wrapper, session_id) pair gets its own Pipeline, hence its own
+conversation history and requery budgets; requests without a session_id
+share the default session. Pipelines are built on the worker thread (opening
+the history store may import a legacy JSONL history), and the default
+wrapper's is built before the server starts accepting connections and kept
+for good. Past --max-sessions pipelines, the least recently used idle ones
+are closed; their sessions are reopened from the history store on demand.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from pipeline.config import load_config
+from pipeline.instrumentation import get_stage_metrics
+from pipeline.runner import Pipeline
+from serving.metrics import Metrics
+
+MAX_BODY_BYTES = 1 << 20
+
+
+class MicroBatcher:
+    """Collects requests for one Pipeline and runs them in micro-batches."""
+
+    def __init__(self, pipeline, executor, metrics, max_batch_size=8, max_wait_ms=10, max_queue=256):
+        self.pipeline = pipeline
+        self.executor = executor
+        self.metrics = metrics
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.pending = 0
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def submit(self, prompt):
+        """Queue a prompt; raises asyncio.QueueFull when the backlog is at its limit."""
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((prompt, future, time.perf_counter()))
+        self.pending += 1
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        self.pending -= 1
+
+    @property
+    def idle(self):
+        """No request is queued or running."""
+        return self.pending == 0
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            started = time.perf_counter()
+            prompts = [prompt for prompt, _, _ in batch]
+            try:
+                outcomes = await loop.run_in_executor(self.executor, self._run_batch, prompts)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.metrics.batch_sizes.append(len(batch))
+            for (_, future, enqueued), outcome in zip(batch, outcomes):
+                self.metrics.queue_ms.append((started - enqueued) * 1000)
+                if not future.done():
+                    future.set_result(outcome)
+
+    def _run_batch(self, prompts):
+        if hasattr(self.pipeline.model, "generate_batch"):
+            return self.pipeline.run_batch(prompts, batch_size=self.max_batch_size)
+        return [self.pipeline.run(p) for p in prompts]
+
+    def close(self):
+        self._task.cancel()
+
+
+class WrapperServer:
+    def __init__(self, model_instance, default_wrapper, config=None, max_batch_size=8, max_wait_ms=10, max_queue=256,
+                 max_sessions=256, max_in_flight=1024):
+        self.model = model_instance
+        self.config = config or load_config()
+        self.default_wrapper = default_wrapper
+        self.batch_options = {"max_batch_size": max_batch_size, "max_wait_ms": max_wait_ms, "max_queue": max_queue}
+        self.metrics = Metrics()
+        # The model is not thread-safe: every batch runs on this one thread
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="generate")
+        self.max_sessions = max_sessions
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        # (wrapper, session_id) -> task building its MicroBatcher, least recently used first
+        self.batchers = OrderedDict()
+        # Requests waiting for a key's batcher to be built; it can't be evicted under them
+        self._waiting = {}
+
+    async def _start_batcher(self, wrapper_type, session_id):
+        pipeline = await asyncio.get_running_loop().run_in_executor(
+            self.executor, lambda: Pipeline(wrapper_type, self.model, config=self.config, session_id=session_id))
+        return MicroBatcher(pipeline, self.executor, self.metrics, **self.batch_options)
+
+    @staticmethod
+    def _close_batcher(task):
+        if not task.done() or task.cancelled() or task.exception() is not None:
+            return
+        batcher = task.result()
+        batcher.close()
+        batcher.pipeline.close()
+
+    def _evict_idle(self):
+        """Close least recently used idle pipelines until at most ``max_sessions`` are open."""
+        excess = len(self.batchers) - self.max_sessions
+        for key, task in list(self.batchers.items()):
+            if excess <= 0:
+                break
+            if key == (self.default_wrapper, None) or key in self._waiting or not task.done():
+                continue
+            if task.cancelled() or task.exception() is not None or task.result().idle:
+                del self.batchers[key]
+                self._close_batcher(task)
+                excess -= 1
+
+    async def _batcher(self, wrapper_type, session_id=None):
+        key = (wrapper_type, session_id)
+        if key in self.batchers:
+            self.batchers.move_to_end(key)
+        else:
+            # A task, so concurrent first requests for the same key share one Pipeline
+            self.batchers[key] = asyncio.ensure_future(self._start_batcher(wrapper_type, session_id))
+            self._evict_idle()
+        self._waiting[key] = self._waiting.get(key, 0) + 1
+        try:
+            return await self.batchers[key]
+        except Exception:
+            self.batchers.pop(key, None)
+            raise
+        finally:
+            self._waiting[key] -= 1
+            if not self._waiting[key]:
+                del self._waiting[key]
+
+    async def handle_generate(self, body):
+        try:
+            request = json.loads(body or b"{}")
+            prompt = request["prompt"]
+        except (ValueError, KeyError, TypeError):
+            return 400, {"error": "expected a JSON body with a 'prompt' field"}
+        if not isinstance(prompt, str):
+            return 400, {"error": "'prompt' must be a string"}
+        wrapper_type = request.get("wrapper", self.default_wrapper)
+        session_id = request.get("session_id")
+        if not isinstance(wrapper_type, str) or not (session_id is None or isinstance(session_id, str)):
+            return 400, {"error": "'wrapper' and 'session_id' must be strings"}
+
+        if self.in_flight >= self.max_in_flight:
+            # Checked across sessions: a fresh session_id would otherwise get a fresh queue
+            self.metrics.rejected += 1
+            return 503, {"error": "server overloaded, retry later"}
+
+        start = time.perf_counter()
+        self.in_flight += 1
+        try:
+            try:
+                batcher = await self._batcher(wrapper_type, session_id)
+            except ValueError as e:
+                return 400, {"error": str(e)}
+            try:
+                future = batcher.submit(prompt)
+            except asyncio.QueueFull:
+                self.metrics.rejected += 1
+                return 503, {"error": "server overloaded, retry later"}
+
+            try:
+                final_output, calls = await future
+            except Exception as e:
+                self.metrics.failed += 1
+                return 500, {"error": str(e)}
+        finally:
+            self.in_flight -= 1
+        latency_ms = (time.perf_counter() - start) * 1000
+        self.metrics.completed += 1
+        self.metrics.latencies_ms.append(latency_ms)
+        return 200, {"output": final_output, "calls": calls, "latency_ms": round(latency_ms, 3)}
+
+    async def route(self, method, path, body):
+        if method == "POST" and path == "/generate":
+            return await self.handle_generate(body)
+        if method == "GET" and path == "/metrics":
+            return 200, self.metrics.snapshot()
+        if method == "GET" and path == "/metrics/prometheus":
+            return 200, get_stage_metrics().prometheus()
+        if method == "GET" and path == "/healthz":
+            return 200, {"status": "ok"}
+        return 404, {"error": f"no route for {method} {path}"}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                try:
+                    length = int(headers.get("content-length", "0" if method != "POST" else ""))
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    # Without a usable length the body can't be delimited: answer and drop the connection
+                    status, payload = 400, {"error": "missing or malformed Content-Length"}
+                    keep_alive = False
+                elif length > MAX_BODY_BYTES:
+                    # Don't read the oversized body; answer and drop the connection
+                    status, payload = 413, {"error": "request body too large"}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    status, payload = await self.route(method, path, body)
+
+                if isinstance(payload, str):
+                    data, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4"
+                else:
+                    data, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8080):
+        await self._batcher(self.default_wrapper)
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Serving {self.model.model_name} on http://{host}:{port} (default wrapper: {self.default_wrapper})")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in self.batchers.values():
+                self._close_batcher(task)
+            self.executor.shutdown()
+
+
+def main():
+    from models.registry import build_model
+
+    config = load_config()
+    p = argparse.ArgumentParser()
+    p.add_argument("--model", default=config["models"][0], help="Model name")
+    p.add_argument("--backend", default=None, help="Model backend (default: config 'backend', else hf)")
+    p.add_argument("--wrapper", default="keyword", help="Default wrapper type for requests that don't name one")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8080)
+    p.add_argument("--max-batch-size", type=int, default=8)
+    p.add_argument("--max-wait-ms", type=float, default=10)
+    p.add_argument("--max-queue", type=int, default=256, help="Waiting requests per wrapper before rejecting with 503")
+    p.add_argument("--max-in-flight", type=int, default=1024, help="Requests across all wrappers before rejecting with 503")
+    p.add_argument("--max-sessions", type=int, default=256, help="Open pipelines before idle ones are closed")
+    args = p.parse_args()
+
+    llm = build_model(args.model, config, backend=args.backend)
+    server = WrapperServer(
+        llm, args.wrapper, config=config,
+        max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms, max_queue=args.max_queue,
+        max_sessions=args.max_sessions, max_in_flight=args.max_in_flight,
+    )
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import sys
 import os
+import json
 # ensure project root is on sys.path so tests can import the package
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
@@ -7,6 +8,16 @@ from wrappers.keyword_wrapper import KeywordFilterWrapper
 from wrappers.history_wrapper import HistoryBasedWrapper
 from wrappers.query_budget_wrapper import QueryBudgetWrapper
 from wrappers.base import WrapperDecision
+from wrappers.matcher import KeywordMatcher, get_matcher
+from models.pool import ModelPool
+from pipeline.history_store import HistoryStore, SessionHistory, open_history
+from wrappers.budget_store import InMemoryBudgetStore, SQLiteBudgetStore, budget_key, budget_store_from_config
+from experiments.streaming_io import CheckpointedCSVWriter, checkpoint_offset, iter_prompts, shard_ranges
+from pipeline.instrumentation import NULL_TIMER, StageMetrics, stage_timer
+from wrappers.ngram_wrapper import NGramHasher, NGramRiskScorer, NGramRiskWrapper
+from wrappers.redaction import Redactor
+from scripts.train_ngram_scorer import calibrate_threshold
+from models.token_cache import TokenizedCorpus, build_corpus, corpus_prefix
 
 
 def fail(msg):
@@ -31,6 +42,20 @@ for i in range(5):
     hw.decide(f"p{i}", "ok", hist)
 if len(hist) > hw.config["history_limit"]:
     fail("History should be trimmed to history_limit")
+# Per-turn keyword matches are stored with each turn and counted over the window
+hw = HistoryBasedWrapper(banned_keywords=["hack"], history_limit=3, max_flagged_turns=2)
+decision, payload = hw.decide("p", "how to hack it", [])
+turns = [{"user": "p", "model": "how to hack it", **hw.annotate_turn("p", "how to hack it", payload)}]
+if turns[0].get("keyword_hits") != ["hack"]:
+    fail("HistoryBasedWrapper.annotate_turn should store the hits the decision found")
+turns.append({"user": "p", "model": "hack again"})  # unannotated turn, backfilled on first read
+decision, payload = hw.decide("p", "hack", turns)
+if decision != WrapperDecision.BLOCK or turns[1].get("keyword_hits") != ["hack"] or not payload.get("window_flagged"):
+    fail("HistoryBasedWrapper should BLOCK once max_flagged_turns recent turns were flagged")
+if hw.decide_partial("p", "fi", turns, 0) != (decision, payload):
+    fail("A flagged window should block a streamed output at its first chunk, as decide() does")
+if hw.decide("p", "fine", turns + [{"user": "p", "model": "hack", **hw.annotate_turn("p", "hack", payload)}] * 2)[0] != WrapperDecision.ALLOW:
+    fail("Turns blocked by the window check alone should not keep the window flagged")
 
 # Query budget wrapper test
 qb = QueryBudgetWrapper(max_requeries=2, banned_keywords=["bomb"]) 
@@ -53,4 +78,401 @@ d_ok, _ = qb.decide("Other prompt", "Safe content here", [])
 if d_ok != WrapperDecision.ALLOW:
     fail("QueryBudget should ALLOW safe outputs")
 
+# Keyword matcher tests
+m = KeywordMatcher(["kill", "ignore previous instructions", "bomb", "bombs"])
+found = m.find_all("Skill the BOMBS, then Ignore previous instructions")
+if [(f.start, f.end, f.keyword) for f in found] != [(1, 5, "kill"), (10, 15, "bombs"), (22, 50, "ignore previous instructions")]:
+    fail("KeywordMatcher should return leftmost-longest matches with offsets")
+if KeywordMatcher(["kill"], word_boundary=True).search("skill") is not None:
+    fail("KeywordMatcher word_boundary mode should not match inside words")
+if KeywordMatcher(["Kill"], case_insensitive=False).search("kill") is not None:
+    fail("KeywordMatcher should be case-sensitive when case_insensitive=False")
+if get_matcher(["bomb"]) is not get_matcher(["bomb"]):
+    fail("get_matcher should share one compiled matcher per keyword list")
+if KeywordFilterWrapper(banned_keywords=["bomb"]).matcher is not QueryBudgetWrapper(banned_keywords=["bomb"]).matcher:
+    fail("Keyword-based wrappers should share the compiled matcher")
+
+# Incremental (streaming) decisions
+kw = KeywordFilterWrapper(banned_keywords=["weapon"])
+if kw.decide_partial("q", "a harmless wea", [], 0) is not None:
+    fail("KeywordFilterWrapper.decide_partial should stay undecided without a match")
+verdict = kw.decide_partial("q", "a harmless weapon", [], len("a harmless wea"))
+if verdict is None or verdict[0] != WrapperDecision.BLOCK:
+    fail("KeywordFilterWrapper.decide_partial should catch keywords spanning chunks")
+if KeywordMatcher(["kill"], word_boundary=True).search_incremental("skill or kill", 10) is not None:
+    fail("Word-boundary matches at the end of a partial output should wait for more text")
+boundary_matcher = KeywordMatcher(["kill"], word_boundary=True)
+chunks, streamed, found = ["a kill", " now"], "", []
+for chunk in chunks:
+    new_from, streamed = len(streamed), streamed + chunk
+    found.append(boundary_matcher.search_incremental(streamed, new_from))
+if found[0] is not None or found[1] is None or found[1].start != 2:
+    fail("A word-boundary match held back at a chunk boundary should be reported with the next chunk")
+qb = QueryBudgetWrapper(max_requeries=1, banned_keywords=["bomb"])
+verdict = qb.decide_partial("p", "a bo", [], 0), qb.decide_partial("p", "a bomb", [], 4)
+if verdict[0] is not None or verdict[1][0] != WrapperDecision.REQUERY:
+    fail("QueryBudgetWrapper.decide_partial should REQUERY once a keyword completes")
+
+# Candidate sampling hooks
+qb = QueryBudgetWrapper(max_requeries=2, banned_keywords=["bomb"])
+qb.decide("p", "bomb", [])
+if qb.remaining_requeries("p") != 1 or qb.remaining_requeries("other") != 2:
+    fail("QueryBudgetWrapper.remaining_requeries should reflect the prompt's used budget")
+if qb.decide("p", "bomb", [])[1]["revised_prompt"] != qb.revise_prompt("p"):
+    fail("QueryBudgetWrapper REQUERY payload should use revise_prompt")
+
+# Budget stores
+store = InMemoryBudgetStore(max_entries=2)
+for key in ("a", "b", "a", "c"):
+    store.increment(key)
+if len(store) != 2 or store.get("b") != 0 or store.get("a") != 2:
+    fail("InMemoryBudgetStore should evict the least recently used key past max_entries")
+if InMemoryBudgetStore(ttl_seconds=0).increment("a") != 1 or budget_key("p") == budget_key("p", "s1"):
+    fail("Budget keys should be namespaced by session id")
+import tempfile
+with tempfile.TemporaryDirectory() as tmp:
+    path = os.path.join(tmp, "budgets.sqlite")
+    shared = [SQLiteBudgetStore(path), SQLiteBudgetStore(path)]
+    qbs = [QueryBudgetWrapper(max_requeries=1, banned_keywords=["bomb"], store=s) for s in shared]
+    decisions = [qbs[0].decide("p", "bomb", [])[0], qbs[1].decide("p", "bomb", [])[0]]
+    if decisions != [WrapperDecision.REQUERY, WrapperDecision.BLOCK]:
+        fail("QueryBudgetWrappers sharing a SQLiteBudgetStore should share the budget")
+    for s in shared:
+        s.close()
+
+# History store
+with tempfile.TemporaryDirectory() as tmp:
+    jsonl = os.path.join(tmp, "history.jsonl")
+    with open(jsonl, "w") as f:
+        for i in range(10):
+            f.write(json.dumps({"user": f"u{i}", "model": f"m{i}"}) + "\n")
+    store = HistoryStore(os.path.join(tmp, "history.sqlite"))
+    if store.import_jsonl(jsonl) != 10 or store.import_jsonl(jsonl) != 0:
+        fail("HistoryStore.import_jsonl should import a file once")
+    store.append("other", {"user": "x", "model": "y", "flag": 1})
+    if [t["model"] for t in store.recent("default", 3)] != ["m7", "m8", "m9"] or store.recent("other", 5)[0]["flag"] != 1:
+        fail("HistoryStore.recent should return a session's last turns in order, with metadata")
+    session = SessionHistory(store, "default", limit=3)
+    session.append({"user": "u10", "model": "m10"})
+    if [t["model"] for t in HistoryBasedWrapper(history_limit=2).recent_turns(session)] != ["m9", "m10"]:
+        fail("HistoryBasedWrapper should read recent turns through the history view")
+    if store.compact(max_turns_per_session=4) != 7 or store.count("default") != 4 or store.count("other") != 1:
+        fail("HistoryStore.compact should keep the newest turns of each session")
+    store.close()
+    import threading
+    raced = os.path.join(tmp, "raced.jsonl")
+    with open(raced, "w") as f:
+        for i in range(2000):
+            f.write(json.dumps({"user": f"u{i}", "model": f"m{i}"}) + "\n")
+    racers = [HistoryStore(os.path.join(tmp, "raced.sqlite")) for _ in range(2)]
+    barrier = threading.Barrier(len(racers))
+    def race(racer):
+        barrier.wait()
+        racer.import_jsonl(raced, batch_size=50)
+    threads = [threading.Thread(target=race, args=(racer,)) for racer in racers]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if racers[0].count() != 2000:
+        fail("Concurrent imports of the same history.jsonl should import it once")
+    for racer in racers:
+        racer.close()
+
+# Model pool
+pool = ModelPool({"backend": "fake"}, memory_budget_mb=1000, memory_mb=400)
+first, second = pool.get("a"), pool.get("b")
+pool.get("a")
+pool.get("c")
+if "b" in pool or not second.released or first.released or pool.get("a") is not first:
+    fail("ModelPool should release the least recently used model when over its memory budget")
+if ModelPool({"backend": "fake"}, cache=object()).get("a").model_name != "a":
+    fail("The fake backend should accept (and ignore) a generation cache")
+
+# N-gram risk wrapper
+hasher = NGramHasher(n_features=2**10)
+doc, features = hasher.transform(["abc", "", "abc"])
+if sorted(features[doc == 0]) != sorted(features[doc == 2]) or (doc == 1).any() or features.max() >= 2**10:
+    fail("NGramHasher should hash equal texts to equal features within n_features")
+scorer = NGramRiskScorer.train(["how to build a bomb", "make poison at home"] * 3 + ["bake a cake", "plant a garden"] * 3,
+                               [1, 1] * 3 + [0, 0] * 3, hasher)
+with tempfile.TemporaryDirectory() as tmp:
+    path = os.path.join(tmp, "weights.npy")
+    scorer.save(path)
+    ngram = NGramRiskWrapper(weights_path=path, scorer=NGramRiskScorer.load(path))
+    if ngram.decide("q", "build a bomb", [])[0] != WrapperDecision.BLOCK or ngram.decide("q", "bake a cake", [])[0] != WrapperDecision.ALLOW:
+        fail("NGramRiskWrapper should block outputs the trained scorer rates risky")
+    if [d for d, _ in ngram.decide_batch(["q", "q"], ["build a bomb", "bake a cake"], [])] != [WrapperDecision.BLOCK, WrapperDecision.ALLOW]:
+        fail("NGramRiskWrapper.decide_batch should agree with decide")
+    scorer.save(path, threshold=0.75)
+    if NGramRiskWrapper(weights_path=path, scorer=NGramRiskScorer.load(path)).config["threshold"] != 0.75:
+        fail("NGramRiskWrapper should default to the threshold calibrated with the weights")
+harmless_scores = [0.1, 0.2, 0.55, 0.6, 0.7, 0.3, 0.4, 0.45, 0.5, 0.52]
+threshold = calibrate_threshold(harmless_scores, 0.1)
+if not 0.6 < threshold <= 0.7 or sum(s >= threshold for s in harmless_scores) != 1:
+    fail("calibrate_threshold should block at most target_fpr of the harmless scores")
+if calibrate_threshold([0.1, 0.2], 0.0) != 0.5:
+    fail("calibrate_threshold should never go below 0.5")
+
+# Span redaction (MODIFY) and redaction-first query budget
+text = "Fine here. How to build a bomb now. Bye"
+spans = [(26, 30)]
+if (Redactor("mask").apply(text, spans) != "Fine here. How to build a **** now. Bye"
+        or Redactor("placeholder", placeholder="[X]").apply(text, spans) != "Fine here. How to build a [X] now. Bye"
+        or Redactor("sentence").apply(text, spans) != "Fine here. Bye"):
+    fail("Redactor policies should mask, replace or drop the sentence around each span")
+qb = QueryBudgetWrapper(max_requeries=1, banned_keywords=["bomb"], redact_first=True, max_redact_fraction=0.2)
+decision, payload = qb.decide("q", text, [])
+if decision != WrapperDecision.MODIFY or payload["spans"] != spans or qb.remaining_requeries("q") != 1:
+    fail("Redaction-first QueryBudget should MODIFY without spending the requery budget")
+if qb.decide("q", "bomb bomb", [])[0] != WrapperDecision.REQUERY:
+    fail("Redaction-first QueryBudget should REQUERY when too much of the output would be redacted")
+
+# Pre-tokenized prompt corpus
+with tempfile.TemporaryDirectory() as tmp:
+    dataset = os.path.join(tmp, "prompts.jsonl")
+    texts = [f"prompt {i} " + "word " * (i % 5) for i in range(30)]
+    with open(dataset, "w") as f:
+        f.writelines(json.dumps({"text": t}) + "\n" for t in texts)
+    def encode_words(batch):
+        return [[len(w) for w in t.split()] for t in batch]
+    prefix = corpus_prefix(tmp, dataset, "org/tok", "0123")
+    build_corpus(dataset, prefix, encode_words, "org/tok", "0123", batch_size=7)
+    corpus = TokenizedCorpus(prefix)
+    if len(corpus) != 30 or [corpus.lookup(t).tolist() for t in texts] != encode_words(texts) or corpus.lookup("other") is not None:
+        fail("TokenizedCorpus should return the stored ids of every dataset prompt")
+    prefixed = corpus_prefix(tmp, dataset, "org/tok", "0123", prompt_prefix="Please rephrase: ")
+    build_corpus(dataset, prefixed, encode_words, "org/tok", "0123", prompt_prefix="Please rephrase: ")
+    requery = TokenizedCorpus(prefixed)
+    if (prefixed == prefix or requery.lookup(texts[3]) is not None
+            or [requery.lookup("Please rephrase: " + t).tolist() for t in texts] != encode_words(["Please rephrase: " + t for t in texts])):
+        fail("A prefixed corpus should store and key the ids of prefix + prompt")
+    with open(dataset, "a") as f:
+        f.write(json.dumps({"text": "new"}) + "\n")
+    if not corpus.is_stale():
+        fail("A corpus should be stale once its dataset changes")
+
+# Stage instrumentation
+timer = stage_timer()
+with timer.span("generate"):
+    with timer.span("decide"):
+        sum(range(10000))
+timings = timer.finish()
+if timings["decide"] <= timings["generate"] or timings["total"] < timings["decide"] + timings["generate"]:
+    fail("Nested spans should be excluded from the enclosing span's time")
+if stage_timer(False) is not NULL_TIMER or NULL_TIMER.finish() is not None:
+    fail("Disabled instrumentation should use the no-op timer")
+stage_metrics = StageMetrics()
+stage_metrics.observe_timings("m", "keyword", {"decide": 0.02, "total": 2000.0})
+if 'pipeline_stage_seconds_bucket{model="m",wrapper="keyword",stage="total",le="+Inf"} 1' not in stage_metrics.prometheus():
+    fail("StageMetrics.prometheus should export cumulative histogram buckets")
+
+# Streaming experiment I/O
+with tempfile.TemporaryDirectory() as tmp:
+    dataset = os.path.join(tmp, "prompts.jsonl")
+    with open(dataset, "w") as f:
+        for i in range(50):
+            f.write(json.dumps({"text": f"prompt {i} " + "x" * (i % 7)}) + "\n")
+    sharded = [text for start, end in shard_ranges(dataset, 4) for _, text in iter_prompts(dataset, start, end)]
+    if sharded != [text for _, text in iter_prompts(dataset)]:
+        fail("shard_ranges should split a dataset into line-aligned ranges covering every prompt once")
+    results = os.path.join(tmp, "results.csv")
+    with CheckpointedCSVWriter(results, ["prompt", "calls"], chunk_size=10, sum_columns=("calls",)) as writer:
+        for offset, text in iter_prompts(dataset, limit=25):
+            writer.write({"prompt": text, "calls": 1}, offset)
+        writer._pending = []  # simulate a crash: the unfinished chunk is lost
+    with CheckpointedCSVWriter(results, ["prompt", "calls"], chunk_size=10, sum_columns=("calls",)) as writer:
+        for offset, text in iter_prompts(dataset, start=writer.offset):
+            writer.write({"prompt": text, "calls": 1}, offset)
+    with open(results) as f:
+        written = [line.split(",")[0] for line in f.read().splitlines()[1:]]
+    if written != [text for _, text in iter_prompts(dataset)] or writer.state["sums"]["calls"] != 50:
+        fail("CheckpointedCSVWriter should resume after its last checkpointed chunk")
+    if checkpoint_offset(results) != os.path.getsize(dataset):
+        fail("A finished run's checkpoint should reach the end of its dataset")
+    run_id = writer.state["run_id"]
+    with CheckpointedCSVWriter(results, ["prompt", "calls"], chunk_size=10, sum_columns=("calls",)) as writer:
+        if writer.state["run_id"] != run_id:
+            fail("A resumed run should keep its run id")
+    with CheckpointedCSVWriter(results, ["prompt", "calls"], restart=True) as writer:
+        if writer.state["run_id"] == run_id:
+            fail("A restarted run should get a new run id")
+
+# Resuming an interrupted run rewinds its history session and requery budgets
+import experiments.run_batch as run_batch
+with tempfile.TemporaryDirectory() as tmp:
+    dataset = os.path.join(tmp, "prompts.jsonl")
+    with open(dataset, "w") as f:
+        for i in range(30):
+            f.write(json.dumps({"text": f"prompt {i}"}) + "\n")
+    saved_config = run_batch.CONFIG
+    run_batch.CONFIG = dict(saved_config, history_store={"backend": "sqlite", "path": os.path.join(tmp, "history.sqlite")},
+                            budget_store={"backend": "sqlite", "path": os.path.join(tmp, "budgets.sqlite")})
+    try:
+        results = os.path.join(tmp, "results.csv")
+        with CheckpointedCSVWriter(results, ["prompt"], chunk_size=10) as writer:
+            session_id = run_batch.run_session("m", "query_budget", "risky", tmp, run_id=writer.state["run_id"])
+            history = open_history(run_batch.CONFIG, session_id=session_id)
+            budgets = budget_store_from_config(run_batch.CONFIG)
+            for offset, text in iter_prompts(dataset, limit=15):
+                history.append({"user": text, "model": "out"})
+                budgets.increment(budget_key(text, session_id))
+                writer.write({"prompt": text}, offset)
+            writer._pending = []  # simulate a crash after the first chunk
+        with CheckpointedCSVWriter(results, ["prompt"], chunk_size=10) as writer:
+            run_batch.rewind_runs([writer], [session_id], dataset, writer.offset)
+        store = history.store
+        if store.count(session_id) != 10 or store.recent(session_id, 1)[0]["user"] != "prompt 9":
+            fail("Resuming a run should drop the turns it recorded after its checkpoint")
+        if budgets.get(budget_key("prompt 9", session_id)) != 1 or budgets.get(budget_key("prompt 12", session_id)) != 0:
+            fail("Resuming a run should reset the requery budgets of the prompts it redoes")
+        budgets.close()
+        store.close()
+    finally:
+        run_batch.CONFIG = saved_config
+
+# Pipeline runs on the deterministic FakeLLM
+from models.fake_llm import FakeLLM
+from pipeline.config import load_config
+from pipeline.logger import get_logger
+from pipeline.runner import Pipeline, run_fanout
+
+def pipeline_config(tmp, **overrides):
+    return dict(
+        load_config(), log_file=os.path.join(tmp, "log.jsonl"), history_file=os.path.join(tmp, "history.jsonl"),
+        history_store={"backend": "sqlite", "path": os.path.join(tmp, "history.sqlite")},
+        budget_store={"backend": "memory"}, streaming=False, parallel_candidates=False, **overrides,
+    )
+
+pipeline_prompts = [f"prompt {i}" for i in range(40)]
+pipeline_wrappers = ["baseline", "keyword", "history", "query_budget"]
+
+with tempfile.TemporaryDirectory() as tmp:
+    config = pipeline_config(tmp)
+    llm = FakeLLM(banned_rate=0.3, banned_keywords=config["banned_keywords"])
+    sequential = {}
+    for wrapper in pipeline_wrappers:
+        with Pipeline(wrapper, llm, config=config, session_id=f"seq-{wrapper}") as pipeline:
+            sequential[wrapper] = [pipeline.run(p) for p in pipeline_prompts]
+    pipelines = {w: Pipeline(w, llm, config=config, session_id=f"fan-{w}") for w in pipeline_wrappers}
+    fanout = {w: [] for w in pipeline_wrappers}
+    for p in pipeline_prompts:
+        for wrapper, outcome in run_fanout(p, pipelines).items():
+            fanout[wrapper].append(outcome)
+    for pipeline in pipelines.values():
+        pipeline.close()
+    get_logger(config["log_file"]).close()
+    if fanout != sequential:
+        fail("Fan-out should give every wrapper the same outcomes as a sequential run")
+
+with tempfile.TemporaryDirectory() as tmp:
+    config = pipeline_config(tmp)
+    llm = FakeLLM(banned_rate=0.3, banned_keywords=config["banned_keywords"])
+    for wrapper in ("keyword", "history", "query_budget"):
+        outcomes = {}
+        for stream in (False, True):
+            with Pipeline(wrapper, llm, config=config, stream=stream, session_id=f"{wrapper}-{stream}") as pipeline:
+                outcomes[stream] = [pipeline.run(p) for p in pipeline_prompts]
+        if outcomes[True] != outcomes[False]:
+            fail(f"Streaming should not change the {wrapper} wrapper's outcomes")
+    get_logger(config["log_file"]).close()
+
+with tempfile.TemporaryDirectory() as tmp:
+    config = pipeline_config(tmp)
+    llm = FakeLLM(banned_rate=0.5, banned_keywords=config["banned_keywords"])
+    outputs = {}
+    for candidates in (False, True):
+        with Pipeline("query_budget", llm, config=config, candidates=candidates, session_id=f"candidates-{candidates}") as pipeline:
+            outputs[candidates] = [pipeline.run(p)[0] for p in pipeline_prompts]
+    get_logger(config["log_file"]).close()
+    if outputs[True] != outputs[False] or all(o != config["safe_refusal"] for o in outputs[False]):
+        fail("Candidates mode should pick the same final output as the sequential requery loop")
+
+with tempfile.TemporaryDirectory() as tmp:
+    config = pipeline_config(tmp, redact_first=True, redaction={"policy": "mask", "mask_char": "*"})
+    llm = FakeLLM(banned_rate=1.0, banned_keywords=config["banned_keywords"])
+    with Pipeline("query_budget", llm, config=config, session_id="modify") as pipeline:
+        output, calls = pipeline.run("prompt 1")
+        turn = pipeline.history.recent(1)[0]
+    get_logger(config["log_file"]).close()
+    with open(config["log_file"]) as f:
+        entry = json.loads(f.read().splitlines()[-1])
+    spans = entry.get("redacted_spans") or []
+    if (entry["decisions"] != ["MODIFY"] or entry["final_output"] != output or calls != 1 or not spans
+            or turn.get("redacted_spans") != spans or turn["model"] != llm.generate("prompt 1")
+            or any(turn["model"][start:end] not in config["banned_keywords"] or set(output[start:end]) != {"*"}
+                   for start, end in spans)):
+        fail("A MODIFY decision's spans should be redacted in the output and recorded in the log and history")
+
+# Background JSONL logger survives write errors
+import contextlib
+import io
+from pipeline.logger import BufferedJSONLLogger
+
+with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stderr(io.StringIO()):
+    log_dir = os.path.join(tmp, "later")
+    with BufferedJSONLLogger(os.path.join(log_dir, "log.jsonl")) as logger:
+        errors = []
+        for entry in ({"n": 1}, {"n": object()}, {"n": 2}):
+            logger.log(entry)
+            try:
+                logger.flush()
+            except Exception as e:
+                errors.append(type(e).__name__)
+            os.makedirs(log_dir, exist_ok=True)
+        if not logger._thread.is_alive():
+            fail("The logger thread should keep running after a failed batch")
+    with open(os.path.join(log_dir, "log.jsonl")) as f:
+        logged = [json.loads(line)["n"] for line in f]
+    if errors != ["FileNotFoundError", "TypeError"] or logged != [2] or logger.dropped != 2:
+        fail("The logger should drop failed lines and raise their errors from the next flush()")
+
+# HTTP server request handling
+import asyncio
+from serving.server import WrapperServer
+
+class CollectingWriter:
+    def __init__(self):
+        self.data = b""
+    def write(self, data):
+        self.data += data
+    async def drain(self):
+        pass
+    def close(self):
+        pass
+
+async def exercise_server(server):
+    statuses = [(await server.handle_generate(body))[0] for body in (
+        b'{"prompt": 5}', b'{"prompt": "hi", "session_id": 7}', b'{"prompt": "hi", "wrapper": "nope"}',
+        b'{"prompt": "hi", "session_id": "a"}', b'{"prompt": "hi"}', b'{"prompt": "hi", "session_id": "b"}',
+    )]
+    server.in_flight = server.max_in_flight
+    statuses.append((await server.handle_generate(b'{"prompt": "hi", "session_id": "c"}'))[0])
+    server.in_flight = 0
+    responses = []
+    for request in (b"POST /generate HTTP/1.1\r\n\r\n", b"POST /generate HTTP/1.1\r\nContent-Length: x\r\n\r\n"):
+        reader, writer = asyncio.StreamReader(), CollectingWriter()
+        reader.feed_data(request)
+        reader.feed_eof()
+        await server.handle_connection(reader, writer)
+        responses.append(writer.data.split(b" ")[1])
+    sessions = set(server.batchers)
+    for task in server.batchers.values():
+        (await task).close()
+        (await task).pipeline.close()
+    server.executor.shutdown()
+    return statuses, responses, sessions
+
+with tempfile.TemporaryDirectory() as tmp:
+    config = pipeline_config(tmp)
+    server = WrapperServer(FakeLLM(banned_keywords=config["banned_keywords"]), "keyword", config=config, max_sessions=2)
+    statuses, responses, sessions = asyncio.run(exercise_server(server))
+    get_logger(config["log_file"]).close()
+    if statuses[:6] != [400, 400, 400, 200, 200, 200] or responses != [b"400", b"400"]:
+        fail("The server should reject bad prompts, session ids, wrappers and Content-Length with 400")
+    if statuses[6] != 503:
+        fail("The server should reject requests past max_in_flight with 503, whatever their session")
+    if sessions != {("keyword", None), ("keyword", "b")}:
+        fail("The server should keep one pipeline per wrapper and session_id, closing idle ones past max_sessions")
+
 print("All wrapper tests passed!")
@@ -14,4 +14,22 @@ class SafetyWrapper(ABC):
 
     @abstractmethod
     def decide(self, user_prompt: str, model_output: str, history: list):
-        pass
\ No newline at end of file
+        pass
+
+    def decide_partial(self, user_prompt: str, partial_output: str, history: list, new_from: int = 0):
+        """Judge an output that is still being generated.
+
+        ``partial_output`` is the text so far and ``new_from`` the offset where
+        the latest chunk starts. Return (decision, payload) to stop decoding
+        early, or None if the wrapper can't decide until the output is complete.
+        """
+        return None
+
+    def annotate_turn(self, user_prompt: str, model_output: str, payload: dict | None = None):
+        """Extra fields stored with the turn when it is appended to the history.
+
+        ``payload`` is the payload of the turn's final decision, so results
+        the decision already computed can be stored without recomputing
+        them, and read back from the history on later decisions.
+        """
+        return {}
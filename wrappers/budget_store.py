@@ -0,0 +1,179 @@
+"""Requery budget counters for QueryBudgetWrapper.
+
+Counters are keyed by a fixed-size digest of the prompt (optionally
+namespaced by a session id), so an entry costs the same however long the
+prompt is. Both stores forget entries that have not been touched for
+``ttl_seconds`` and evict the least recently used ones past ``max_entries``.
+
+``InMemoryBudgetStore`` is private to one process. ``SQLiteBudgetStore``
+keeps the counters in a WAL-mode SQLite file that any number of processes
+(e.g. the parallel runner's workers) can update atomically.
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+
+def budget_key(prompt, session_id=None):
+    """Digest key for ``prompt``; with ``session_id`` budgets are per session."""
+    digest = hashlib.blake2b(prompt.encode("utf-8"), digest_size=16).hexdigest()
+    return f"{session_id}:{digest}" if session_id is not None else digest
+
+
+class BudgetStore(ABC):
+    @abstractmethod
+    def increment(self, key):
+        """Count one more requery for ``key`` and return the new count."""
+
+    @abstractmethod
+    def get(self, key):
+        """Current count for ``key`` (0 if unknown or expired)."""
+
+    @abstractmethod
+    def reset(self, key):
+        pass
+
+    @abstractmethod
+    def __len__(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class InMemoryBudgetStore(BudgetStore):
+    """Process-local LRU of counters, capped at ``max_entries`` (~150 bytes each)."""
+
+    def __init__(self, max_entries=100_000, ttl_seconds=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._counts = OrderedDict()  # key -> (count, last_updated)
+
+    def _live(self, key, now):
+        entry = self._counts.get(key)
+        if entry is None:
+            return 0
+        if self.ttl_seconds is not None and now - entry[1] > self.ttl_seconds:
+            del self._counts[key]
+            return 0
+        return entry[0]
+
+    def increment(self, key):
+        now = time.monotonic()
+        with self._lock:
+            count = self._live(key, now) + 1
+            self._counts[key] = (count, now)
+            self._counts.move_to_end(key)
+            while self.max_entries and len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+            return count
+
+    def get(self, key):
+        with self._lock:
+            return self._live(key, time.monotonic())
+
+    def reset(self, key):
+        with self._lock:
+            self._counts.pop(key, None)
+
+    def __len__(self):
+        return len(self._counts)
+
+
+class SQLiteBudgetStore(BudgetStore):
+    """Counters shared across processes through one WAL-mode SQLite table.
+
+    Increments are single UPSERT statements, so concurrent workers never lose
+    an update. Expired and excess entries are purged every ``purge_every``
+    increments rather than on each write.
+    """
+
+    def __init__(self, path, max_entries=1_000_000, ttl_seconds=None, purge_every=1000):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.purge_every = purge_every
+        self._writes = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS budgets ("
+            " key TEXT PRIMARY KEY, count INTEGER NOT NULL, updated REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS budgets_updated ON budgets(updated)")
+        self._conn.commit()
+
+    def _expired_before(self, now):
+        return now - self.ttl_seconds if self.ttl_seconds is not None else float("-inf")
+
+    def increment(self, key):
+        # Wall-clock time: the timestamps are compared across processes
+        now = time.time()
+        with self._lock:
+            count = self._conn.execute(
+                "INSERT INTO budgets (key, count, updated) VALUES (?, 1, ?) "
+                "ON CONFLICT(key) DO UPDATE SET "
+                " count = CASE WHEN budgets.updated < ? THEN 1 ELSE budgets.count + 1 END,"
+                " updated = excluded.updated "
+                "RETURNING count",
+                (key, now, self._expired_before(now)),
+            ).fetchone()[0]
+            self._conn.commit()
+            self._writes += 1
+            if self.purge_every and self._writes % self.purge_every == 0:
+                self._purge(now)
+            return count
+
+    def _purge(self, now):
+        if self.ttl_seconds is not None:
+            self._conn.execute("DELETE FROM budgets WHERE updated < ?", (self._expired_before(now),))
+        if self.max_entries:
+            excess = self._conn.execute("SELECT COUNT(*) FROM budgets").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM budgets WHERE key IN "
+                    "(SELECT key FROM budgets ORDER BY updated ASC LIMIT ?)",
+                    (excess,),
+                )
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT count FROM budgets WHERE key = ? AND updated >= ?",
+                (key, self._expired_before(time.time())),
+            ).fetchone()
+            return row[0] if row else 0
+
+    def reset(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM budgets WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM budgets").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def budget_store_from_config(config):
+    """Build the store described by ``config["budget_store"]`` (default: in-memory)."""
+    options = dict(config.get("budget_store", {}))
+    backend = options.pop("backend", "memory")
+    path = options.pop("path", None)
+    if backend == "memory":
+        return InMemoryBudgetStore(**options)
+    if backend == "sqlite":
+        return SQLiteBudgetStore(path or "logs/budget_store.sqlite", **options)
+    raise ValueError(f"Unknown budget store backend: {backend!r}")
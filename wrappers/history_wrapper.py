@@ -1,25 +1,76 @@
 from wrappers.base import SafetyWrapper, WrapperDecision
+from wrappers.matcher import get_matcher
+
+# Turn metadata: banned keywords found in the turn's output, and whether the
+# turn was blocked by the window check alone (its output was not scanned)
+HITS_KEY = "keyword_hits"
+WINDOW_KEY = "window_flagged"
 
 class HistoryBasedWrapper(SafetyWrapper):
-    def __init__(self, banned_keywords=None, history_limit=3):
+    """BLOCK unsafe outputs, and any output while the conversation keeps producing them.
+
+    An output is blocked if at least ``max_flagged_turns`` of the last
+    ``history_limit`` turns contained a banned keyword (0 turns this check
+    off), or else if it contains one itself. Each decision's payload carries
+    the hits it was based on and the pipeline stores them with the turn
+    (``annotate_turn``), so a decision costs one scan of the new output plus
+    a count over K stored results rather than a rescan of K turns. Turns
+    blocked by the window check are stored as not flagged: the block lasts
+    until the flagged turns leave the window, and a streamed output can be
+    blocked before it is decoded with the same outcome as a complete one.
+    Turns stored without hits (older history, or turns appended by other
+    wrappers' pipelines) are scanned the first time they are seen and
+    annotated in place.
+    """
+
+    def __init__(self, banned_keywords=None, history_limit=3, matcher=None, max_flagged_turns=2):
         super().__init__(
             name="history_based",
-            config={"banned_keywords": banned_keywords or [], "history_limit": history_limit}
+            config={"banned_keywords": banned_keywords or [], "history_limit": history_limit,
+                    "max_flagged_turns": max_flagged_turns}
         )
+        self.matcher = matcher or get_matcher(self.config["banned_keywords"])
+
+    def recent_turns(self, history):
+        """Last ``history_limit`` turns from a history view (``recent(k)``) or a plain list."""
+        k = self.config["history_limit"]
+        if hasattr(history, "recent"):
+            return history.recent(k)
+        return list(history)[-k:] if k > 0 else []
+
+    def keyword_hits(self, text):
+        """Distinct banned keywords in ``text``, sorted."""
+        return sorted({m.keyword for m in self.matcher.find_all(text)})
+
+    def turn_hits(self, turn):
+        hits = turn.get(HITS_KEY)
+        if hits is None:
+            hits = turn[HITS_KEY] = self.keyword_hits(turn.get("model") or "")
+        return hits
+
+    def flagged_turns(self, history):
+        """How many of the last ``history_limit`` turns had a banned keyword in the output."""
+        return sum(1 for turn in self.recent_turns(history) if self.turn_hits(turn))
+
+    def _history_flagged(self, history):
+        limit = self.config["max_flagged_turns"]
+        return bool(limit) and self.flagged_turns(history) >= limit
 
     def decide(self, user_prompt, model_output, history):
-        # We only check previous turns, not the current one (which is handled by keyword wrapper usually)
-        # But for this assignment, we check if context + current output is unsafe
-        
-        # Combine last K turns
-        recent_context = history[-self.config["history_limit"]:]
-        
-        # Check if banned words appear in the model's history (repetitive unsafe behavior)
-        # or if the current output triggers a keyword
-        check_text = model_output.lower()
-        
-        for keyword in self.config["banned_keywords"]:
-            if keyword.lower() in check_text:
-                return WrapperDecision.BLOCK, None
-                
-        return WrapperDecision.ALLOW, None
\ No newline at end of file
+        if self._history_flagged(history):
+            return WrapperDecision.BLOCK, {HITS_KEY: [], WINDOW_KEY: True}
+        hits = self.keyword_hits(model_output)
+        return (WrapperDecision.BLOCK if hits else WrapperDecision.ALLOW), {HITS_KEY: hits}
+
+    def decide_partial(self, user_prompt, partial_output, history, new_from=0):
+        # A flagged window blocks whatever comes next: no need to decode past the first chunk
+        if new_from == 0 and self._history_flagged(history):
+            return WrapperDecision.BLOCK, {HITS_KEY: [], WINDOW_KEY: True}
+        if self.matcher.search_incremental(partial_output, new_from):
+            return WrapperDecision.BLOCK, {HITS_KEY: self.keyword_hits(partial_output)}
+        return None
+
+    def annotate_turn(self, user_prompt, model_output, payload=None):
+        if payload and HITS_KEY in payload:
+            return {key: payload[key] for key in (HITS_KEY, WINDOW_KEY) if key in payload}
+        return {HITS_KEY: self.keyword_hits(model_output)}
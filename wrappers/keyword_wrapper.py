@@ -1,15 +1,20 @@
 from wrappers.base import SafetyWrapper, WrapperDecision
+from wrappers.matcher import get_matcher
 
 class KeywordFilterWrapper(SafetyWrapper):
-    def __init__(self, banned_keywords=None):
+    def __init__(self, banned_keywords=None, matcher=None):
         super().__init__(
             name="keyword_filter",
             config={"banned_keywords": banned_keywords or []}
         )
+        self.matcher = matcher or get_matcher(self.config["banned_keywords"])
 
     def decide(self, user_prompt, model_output, history):
-        output_lower = model_output.lower()
-        for keyword in self.config["banned_keywords"]:
-            if keyword.lower() in output_lower:
-                return WrapperDecision.BLOCK, None
-        return WrapperDecision.ALLOW, None
\ No newline at end of file
+        if self.matcher.search(model_output):
+            return WrapperDecision.BLOCK, None
+        return WrapperDecision.ALLOW, None
+
+    def decide_partial(self, user_prompt, partial_output, history, new_from=0):
+        if self.matcher.search_incremental(partial_output, new_from):
+            return WrapperDecision.BLOCK, None
+        return None
@@ -0,0 +1,139 @@
+"""Compiled multi-keyword matcher shared by the keyword-based wrappers.
+
+The banned keyword list is folded into a trie and emitted as a single regular
+expression, so one scan of the output checks every keyword at once instead of
+running one substring search per keyword.
+"""
+
+import re
+from functools import lru_cache
+from typing import NamedTuple
+
+
+class KeywordMatch(NamedTuple):
+    start: int
+    end: int
+    keyword: str
+
+
+def _trie_pattern(node):
+    """Turn a trie (nested dicts, "" marks end of word) into a regex fragment."""
+    branches = [re.escape(ch) + _trie_pattern(child) for ch, child in sorted(node.items()) if ch != ""]
+    if not branches:
+        return ""
+    if len(branches) == 1:
+        body = branches[0]
+        if "" in node:
+            body = "(?:" + body + ")"
+    else:
+        body = "(?:" + "|".join(branches) + ")"
+    # A keyword ends here: make the continuation a greedy optional group so
+    # the longest keyword sharing this prefix wins.
+    if "" in node:
+        body += "?"
+    return body
+
+
+class KeywordMatcher:
+    """Match many keywords in one pass over the text.
+
+    Matches are leftmost-longest and non-overlapping. With ``case_insensitive``
+    the keywords and the text are compared case-folded; with ``word_boundary``
+    a keyword only matches when it is not embedded in a larger word.
+    Offsets always refer to the original text.
+    """
+
+    def __init__(self, keywords, case_insensitive=True, word_boundary=False):
+        self.case_insensitive = case_insensitive
+        self.word_boundary = word_boundary
+
+        canonical = {}
+        for keyword in keywords:
+            if not keyword:
+                continue
+            key = keyword.lower() if case_insensitive else keyword
+            canonical.setdefault(key, keyword)
+        self.keywords = tuple(canonical.values())
+        self.max_length = max((len(k) for k in canonical), default=0)
+        self._canonical = canonical
+
+        trie = {}
+        for key in canonical:
+            node = trie
+            for ch in key:
+                node = node.setdefault(ch, {})
+            node[""] = {}
+
+        body = _trie_pattern(trie) if trie else "(?!)"
+        if word_boundary:
+            body = r"(?<!\w)(?:" + body + r")(?!\w)"
+        # ``pattern`` runs on lowercased text, which is much cheaper than
+        # re.IGNORECASE; the IGNORECASE variant is only needed for the rare
+        # text whose length changes when lowercased (offsets would drift).
+        self.pattern = re.compile(body)
+        self._ignorecase_pattern = re.compile(body, re.IGNORECASE) if case_insensitive else self.pattern
+
+    def fold(self, text):
+        """Apply the matcher's case folding; ``pattern`` expects folded text."""
+        return text.lower() if self.case_insensitive else text
+
+    def _prepare(self, text):
+        folded = self.fold(text)
+        if len(folded) != len(text):
+            return self._ignorecase_pattern, text
+        return self.pattern, folded
+
+    def _to_match(self, m, text):
+        found = text[m.start():m.end()]
+        key = self.fold(found)
+        return KeywordMatch(m.start(), m.end(), self._canonical.get(key, found))
+
+    def search(self, text, pos=0):
+        """Return the first match at or after ``pos``, or None."""
+        pattern, target = self._prepare(text)
+        m = pattern.search(target, pos)
+        return self._to_match(m, text) if m else None
+
+    def find_all(self, text, pos=0):
+        """Return every non-overlapping match as a list of KeywordMatch."""
+        pattern, target = self._prepare(text)
+        return [self._to_match(m, text) for m in pattern.finditer(target, pos)]
+
+    def search_incremental(self, text, new_from):
+        """Search text that grew from ``text[:new_from]``, e.g. a streamed output.
+
+        Only the new part plus the tail a keyword could straddle is scanned, so
+        matches spanning chunk boundaries are still found. In word-boundary
+        mode a match touching the end of ``text`` is not reported yet, since the
+        next chunk could extend it into a longer word; the rescan starts far
+        enough back to report it then.
+        """
+        # A held-back match ends at new_from, so it can start max_length before it
+        m = self.search(text, max(0, new_from - self.max_length))
+        if m and self.word_boundary and m.end == len(text):
+            return None
+        return m
+
+    def contains(self, text):
+        pattern, target = self._prepare(text)
+        return pattern.search(target) is not None
+
+
+@lru_cache(maxsize=32)
+def _cached_matcher(keywords, case_insensitive, word_boundary):
+    return KeywordMatcher(keywords, case_insensitive=case_insensitive, word_boundary=word_boundary)
+
+
+def get_matcher(keywords, case_insensitive=True, word_boundary=False):
+    """Return a shared compiled matcher for this keyword list and mode."""
+    return _cached_matcher(tuple(keywords or ()), case_insensitive, word_boundary)
+
+
+def matcher_from_config(config):
+    """Build (or reuse) the matcher described by ``config["banned_keywords"]``."""
+    options = config.get("keyword_matching", {})
+    return get_matcher(
+        config.get("banned_keywords", []),
+        case_insensitive=options.get("case_insensitive", True),
+        word_boundary=options.get("word_boundary", False),
+    )
@@ -0,0 +1,202 @@
+"""Hashed n-gram risk scorer: a linear model over character and word n-grams.
+
+Texts are lowercased and turned into hashed n-gram feature indices entirely
+in NumPy. Every substring hash comes from one polynomial prefix-hash pass
+over the bytes (mod 2**64), so there is no per-n-gram Python loop. A batch of
+texts is featurized as one byte buffer and scored with one gather plus a
+``bincount`` per batch:
+
+    score(text) = bias + sum(weights[features(text)]) / sqrt(len(features(text)))
+    risk(text)  = sigmoid(score(text))
+
+Weights are a float32 ``.npy`` file (loaded memory-mapped) with a JSON sidecar
+holding the hashing parameters, bias and the decision threshold calibrated on
+harmless model outputs. Train with
+``python -m scripts.train_ngram_scorer``.
+"""
+
+import json
+from functools import lru_cache
+
+import numpy as np
+
+from wrappers.base import SafetyWrapper, WrapperDecision
+
+_P = 0x100000001B3  # odd, hence invertible mod 2**64
+_P_INV = pow(_P, -1, 2**64)
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+# Bytes that belong to a word: ASCII letters/digits, apostrophe and any non-ASCII (UTF-8) byte
+_WORD_BYTE = np.zeros(256, dtype=bool)
+for _c in b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'":
+    _WORD_BYTE[_c] = True
+_WORD_BYTE[128:] = True
+
+
+_power_tables = {}
+
+
+def _powers(base, n):
+    """base**0 .. base**n mod 2**64; tables are cached and grown by doubling."""
+    table = _power_tables.get(base)
+    if table is None or len(table) <= n:
+        size = max(n + 1, 2 * len(table) if table is not None else 4096)
+        table = np.empty(size, dtype=np.uint64)
+        table[0] = 1
+        table[1:] = np.cumprod(np.full(size - 1, base, dtype=np.uint64))
+        _power_tables[base] = table
+    return table
+
+
+class NGramHasher:
+    """Maps texts to hashed character and word n-gram indices in [0, n_features)."""
+
+    def __init__(self, n_features=2**16, char_ngrams=(2, 4), word_ngrams=(1, 2)):
+        if n_features & (n_features - 1):
+            raise ValueError("n_features must be a power of two")
+        self.n_features = n_features
+        self.char_ngrams = tuple(char_ngrams)
+        self.word_ngrams = tuple(word_ngrams)
+        self._shift = np.uint64(64 - (n_features.bit_length() - 1))
+
+    def params(self):
+        return {"n_features": self.n_features, "char_ngrams": list(self.char_ngrams),
+                "word_ngrams": list(self.word_ngrams)}
+
+    def _index(self, hashes, salt):
+        return ((hashes ^ np.uint64(salt)) * _MIX) >> self._shift
+
+    def transform(self, texts):
+        """Return (doc_ids, feature_ids) int64 arrays with one entry per n-gram of ``texts``."""
+        encoded = [t.lower().encode("utf-8") for t in texts]
+        lengths = np.fromiter((len(e) for e in encoded), dtype=np.int64, count=len(encoded))
+        # Texts are separated (and terminated) by a NUL byte that belongs to no document
+        buf = np.frombuffer(b"\0".join(encoded) + b"\0", dtype=np.uint8)
+        size = len(buf)
+        doc = np.repeat(np.arange(len(encoded), dtype=np.int64), lengths + 1)
+        doc[np.cumsum(lengths + 1) - 1] = -1
+
+        # hash(l, r) = sum(buf[j] * P**(r-1-j) for j in l..r-1) = P**(r-1) * (S[r] - S[l])
+        powers = _powers(_P, size)
+        prefix = np.zeros(size + 1, dtype=np.uint64)
+        prefix[1:] = np.cumsum(buf.astype(np.uint64) * _powers(_P_INV, size)[:size])
+
+        def span_hashes(starts, ends):
+            return powers[ends - 1] * (prefix[ends] - prefix[starts])
+
+        doc_parts, feature_parts = [], []
+        for n in range(self.char_ngrams[0], self.char_ngrams[1] + 1):
+            if size < n:
+                continue
+            starts = np.arange(size - n + 1)
+            ends = starts + n
+            keep = (doc[starts] == doc[ends - 1]) & (doc[starts] >= 0)
+            starts, ends = starts[keep], ends[keep]
+            doc_parts.append(doc[starts])
+            feature_parts.append(self._index(span_hashes(starts, ends), n))
+
+        is_word = _WORD_BYTE[buf]
+        before = np.concatenate(([False], is_word[:-1]))
+        after = np.concatenate((is_word[1:], [False]))
+        word_starts = np.flatnonzero(is_word & ~before)
+        word_ends = np.flatnonzero(is_word & ~after) + 1
+        for n in range(self.word_ngrams[0], self.word_ngrams[1] + 1):
+            if len(word_starts) < n:
+                continue
+            starts, ends = word_starts[:len(word_starts) - n + 1], word_ends[n - 1:]
+            keep = doc[starts] == doc[ends - 1]
+            starts, ends = starts[keep], ends[keep]
+            doc_parts.append(doc[starts])
+            feature_parts.append(self._index(span_hashes(starts, ends), 0x100 + n))
+
+        if not doc_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(doc_parts), np.concatenate(feature_parts).astype(np.int64)
+
+
+class NGramRiskScorer:
+    """Logistic model over an NGramHasher's features."""
+
+    def __init__(self, hasher, weights, bias=0.0, threshold=0.5):
+        self.hasher = hasher
+        self.weights = weights
+        self.bias = bias
+        self.threshold = threshold
+
+    def scores(self, texts):
+        """Raw linear scores for a batch of texts; -inf (zero risk) for texts without features, e.g. empty outputs."""
+        doc, features = self.hasher.transform(texts)
+        totals = np.bincount(doc, weights=self.weights[features], minlength=len(texts))
+        counts = np.bincount(doc, minlength=len(texts))
+        return np.where(counts > 0, totals / np.sqrt(np.maximum(counts, 1)) + self.bias, -np.inf)
+
+    def score_batch(self, texts):
+        """Risk probability in [0, 1] for each text."""
+        return 1.0 / (1.0 + np.exp(-self.scores(texts)))
+
+    def score(self, text):
+        return float(self.score_batch([text])[0])
+
+    @classmethod
+    def train(cls, texts, labels, hasher=None, epochs=300, learning_rate=2.0, l2=1e-4):
+        """Fit by full-batch gradient descent on the logistic loss (labels: 1 = risky)."""
+        hasher = hasher or NGramHasher()
+        labels = np.asarray(labels, dtype=np.float64)
+        doc, features = hasher.transform(texts)
+        scale = 1.0 / np.sqrt(np.maximum(np.bincount(doc, minlength=len(texts)), 1))
+        weights = np.zeros(hasher.n_features)
+        bias = 0.0
+        for _ in range(epochs):
+            z = np.bincount(doc, weights=weights[features], minlength=len(texts)) * scale + bias
+            error = (1.0 / (1.0 + np.exp(-z)) - labels) / len(texts)
+            grad = np.bincount(features, weights=(error * scale)[doc], minlength=hasher.n_features)
+            weights -= learning_rate * (grad + l2 * weights)
+            bias -= learning_rate * error.sum()
+        return cls(hasher, weights.astype(np.float32), float(bias))
+
+    def save(self, path, threshold=None, **metadata):
+        if threshold is not None:
+            self.threshold = threshold
+        np.save(path, np.asarray(self.weights, dtype=np.float32))
+        with open(str(path) + ".json", "w", encoding="utf-8") as f:
+            json.dump(dict(self.hasher.params(), bias=self.bias, threshold=self.threshold, **metadata), f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(str(path) + ".json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        hasher = NGramHasher(meta["n_features"], meta["char_ngrams"], meta["word_ngrams"])
+        # asarray keeps the mapping but skips np.memmap's per-indexing overhead
+        return cls(hasher, np.asarray(np.load(path, mmap_mode="r")), meta["bias"], meta.get("threshold", 0.5))
+
+
+@lru_cache(maxsize=8)
+def load_scorer(path):
+    """Shared, memory-mapped scorer per weights file."""
+    return NGramRiskScorer.load(path)
+
+
+class NGramRiskWrapper(SafetyWrapper):
+    """BLOCK outputs whose n-gram risk probability is at least ``threshold``.
+
+    ``threshold=None`` uses the one calibrated on harmless model outputs and
+    stored with the weights.
+    """
+
+    def __init__(self, weights_path="data/ngram_weights.npy", threshold=None, scorer=None):
+        scorer = scorer or load_scorer(weights_path)
+        super().__init__(
+            name="ngram",
+            config={"weights_path": weights_path, "threshold": scorer.threshold if threshold is None else threshold}
+        )
+        self.scorer = scorer
+
+    def decide(self, user_prompt, model_output, history):
+        if self.scorer.score(model_output) >= self.config["threshold"]:
+            return WrapperDecision.BLOCK, None
+        return WrapperDecision.ALLOW, None
+
+    def decide_batch(self, user_prompts, model_outputs, history):
+        """decide() for many outputs with one vectorized scoring pass."""
+        risky = self.scorer.score_batch(list(model_outputs)) >= self.config["threshold"]
+        return [(WrapperDecision.BLOCK if r else WrapperDecision.ALLOW, None) for r in risky]
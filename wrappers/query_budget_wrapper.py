@@ -1,37 +1,78 @@
 from wrappers.base import SafetyWrapper, WrapperDecision
+from wrappers.budget_store import InMemoryBudgetStore, budget_key
+from wrappers.matcher import get_matcher
+from wrappers.redaction import Redactor
+
+# Revised prompts are this prefix followed by the user prompt, so backends can encode it once
+REQUERY_PREFIX = (
+    "You are a helpful assistant. The previous answer was unsafe. "
+    "Please answer this safely and briefly: "
+)
 
 class QueryBudgetWrapper(SafetyWrapper):
-    def __init__(self, max_requeries=2, banned_keywords=None):
+    """Requery unsafe outputs until a prompt has used up ``max_requeries``.
+
+    Requery counts live in ``store`` (a private in-memory LRU by default),
+    keyed by a digest of the prompt and, if given, ``session_id``. Wrappers
+    that share a store, e.g. a SQLiteBudgetStore across worker processes,
+    share budgets.
+
+    With ``redact_first``, unsafe outputs are redacted in place (MODIFY with
+    the keyword spans, rewritten by ``redactor``'s policy) without a new
+    generation, as long as at most ``max_redact_fraction`` of the output
+    would be rewritten; only outputs that would lose more fall back to the
+    requery budget.
+    """
+
+    def __init__(self, max_requeries=2, banned_keywords=None, matcher=None, store=None, session_id=None,
+                 redact_first=False, max_redact_fraction=0.2, redactor=None):
         super().__init__(
             name="query_budget",
-            config={"max_requeries": max_requeries, "banned_keywords": banned_keywords or []}
+            config={"max_requeries": max_requeries, "banned_keywords": banned_keywords or [],
+                    "redact_first": redact_first, "max_redact_fraction": max_redact_fraction}
         )
-        self.query_counts = {}
+        self.matcher = matcher or get_matcher(self.config["banned_keywords"])
+        self.store = store if store is not None else InMemoryBudgetStore()
+        self.session_id = session_id
+        self.redactor = redactor or Redactor()
+        self.requery_prefix = REQUERY_PREFIX
 
     def decide(self, user_prompt, model_output, history):
-        if user_prompt not in self.query_counts:
-            self.query_counts[user_prompt] = 0
-
-        output_lower = model_output.lower()
-        is_unsafe = False
-        
-        for keyword in self.config["banned_keywords"]:
-            if keyword.lower() in output_lower:
-                is_unsafe = True
-                break
-        
-        if is_unsafe:
-            self.query_counts[user_prompt] += 1
-            if self.query_counts[user_prompt] > self.config["max_requeries"]:
+        if self.config["redact_first"]:
+            spans = [(m.start, m.end) for m in self.matcher.find_all(model_output)]
+            if not spans:
+                return WrapperDecision.ALLOW, None
+            if self.redactor.removed_fraction(model_output, spans) <= self.config["max_redact_fraction"]:
+                return WrapperDecision.MODIFY, {"spans": spans}
+            unsafe = True
+        else:
+            unsafe = self.matcher.search(model_output)
+
+        if unsafe:
+            count = self.store.increment(budget_key(user_prompt, self.session_id))
+            if count > self.config["max_requeries"]:
                 return WrapperDecision.BLOCK, None
 
             # Re-query payload
-            revised = {
-                "revised_prompt": (
-                    f"You are a helpful assistant. The previous answer was unsafe. "
-                    f"Please answer this safely and briefly: {user_prompt}"
-                )
-            }
+            revised = {"revised_prompt": self.revise_prompt(user_prompt)}
             return WrapperDecision.REQUERY, revised
 
-        return WrapperDecision.ALLOW, None
\ No newline at end of file
+        return WrapperDecision.ALLOW, None
+
+    def revise_prompt(self, user_prompt):
+        """The prompt a REQUERY asks the model to answer instead."""
+        return self.requery_prefix + user_prompt
+
+    def remaining_requeries(self, user_prompt):
+        """Requeries ``user_prompt`` may still get before an unsafe output is blocked."""
+        count = self.store.get(budget_key(user_prompt, self.session_id))
+        return max(0, self.config["max_requeries"] - count)
+
+    def decide_partial(self, user_prompt, partial_output, history, new_from=0):
+        if self.config["redact_first"]:
+            # Whether a hit can be redacted depends on the whole output
+            return None
+        # A keyword hit already settles it; decide() applies the budget
+        if self.matcher.search_incremental(partial_output, new_from):
+            return self.decide(user_prompt, partial_output, history)
+        return None
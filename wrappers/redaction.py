@@ -0,0 +1,82 @@
+"""Span redaction behind WrapperDecision.MODIFY.
+
+A wrapper that answers MODIFY returns the offending spans of the output
+(``{"spans": [(start, end), ...]}``) and the pipeline rewrites them with the
+configured ``Redactor`` instead of blocking or requerying. Policies:
+
+    mask         every character of a span becomes ``mask_char``
+    placeholder  each span is replaced by ``placeholder``
+    sentence     the sentence around each span is dropped
+
+Overlapping or adjacent regions are merged first, so every character is
+rewritten at most once. ``removed_fraction`` tells a wrapper how much of an
+output a policy would rewrite before it commits to MODIFY.
+"""
+
+import re
+
+POLICIES = ("mask", "placeholder", "sentence")
+
+_SENTENCE_END = re.compile(r"[.!?\n]")
+
+
+class Redactor:
+    def __init__(self, policy="placeholder", placeholder="[REDACTED]", mask_char="*"):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown redaction policy {policy!r}, expected one of {POLICIES}")
+        self.policy = policy
+        self.placeholder = placeholder
+        self.mask_char = mask_char
+
+    def _sentence(self, text, start, end):
+        left = max(text.rfind(ch, 0, start) for ch in ".!?\n") + 1
+        m = _SENTENCE_END.search(text, end)
+        right = m.end() if m else len(text)
+        # Take the whitespace before the next sentence along
+        while right < len(text) and text[right] in " \t":
+            right += 1
+        while left < start and text[left].isspace():
+            left += 1
+        return left, right
+
+    def regions(self, text, spans):
+        """Sorted, merged (start, end) regions the policy rewrites for ``spans``.
+
+        ``spans`` holds (start, end, ...) tuples, e.g. KeywordMatch objects.
+        """
+        bounds = sorted((span[0], span[1]) for span in spans)
+        if self.policy == "sentence":
+            bounds = sorted(self._sentence(text, start, end) for start, end in bounds)
+        merged = []
+        for start, end in bounds:
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return [(start, end) for start, end in merged]
+
+    def removed_fraction(self, text, spans):
+        """Share of ``text``'s characters the policy would rewrite."""
+        if not text:
+            return 0.0
+        return sum(end - start for start, end in self.regions(text, spans)) / len(text)
+
+    def apply(self, text, spans):
+        """``text`` with ``spans`` redacted."""
+        pieces = []
+        last = 0
+        for start, end in self.regions(text, spans):
+            pieces.append(text[last:start])
+            if self.policy == "mask":
+                pieces.append(self.mask_char * (end - start))
+            elif self.policy == "placeholder":
+                pieces.append(self.placeholder)
+            last = end
+        pieces.append(text[last:])
+        redacted = "".join(pieces)
+        return redacted.strip() if self.policy == "sentence" else redacted
+
+
+def redactor_from_config(config):
+    """The Redactor described by config ``redaction``."""
+    return Redactor(**config.get("redaction", {}))